@@ -1,3 +1,4 @@
+import hashlib
 import multiprocessing
 from functools import partial
 from multiprocessing import Pool
@@ -8,12 +9,116 @@ import numpy as np
 from .nuclitrack_tools import classifycells
 from .nuclitrack_tools import classifypixels
 from .nuclitrack_tools import extractfeats
+from .nuclitrack_tools import featuretable
 from .nuclitrack_tools import loadimages
 from .nuclitrack_tools import movieobj
+from .nuclitrack_tools import registration
 from .nuclitrack_tools import trackcells
+from .nuclitrack_tools import trackregions
+from .nuclitrack_tools import trackwindows
 from .nuclitrack_tools import segmentimages
 
-def batch_analyse(text_file, param_file, output_file, parallel_flag=False, ring_flag=False):
+def segment_features(movie, s_params, clf, ring_flag, label_files, feature_set, frame):
+
+    # Segment or load the labels of one frame and measure them, IDs are local to the frame
+
+    if label_files:
+        labels = loadimages.loadlabel(label_files[frame])
+
+    else:
+        labels = segmentimages.segment_image(movie, s_params, clf, frame)
+
+    return extractfeats.frame_job(movie, ring_flag, frame, labels, feature_set)
+
+
+def training_key(group):
+
+    # Hash of the datasets of a training group, to tell whether the classifier was trained again
+
+    key = hashlib.sha1()
+
+    for name in sorted(group):
+
+        item = group[name]
+        key.update(name.encode())
+
+        if isinstance(item, h5py.Group):
+            key.update(training_key(item).encode())
+        else:
+            key.update(np.ascontiguousarray(item[...]).tobytes())
+
+    return key.hexdigest()
+
+
+def saved_features(fov, key):
+
+    ''' Feature table of an earlier run on the same output if it finished segmentation and feature extraction with
+    the same inputs, identified by key, written through to the file. Otherwise None, and partial results are
+    removed.'''
+
+    if 'labels' in fov and 'features' in fov and fov['features'].attrs.get('extracted') == key:
+        return featuretable.FeatureTable.load(fov['features'], write_through=True)
+
+    for name in ['labels', 'features']:
+        if name in fov:
+            del fov[name]
+
+    return None
+
+
+def replace_dataset(fov, name, data):
+
+    if name in fov:
+        del fov[name]
+
+    fov.create_dataset(name, data=data)
+
+
+def print_progress(progress):
+
+    print(progress['stage'], progress['tracks'], 'tracks', 'score', round(progress['cum_score'], 2), end='\r')
+
+
+def batch_analyse(text_file, param_file, output_file, parallel_flag=False, ring_flag=False, feature_set=None,
+                  export_columns=None, track_window=None, track_overlap=20, track_regions=None, track_engine='greedy',
+                  track_gap_closing=False, track_debris=None, track_mitosis=None, track_registration=None,
+                  track_time=None, track_tol=None, track_stats=False):
+
+    ''' Segment, measure, classify and track a movie. feature_set limits the measured features to a set of names from
+    extractfeats.FEATURES, or to those used by the trained classifier if 'classifier' is given. By default all
+    features are measured. export_columns, names from featuretable.DATA_COLUMNS, adds the features the CSV should
+    export, columns that were not measured are left out of the CSV.
+
+    If track_window is given the movie is tracked in windows of that many frames overlapping by track_overlap
+    frames, tracked in parallel and joined, see trackwindows for the accuracy/speed trade-off. If track_regions,
+    (columns, rows), is given the field is instead tracked in a grid of spatial regions in parallel, see
+    trackregions.
+
+    track_engine selects the TrackCells engine, 'greedy' or 'lap', track_gap_closing closes gaps after tracking
+    instead of adding edges for them, see trackgaps, and track_debris and track_mitosis prune segments that are likely
+    debris from the edges and limit mitotic parents to likely mitoses, see TrackCells. These apply to the whole movie
+    and to every window or region alike.
+
+    If track_registration is 'movie' or 'centroids' the drift of each frame is estimated from the images or the
+    label centroids and saved as registration in the HDF5 file. Cells are tracked with the drift subtracted from
+    their positions, and the saved features keep the measured positions, see registration.
+
+    Running again with the same output file resumes an earlier run that stopped or was killed. Labels and features
+    are reused once extraction has finished with the same images, parameters and pixel training, the probabilities
+    while the cell training is unchanged, and tracking continues from the last checkpoint in tracking_checkpoint
+    while its inputs are unchanged, see trackcheckpoint. Other outputs are replaced.
+
+    track_time limits tracking to that many seconds, after which the tracks found so far are saved and running again
+    continues tracking, and optimisation stops once a sweep improves the total score by less than track_tol, see
+    TrackCells.run. Both only apply to tracking the whole movie and raise a ValueError with track_window or
+    track_regions.
+
+    With track_stats the counters and timings of tracking are saved as tracking_stats in the HDF5 file and in a JSON
+    file next to the output, see trackstats. Only tracking the whole movie records them, track_stats raises a
+    ValueError with track_window or track_regions.'''
+
+    if (track_window or track_regions) and (track_time is not None or track_tol is not None or track_stats):
+        raise ValueError('track_time, track_tol and track_stats do not apply to track_window or track_regions')
 
     print('Loading Images')
     fov = h5py.File(output_file + '.hdf5', "a")
@@ -29,88 +134,138 @@ def batch_analyse(text_file, param_file, output_file, parallel_flag=False, ring_
     if 'seg_training' in params:
         clf = classifypixels.train_clf(params['seg_training'])
 
-    if len(label_files) > 1:
-        labels = loadimages.loadlabels(label_files)
+    if export_columns is not None:
+        export_columns = [featuretable.DATA_COLUMNS.index(name) for name in export_columns]
+
+    if feature_set == 'classifier':
+        feature_set = extractfeats.required_features(training=params['training'], export_columns=export_columns)
+
+    elif feature_set is not None and export_columns is not None:
+        feature_set = set(feature_set) | extractfeats.required_features(export_columns=export_columns)
+
+    measured = None if feature_set is None else extractfeats.measured_columns(feature_set)
+
+    # Each frame is segmented and measured in one step and its labels written straight to the HDF5 file, so only
+    # the feature table grows with movie length
+
+    seg_training = training_key(params['seg_training']) if 'seg_training' in params else None
+
+    inputs = repr((file_list, label_files, s_params.tolist(), seg_training, ring_flag, measured))
+    key = hashlib.sha1(inputs.encode()).hexdigest()
+
+    features = saved_features(fov, key)
+
+    if features is not None:
+        print('Using the labels and features of the earlier run')
 
     else:
-        if parallel_flag:
 
-            print('Segmenting Cells in Parallel')
+        print('Segmenting cells and extracting features')
+
+        if len(label_files) <= 1:
+            label_files = []
+
+        labels = fov.create_dataset('labels', movie.shape, dtype='i4', chunks=(1, movie.dims[0], movie.dims[1]))
+        features = featuretable.FeatureTable(group=fov.create_group('features'), measured=measured)
+
+        job = partial(segment_features, movie, s_params, clf, ring_flag, label_files, feature_set)
+
+        if parallel_flag:
 
             cpu_count = multiprocessing.cpu_count()
             pool = Pool(cpu_count)
+            results = pool.imap(job, range(movie.frames))
+
+        else:
+            results = map(job, range(movie.frames))
+
+        for i, (temp_feat, new_label) in enumerate(results):
 
-            labels_list = pool.map(partial(segmentimages.segment_image, movie, s_params, clf), range(movie.frames))
+            print('Frames processed: ', i, end='\r')
+            labels[i, :, :] = extractfeats.add_frame(features, temp_feat, new_label)
+
+        if parallel_flag:
 
             pool.close()
             pool.join()
 
-            labels = np.zeros((movie.frames, movie.dims[0], movie.dims[1]))
+        fov['features'].attrs['extracted'] = key
+        fov.flush()
+
+    # Probabilities are saved before tracking with the training they came from, the classifier is not deterministic
+    # and a resumed run must track the same features
+
+    classified = training_key(params['training'])
 
-            for i in range(movie.frames):
-                labels[i, :, :] = labels_list[i]
+    if fov['features'].attrs.get('classified') != classified:
 
+        features = classifycells.classifycells(features, params['training'])
+        features.flush()
+
+        fov['features'].attrs['classified'] = classified
+        fov.flush()
+
+    tracking_features = features['tracking'][...]
+
+    if track_registration:
+
+        print('Registering frames')
+
+        if track_registration == 'movie':
+            offsets = registration.movie_offsets(movie)
         else:
+            offsets = registration.centroid_offsets(tracking_features, movie.frames, params['track_param'][1])
 
-            print('Segmenting Cells...')
+        replace_dataset(fov, 'registration', offsets)
+        tracking_features = registration.correct_drift(tracking_features, offsets)
 
-            labels = np.zeros((movie.frames, movie.dims[0], movie.dims[1]))
+    print('Tracking cells')
 
-            for i in range(movie.frames):
+    options = {'incremental': True, 'engine': track_engine, 'gap_closing': track_gap_closing,
+               'debris_threshold': track_debris, 'mitosis_threshold': track_mitosis}
 
-                print('Images segmented: ', i, end='\r')
-                labels[i, :, :] = segmentimages.segment_image(movie, s_params, clf, i)
+    if track_window:
 
-    print('Extracting features')
+        tracks, tracking_features, count, double = trackwindows.track_windows(
+            tracking_features, movie.frames, params['track_param'][...], window=track_window,
+            overlap=track_overlap, **options)
 
-    features = dict()
-    features['tracking'] = np.zeros((1, 13))
-    features['data'] = np.zeros((1, 22))
-    counter = 1
+    elif track_regions:
 
-    for i in range(movie.frames):
+        tracks, tracking_features, count, double = trackregions.track_regions(
+            tracking_features, movie.frames, params['track_param'][...], regions=track_regions, **options)
 
-        temp_feat, labels[i, :, :], counter = extractfeats.framefeats(movie, i, labels[i, :, :], counter, ring_flag)
-        temp_feat['tracking'][:, 1] = i
-        features['tracking'] = np.vstack((features['tracking'], temp_feat['tracking']))
-        features['data'] = np.vstack((features['data'], temp_feat['data']))
+    else:
 
-    inds = np.argsort(features['tracking'][:, 0])
-    features['tracking'] = features['tracking'][inds, :]
-    features['data'] = features['data'][inds, :]
-    features['tracking'][1:, 5] = 1.
+        tracking_object = trackcells.TrackCells(features=tracking_features,
+                                                track_param=params['track_param'][...], frames=movie.frames,
+                                                checkpoint=fov.require_group('tracking_checkpoint'),
+                                                stats=track_stats, **options)
+        finished = tracking_object.run(time_budget=track_time, tol=track_tol, report=print_progress)
 
-    features = classifycells.classifycells(features, params['training'])
+        if not finished:
+            print('Tracking stopped at the time budget, saving the tracks found so far. Run again to continue.')
 
-    tracking_object = trackcells.TrackCells(features=features['tracking'][...],
-                                            track_param=params['track_param'][...], frames=movie.frames)
+        tracks, tracking_features, count, double = tracking_object.get(keep_progress=not finished)
 
-    print('Tracking cells')
-    counter = 0
+        if track_stats:
+            tracking_object.stats.save(fov.require_group('tracking_stats'))
+            tracking_object.stats.save_json(output_file + '_tracking_stats.json')
 
-    while tracking_object.addtrack():
-        counter += 1
-        print(counter)
+    if track_registration:  # Keep the measured positions
 
-    print('Optimising tracks')
+        positions = slice(featuretable.X, featuretable.Y + 1)
+        tracking_features[:, positions] = features['tracking'][:, positions]
 
-    for i in range(2):
-        counter = 0
-        while tracking_object.optimisetrack():
-            counter += 1
-            print(counter)
+    features['tracking'][...] = tracking_features
 
     print('Saving data')
 
-    tracks, features['tracking'][...], count, double = tracking_object.get()
     tracks_stored = np.zeros(int(max(tracks[:, 4])))
 
-    features_hdf5 = fov.create_group('features')
-    features_hdf5.create_dataset("tracking", data=features['tracking'])
-    features_hdf5.create_dataset("data", data=features['data'])
-    fov.create_dataset("labels", data=labels)
-    fov.create_dataset("tracks", data=tracks)
-    fov.create_dataset("tracks_stored", data=tracks_stored)
+    features.flush()
+    replace_dataset(fov, 'tracks', tracks)
+    replace_dataset(fov, 'tracks_stored', tracks_stored)
 
     trackcells.save_csv(features, tracks, output_file + '.csv')
 
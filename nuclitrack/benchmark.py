@@ -0,0 +1,293 @@
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import h5py
+import numpy as np
+
+from .nuclitrack_tools import classifycells
+from .nuclitrack_tools import extractfeats
+from .nuclitrack_tools import featuretable
+from .nuclitrack_tools import loadimages
+from .nuclitrack_tools import movieobj
+from .nuclitrack_tools import segmentimages
+from .nuclitrack_tools import simulatemovie
+from .nuclitrack_tools import trackcells
+from .nuclitrack_tools import trackgraph
+
+''' Benchmarks of every stage of the pipeline on synthetic movies of increasing size, see simulatemovie. Each stage
+    is timed and its peak memory measured with tracemalloc, which counts numpy arrays as well as Python objects but
+    slows Python heavy stages, so timings are only comparable between runs of this suite.
+
+    Stages after segmentation use the ground truth labels, so tracking is benchmarked on the same segments whatever
+    the segmentation finds. A stage that fails is recorded with its error and the remaining stages still run.
+
+    Every size is run repeats times and each stage keeps its lowest time and peak memory, as the noise of a single
+    run is often larger than the regressions worth finding. The sizes double the segments of the movie at each step,
+    so how each stage scales can be read off the results. From xlarge on tracking takes most of the time, and the
+    full ladder takes about an hour, sizes selects a part of it.
+
+    Results are saved as JSON and compared against a baseline, the results of an earlier run. A stage regresses when
+    its time or peak memory exceeds the baseline by more than threshold, a fraction, and by more than min_time seconds
+    or min_memory MB so the noise of short stages is ignored. A stage that fails is a regression if it ran in the
+    baseline, and is listed in the summary as not compared if it failed in both.
+
+    From the tests directory, python benchmark_test.py --update-baseline saves a baseline for the machine, and
+    python benchmark_test.py compares against it, exiting with 1 on a regression.'''
+
+SIZES = [{'name': 'small', 'frames': 10, 'nuclei': 25},
+         {'name': 'medium', 'frames': 20, 'nuclei': 50},
+         {'name': 'large', 'frames': 20, 'nuclei': 150},
+         {'name': 'xlarge', 'frames': 40, 'nuclei': 150},
+         {'name': 'xxlarge', 'frames': 80, 'nuclei': 150}]
+
+STAGES = ['movie_load', 'segment_image', 'framefeats', 'classifycells', 'distance_mat', 'swaps_mat', 'addtrack',
+          'optimisetrack', 'save_csv']
+
+
+def measure(results, stage, func, *args):
+
+    ''' Run func(*args) and record its time in seconds and peak memory in MB under results[stage]. Returns the
+    result of func, or None if it raised an exception.'''
+
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    try:
+        value = func(*args)
+        results[stage] = {'time': time.perf_counter() - start, 'peak_mb': tracemalloc.get_traced_memory()[1] / 1e6}
+
+    except Exception as e:
+        value = None
+        results[stage] = {'error': repr(e)}
+
+    tracemalloc.stop()
+
+    return value
+
+
+def segment_movie(movie, s_params):
+
+    return [segmentimages.segment_image(movie, s_params, 0, i) for i in range(movie.frames)]
+
+
+def extract_features(movie, label_files):
+
+    features = featuretable.FeatureTable()
+
+    for i in range(movie.frames):
+        frame_feats, new_label = extractfeats.frame_job(movie, False, i, loadimages.loadlabel(label_files[i]))
+        extractfeats.add_frame(features, frame_feats, new_label)
+
+    return features
+
+
+def add_tracks(features, frames, track_param):
+
+    tracking_object = trackcells.TrackCells(features=features['tracking'], frames=frames, track_param=track_param,
+                                            incremental=True)
+
+    while tracking_object.addtrack():
+        pass
+
+    return tracking_object
+
+
+def optimise_tracks(tracking_object):
+
+    while tracking_object.sweeps < 2:
+        tracking_object.optimisetrack()
+
+    return tracking_object
+
+
+def save_tracks(tracking_object, features, file_name):
+
+    tracks, features['tracking'][...], count, double = tracking_object.get()
+    trackcells.save_csv(features, tracks, file_name)
+
+
+def benchmark_size(path, frames, nuclei, seed=0):
+
+    ''' Simulate a movie of frames frames starting with nuclei nuclei in the directory path and benchmark every
+    stage on it. Returns the number of segments and the results of each stage.'''
+
+    file_list, label_files = simulatemovie.write_movie(path, frames=frames, nuclei=nuclei, division_rate=0.02,
+                                                       seed=seed)[:2]
+
+    with h5py.File(os.path.join(path, 'params.hdf5'), 'r') as params:
+        s_params = params['seg_param'][...]
+        track_param = params['track_param'][...]
+        training = {'data': params['training']['data'][...], 'tracking': params['training']['tracking'][...]}
+
+    results = dict()
+
+    movie = measure(results, 'movie_load', movieobj.MovieObj, file_list)
+    measure(results, 'segment_image', segment_movie, movie, s_params)
+
+    features = measure(results, 'framefeats', extract_features, movie, label_files)
+    features = measure(results, 'classifycells', classifycells.classifycells, features, training)
+
+    tracking = np.asarray(features['tracking'], dtype=float)
+    d_mat = measure(results, 'distance_mat', trackgraph.distance_mat, tracking, frames, track_param)
+    measure(results, 'swaps_mat', trackgraph.swaps_mat, d_mat, frames)
+
+    tracking_object = measure(results, 'addtrack', add_tracks, features, frames, track_param)
+    tracking_object = measure(results, 'optimisetrack', optimise_tracks, tracking_object)
+    measure(results, 'save_csv', save_tracks, tracking_object, features, os.path.join(path, 'tracks.csv'))
+
+    return features.size - 1, results
+
+
+def best_of(runs):
+
+    # Lowest time and peak memory of each stage over repeated runs, a stage that failed in any run keeps its error
+
+    stages = dict()
+
+    for stage in runs[0]:
+
+        errors = [run[stage] for run in runs if 'error' in run[stage]]
+
+        if errors:
+            stages[stage] = errors[0]
+        else:
+            stages[stage] = {key: min(run[stage][key] for run in runs) for key in ['time', 'peak_mb']}
+
+    return stages
+
+
+def compare(results, baseline, threshold=0.25, min_time=0.05, min_memory=1.):
+
+    ''' Regressions of results against the baseline, as a list of messages. A stage that fails or is missing from the
+    results while it ran in the baseline is a regression. Stages that failed in the baseline are not compared.'''
+
+    regressions = []
+
+    for size in results['sizes']:
+
+        if size not in baseline['sizes']:
+            continue
+
+        for stage, new in results['sizes'][size]['stages'].items():
+
+            old = baseline['sizes'][size]['stages'].get(stage, {})
+
+            if 'error' in new and 'time' in old:
+                regressions.append('{:s} {:s}: failed with {:s}, {:.3f}s in the baseline'.format(
+                    size, stage, new['error'], old['time']))
+
+            for key, margin, unit in [('time', min_time, 's'), ('peak_mb', min_memory, 'MB')]:
+
+                if key in new and key in old:
+                    if new[key] > old[key] * (1 + threshold) and new[key] - old[key] > margin:
+                        regressions.append('{:s} {:s} {:s}: {:.3f}{:s} from {:.3f}{:s}'.format(
+                            size, stage, key, new[key], unit, old[key], unit))
+
+        for stage, old in baseline['sizes'][size]['stages'].items():
+            if 'time' in old and stage not in results['sizes'][size]['stages']:
+                regressions.append('{:s} {:s}: missing, {:.3f}s in the baseline'.format(size, stage, old['time']))
+
+    return regressions
+
+
+def failures(results, baseline=None):
+
+    # Stages that failed, as a list of messages, noting those that also failed in the baseline
+
+    messages = []
+
+    for size in results['sizes']:
+        for stage, new in results['sizes'][size]['stages'].items():
+
+            if 'error' in new:
+
+                message = '{:s} {:s}: failed with {:s}'.format(size, stage, new['error'])
+
+                old = dict() if baseline is None else baseline['sizes'].get(size, {}).get('stages', {}).get(stage, {})
+
+                if 'error' in old:
+                    message += ', also in the baseline so not compared'
+
+                messages.append(message)
+
+    return messages
+
+
+def run_benchmarks(output_file, baseline_file=None, sizes=None, repeats=3, threshold=0.25, min_time=0.05,
+                   min_memory=1., update_baseline=False):
+
+    ''' Benchmark every stage for each size of sizes, a list of dictionaries with name, frames and nuclei or names of
+    SIZES, by default all of SIZES, keeping the best of repeats runs. The results are saved as JSON in output_file
+    and compared against baseline_file, and failed stages are listed. Returns the list of regressions, empty if
+    none.
+
+    A missing baseline_file raises FileNotFoundError before anything is run, unless update_baseline is set, in
+    which case the results are also saved as the new baseline and not compared.'''
+
+    if sizes is None:
+        sizes = SIZES
+
+    ladder = dict((size['name'], size) for size in SIZES)
+    sizes = [ladder[size] if isinstance(size, str) else size for size in sizes]
+
+    if baseline_file is not None and not update_baseline and not os.path.exists(baseline_file):
+        raise FileNotFoundError('No benchmark baseline ' + baseline_file + ', run with update_baseline to create it')
+
+    results = {'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                               'machine': platform.machine(), 'processor': platform.processor()},
+               'repeats': repeats, 'sizes': dict()}
+
+    for size in sizes:
+
+        print('Benchmarking', size['name'])
+
+        runs = []
+
+        for i in range(repeats):
+
+            path = tempfile.mkdtemp()
+
+            try:
+                segments, stages = benchmark_size(path, size['frames'], size['nuclei'])
+                runs.append(stages)
+            finally:
+                shutil.rmtree(path)
+
+        stages = best_of(runs)
+
+        results['sizes'][size['name']] = {'frames': size['frames'], 'nuclei': size['nuclei'], 'segments': segments,
+                                          'stages': stages}
+
+        for stage in STAGES:
+            print(' ', stage, stages[stage])
+
+    with open(output_file, 'w') as f:
+        json.dump(results, f, indent=1)
+
+    regressions = []
+    baseline = None
+
+    if baseline_file is not None and update_baseline:
+
+        shutil.copyfile(output_file, baseline_file)
+        print('Saved the results as the baseline', baseline_file)
+
+    elif baseline_file is not None:
+
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, threshold, min_time, min_memory)
+
+    for failure in failures(results, baseline):
+        print('Failed:', failure)
+
+    for regression in regressions:
+        print('Regression:', regression)
+
+    return regressions
@@ -13,6 +13,7 @@ from .uiloading import LoadingUI
 from .uisegmentation import SegmentationUI, ViewSegment, BatchSegment
 from .uitraining import TrainingUI, ClassifyCells
 from ..nuclitrack_guitools import guitools
+from ..nuclitrack_tools import featuretable as ft
 
 class UserInterface(Widget):
 
@@ -42,7 +43,7 @@ class UserInterface(Widget):
         # loading bar  updates and this sets the flag to True. This appears to provide a very effective lock on
         # preventing more work being scheduled, and blocking loading bar update.
 
-        self.flags = {'segment': False, 'segment_parallel': False, 'feat': False,
+        self.flags = {'segment': False, 'segment_parallel': False, 'feat': False, 'feat_parallel': False,
                       'track': False, 'finish': False, 'cancel': False}
 
         # On each kivy frame test if work needs to be performed.
@@ -142,11 +143,23 @@ class UserInterface(Widget):
     def extract_features(self, instance):
         if instance.state == 'down':
 
-            self.change_widget(FeatureExtract(movie=self.movie, labels=self.labels[...], ring_flag=self.ring_flag))
+            self.change_widget(FeatureExtract(movie=self.movie, labels=self.labels[...], ring_flag=self.ring_flag,
+                                              parallel=self.parallel))
 
-            self.flags['feat'] = True
-            self.count_scheduled = 0
-            self.count_completed = 0
+            if self.parallel:
+                self.flags['feat_parallel'] = True
+
+            else:
+                self.flags['feat'] = True
+                self.count_scheduled = 0
+                self.count_completed = 0
+
+    # Function to schedule parallel feature extraction and then collect and save the results
+
+    def features_parallel(self, dt):
+
+        self.current_widget.parallel_features()
+        self.save_features(dt)
 
     # Collect results of feature extraction and save them to HDF5 file overwriting any previous results.
 
@@ -159,8 +172,7 @@ class UserInterface(Widget):
         if 'features' in self.fov:
             del self.fov['features']
         self.features = self.fov.create_group('features')
-        self.features.create_dataset("tracking", data=features['tracking'])
-        self.features.create_dataset("data", data=features['data'])
+        features.save(self.features)
 
         self.progression_state(6)
 
@@ -189,7 +201,8 @@ class UserInterface(Widget):
     def run_tracking(self, instance):
 
         self.change_widget(RunTracking(features=self.fov['features']['tracking'][...],
-                                          track_param=self.params['track_param'][...], frames=self.movie.frames))
+                                          track_param=self.params['track_param'][...], frames=self.movie.frames,
+                                          checkpoint=self.fov.require_group('tracking_checkpoint')))
         self.flags['track'] = True
 
     def add_tracks(self, dt):
@@ -298,7 +311,7 @@ class UserInterface(Widget):
 
             self.progression[7] = 1
 
-            cl = self.features['tracking'][:, 11:14]
+            cl = self.features['tracking'][:, ft.COLOR:]
 
             if sum(cl.flatten()) > 0:
                 state = 8
@@ -339,6 +352,10 @@ class UserInterface(Widget):
                     self.flags['segment'] = False
                     Clock.schedule_once(self.finish_segmentation)
 
+            if self.flags['feat_parallel']:
+                Clock.schedule_once(self.features_parallel, 0)
+                self.flags['feat_parallel'] = False
+
             if self.flags['feat']:
 
                 Clock.schedule_once(self.current_widget.update_bar, 0)
@@ -1,4 +1,3 @@
-import numpy as np
 from kivy.core.window import Window
 from kivy.uix.floatlayout import FloatLayout
 from kivy.uix.gridlayout import GridLayout
@@ -7,35 +6,50 @@ from kivy.uix.progressbar import ProgressBar
 from kivy.uix.widget import Widget
 
 from ..nuclitrack_tools import extractfeats
+from ..nuclitrack_tools import featuretable
 
 
 class FeatureExtract(Widget):
 
-    def __init__(self, movie,  labels, ring_flag=False, **kwargs):
+    def __init__(self, movie,  labels, ring_flag=False, parallel=False, **kwargs):
         super().__init__(**kwargs)
 
         self.ring_flag = ring_flag
         self.labels = labels
         self.movie = movie
         self.layout = FloatLayout(size=(Window.width, Window.height))
-        self.feat_message = Label(text='[b][color=000000]Extracting Features[/b][/color]', markup=True,
-                                  size_hint=(.2, .05), pos_hint={'x': .4, 'y': .65})
 
-        self.features = dict()
-        self.features['tracking'] = np.zeros([1, 13])
-        self.features['data'] = np.zeros([1, 22])
+        self.features = featuretable.FeatureTable()
 
         self.counter = 1
 
-        self.layout2 = GridLayout(rows=1, padding=2, size_hint=(.9, .1), pos_hint={'x': .05, 'y': .5})
-        self.pb = ProgressBar(max=1000, size_hint=(8., 1.), pos_hint={'x': .1, 'y': .6}, value=1000/self.movie.frames)
-        self.layout2.add_widget(self.pb)
+        if parallel:
 
-        with self.canvas:
+            # Frames are measured in a process pool so no loading bar is shown
 
-            self.add_widget(self.layout)
-            self.layout.add_widget(self.feat_message)
-            self.layout.add_widget(self.layout2)
+            self.feat_message = Label(text='[b][color=000000]Parallel Processing'
+                                           '\n   No Loading Bar[/b][/color]', markup=True,
+                                      size_hint=(.2, .05), pos_hint={'x': .4, 'y': .65})
+            with self.canvas:
+
+                self.add_widget(self.layout)
+                self.layout.add_widget(self.feat_message)
+
+        else:
+
+            self.feat_message = Label(text='[b][color=000000]Extracting Features[/b][/color]', markup=True,
+                                      size_hint=(.2, .05), pos_hint={'x': .4, 'y': .65})
+
+            self.layout2 = GridLayout(rows=1, padding=2, size_hint=(.9, .1), pos_hint={'x': .05, 'y': .5})
+            self.pb = ProgressBar(max=1000, size_hint=(8., 1.), pos_hint={'x': .1, 'y': .6},
+                                  value=1000/self.movie.frames)
+            self.layout2.add_widget(self.pb)
+
+            with self.canvas:
+
+                self.add_widget(self.layout)
+                self.layout.add_widget(self.feat_message)
+                self.layout.add_widget(self.layout2)
 
     def update_bar(self, dt):
         self.pb.value += 1000 / self.movie.frames
@@ -44,19 +58,17 @@ class FeatureExtract(Widget):
 
         features_temp, new_labels, self.counter = extractfeats.framefeats(self.movie, frame, self.labels[frame, :, :],
                                                                           self.counter, ring_flag=self.ring_flag)
-        features_temp['tracking'][:, 1] = frame
 
-        self.features['tracking'] = np.vstack((self.features['tracking'], features_temp['tracking']))
-        self.features['data'] = np.vstack((self.features['data'], features_temp['data']))
+        self.features.append(features_temp['tracking'], features_temp['data'])
         self.labels[frame, :, :] = new_labels
 
+    def parallel_features(self):
+
+        self.features, self.labels = extractfeats.parallel_features(self.movie, self.labels, self.ring_flag)
+
     def get(self):
 
         self.feat_message.text = '[b][color=000000]Features Extracted[/b][/color]'
-        inds = np.argsort(self.features['tracking'][:, 0])
-        self.features['tracking'] = self.features['tracking'][inds, :]
-        self.features['data'] = self.features['data'][inds, :]
-        self.features['tracking'][1:, 5] = 1.
 
         return [self.features, self.labels]
 
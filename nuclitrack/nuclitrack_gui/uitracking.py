@@ -16,15 +16,18 @@ from ..nuclitrack_guitools import guitools
 from ..nuclitrack_guitools.graph import Graph, SmoothLinePlot
 from ..nuclitrack_guitools.imagewidget import ImDisplay, IndexedDisplay
 from ..nuclitrack_tools import extractfeats
+from ..nuclitrack_tools import featuretable as ft
 from ..nuclitrack_tools import trackcells
+from ..nuclitrack_tools import trackstore
 
 class RunTracking(Widget):
 
-    def __init__(self, features, track_param, frames, **kwargs):
+    def __init__(self, features, track_param, frames, checkpoint=None, **kwargs):
 
         super().__init__(**kwargs)
 
-        self.tracking_object = trackcells.TrackCells(features=features, track_param=track_param, frames=frames)
+        self.tracking_object = trackcells.TrackCells(features=features, track_param=track_param, frames=frames,
+                                                     incremental=True, checkpoint=checkpoint)
 
         self.track_message = Label(text='[b][color=000000] Tracking cells [/b][/color]', markup=True,
                                    size_hint=(.2, .05), pos_hint={'x': .4, 'y': .65})
@@ -48,6 +51,13 @@ class RunTracking(Widget):
             self.layout.add_widget(self.track_message)
             self.layout.add_widget(self.cancel_btn)
 
+        if not self.tracking_object.adding:  # Resumed from a checkpoint after all tracks were added
+
+            self.add_flag = False
+            self.sweep = min(self.tracking_object.sweeps, 1)
+            self.optimise_flag = self.tracking_object.sweeps < 2
+            self.update_message(self.sweep + 1)
+
     def cancel_tracking(self, instance):
 
         self.add_flag = False
@@ -255,8 +265,8 @@ class GraphTrack(Widget):
         feats = [features['data'][track_ids, ind] for ind in feat_inds]
         feats = [feat/np.max(feat) for feat in feats]
 
-        t_temp = features['tracking'][track_ids, 1]
-        events_feat = features['tracking'][track_ids, 12]
+        t_temp = features['tracking'][track_ids, ft.FRAME]
+        events_feat = features['tracking'][track_ids, ft.EVENT]
 
         points = []
 
@@ -303,7 +313,7 @@ class TrackingUI(Widget):
         super().__init__(**kwargs)
 
         self.movie = movie
-        self.tracks = tracks
+        self.tracks = trackstore.TrackStore(tracks[...])
         self.features = features
         self.labels = labels
 
@@ -317,8 +327,8 @@ class TrackingUI(Widget):
         self.store_ids = set()
 
         for i in range(len(stored_tracks)):
-            if stored_tracks[i] == 1:
-                self.store_ids = self.store_ids.union(set(self.tracks[self.tracks[:, 4] == i, 0]))
+            if stored_tracks[i] == 1 and i in self.tracks:
+                self.store_ids = self.store_ids.union(set(self.tracks.get(i)[:, 0]))
 
         self.store_layout = FloatLayout(size=(Window.width, Window.height))
 
@@ -334,15 +344,14 @@ class TrackingUI(Widget):
         self.channel = 0
         self.mov_disp.create_im(self.movie.read_im(self.channel, self.current_frame), 'PastelHeat')
 
-        inds = self.features['tracking'][:, 1]
-        mask = np.equal(inds, 0)
+        # Rows of each frame are read using the frame index rather than masking the whole table
 
-        if any(mask):
-            self.frame_feats = self.features['tracking'][mask, :]
+        self.frame_index = ft.frame_index(self.features)
+        self.frame_feats = self.features['tracking'][self.frame_index[0]:self.frame_index[1], :]
 
         im_temp = self.labels[0, :, :]
 
-        mapping = self.features['tracking'][:, 11].astype(int)
+        mapping = self.features['tracking'][:, ft.COLOR].astype(int)
         self.track_disp.create_im(im_temp, 'Random', mapping)
 
         self.frame_slider = guitools.FrameSlider(self.movie.frames, self.change_frame,
@@ -392,7 +401,10 @@ class TrackingUI(Widget):
 
         self.layout4 = layout4
 
-        self.show_feat = [0, 1, 2]
+        # Graph features are numbered among the measured data columns
+
+        self.measured = ft.measured_columns(self.features) or list(range(len(ft.DATA_COLUMNS)))
+        self.show_feat = [self.measured[min(i, len(self.measured) - 1)] for i in range(3)]
 
         self.graph = GraphTrack(self.movie.frames, size_hint=(.87, .32), pos_hint={'x': .12, 'y': .12})
 
@@ -439,8 +451,7 @@ class TrackingUI(Widget):
         self.channel_choice.bind(on_select=lambda instance, x: setattr(self.main_button, 'text', x))
         self.graph_buttons.add_widget(self.main_button)
 
-        mask = self.tracks[:, 0] == self.tracks[0, 0]  # Test if selection is in track array and identify it
-        self.track_ind = self.tracks[mask, 4]  # Set the selected track index
+        self.track_ind = np.asarray(self.tracks.track_ids(tracks[0, 0]), dtype=float)  # Set the selected track index
 
         with self.canvas:
 
@@ -504,14 +515,13 @@ class TrackingUI(Widget):
         im_temp = self.labels[int(val), :, :]
         self.frame_slider.frame_slider.value = val
 
-        mapping = self.features['tracking'][:, 11].astype(int)
+        mapping = self.features['tracking'][:, ft.COLOR].astype(int)
         self.track_disp.update_im(im_temp.astype(float), mapping)
 
         self.mov_disp.update_im(self.movie.read_im(self.channel, self.current_frame))
 
-        inds = self.features['tracking'][:, 1]
-        mask = inds == self.current_frame
-        self.frame_feats = self.features['tracking'][mask, :]
+        self.frame_feats = self.features['tracking'][self.frame_index[self.current_frame]:
+                                                     self.frame_index[self.current_frame + 1], :]
 
         self.track_frame_update()
 
@@ -519,33 +529,31 @@ class TrackingUI(Widget):
 
     def clear_events(self, instance):
 
-        mask2 = self.tracks[:, 4] == self.track_ind[0]
-        self.track_ids = self.tracks[mask2, 0].astype(int)
-        self.features['tracking'][self.track_ids, 12] = 0
+        self.track_ids = self.tracks.segments(self.track_ind[0])
+        self.features['tracking'][self.track_ids, ft.EVENT] = 0
 
         self.modify_update()
 
     def add_event(self, xpos, val):
 
         frame = np.round(self.movie.frames*xpos)
-        mask2 = self.tracks[:, 4] == self.track_ind[0]
-        self.track_ids = self.tracks[mask2, 0].astype(int)
+        self.track_ids = self.tracks.segments(self.track_ind[0])
 
-        time_points = self.features['tracking'][self.track_ids, 1]
+        time_points = self.features['tracking'][self.track_ids, ft.FRAME]
         event_ind = np.argmin(np.abs(time_points - frame))
         event_ind = self.track_ids[event_ind]
 
         if val == 1:
             self.event_flag1.state = 'normal'
-            self.features['tracking'][event_ind, 12] = 1
+            self.features['tracking'][event_ind, ft.EVENT] = 1
 
         if val == 2:
             self.event_flag2.state = 'normal'
-            self.features['tracking'][event_ind, 12] = 2
+            self.features['tracking'][event_ind, ft.EVENT] = 2
 
         if val == 3:
             self.event_flag3.state = 'normal'
-            self.features['tracking'][event_ind, 12] = 3
+            self.features['tracking'][event_ind, ft.EVENT] = 3
 
         self.modify_update()
 
@@ -553,16 +561,15 @@ class TrackingUI(Widget):
 
         im_temp = self.labels[self.current_frame, :, :]
 
-        mapping = self.features['tracking'][:, 11].astype(int)
+        mapping = self.features['tracking'][:, ft.COLOR].astype(int)
         self.track_disp.update_im(im_temp.astype(float), mapping)
 
         self.canvas.ask_update()
 
-        mask2 = self.tracks[:, 4] == self.track_ind[0]
-        self.track_ids = self.tracks[mask2, 0].astype(int)
+        self.track_ids = self.tracks.segments(self.track_ind[0])
         self.track_frame_update()
 
-        self.map_ind = self.features['tracking'][self.track_ids[0], 11]
+        self.map_ind = self.features['tracking'][self.track_ids[0], ft.COLOR]
         self.graph.update_graph(self.features, self.track_ids, self.show_feat)
 
     def track_amend(self, pos, flag):
@@ -577,15 +584,15 @@ class TrackingUI(Widget):
             d = distance.cdist(self.frame_feats[:, [2, 3]], pos)  # Calculate distance from frame segments
 
             sel = self.frame_feats[np.argmin(d), :]  # Choose closest segment to mouse click
-            mask = np.equal(self.tracks[:, 0], sel[0])  # Test if selection is in track array and identify it
+            sel_tracks = self.tracks.track_ids(sel[0])  # Test if selection is in a track and identify it
 
             # Select Cell
 
             if flag == 1:
                 self.track_btn1.state = 'normal'
 
-                if np.any(mask) and np.min(d) < 50:
-                    self.track_ind = self.tracks[mask, 4]  # Set the selected track index
+                if sel_tracks and np.min(d) < 50:
+                    self.track_ind = np.asarray(sel_tracks, dtype=float)  # Set the selected track index
                     self.modify_update()  # Display this as cell marked with black dot
 
             # Add segment to cell track
@@ -594,45 +601,23 @@ class TrackingUI(Widget):
 
                 self.track_btn2.state = 'normal'
 
-                if not np.any(mask) and np.min(d) < 50:
-
-                    frame_ids = self.tracks[self.tracks[:, 5] == self.current_frame, :]  # Get all cell tracks in frame
+                if not sel_tracks and np.min(d) < 50:
 
-                    mask2 = np.equal(frame_ids[:, 4], self.track_ind)  # Test if selected track already has segment in frame
+                    track = self.tracks.get(self.track_ind[0])
+                    feat_id = track[track[:, 5] == self.current_frame, 0]  # Test if selected track already has segment in frame
 
-                    if np.any(mask2):
+                    if len(feat_id):
 
-                        feat_id = frame_ids[mask2, 0]  # get unique id of segment in frame
+                        self.features['tracking'][self.features['tracking'][:, ft.ID] == feat_id, ft.COLOR] = 1
+                        self.features['tracking'][self.features['tracking'][:, ft.ID] == sel[0], ft.COLOR] = self.map_ind
 
-                        self.features['tracking'][self.features['tracking'][:, 0] == feat_id, 11] = 1
-                        self.features['tracking'][self.features['tracking'][:, 0] == sel[0], 11] = self.map_ind
-
-                        self.tracks[self.tracks[:, 0] == feat_id, 0] = sel[0]
+                        self.tracks.replace_segment(feat_id[0], sel[0])
 
                     else:
 
-                        # where to insert the track
-
-                        i = 0
-
-                        while self.tracks[i, 4] != self.track_ind:
-                            i += 1
-
-                        else:
-                            while self.tracks[i, 5] < self.current_frame and i + 1 < self.tracks.shape[0]:
-                                i += 1
-
-                            if i + 1 == self.tracks.shape[0]:
-
-                                self.tracks = np.vstack(
-                                    (self.tracks, [sel[0], 0, 0, 0, self.track_ind, self.current_frame, 0, 0]))
-                                self.features['tracking'][self.features['tracking'][:, 0] == sel[0], 11] = self.map_ind
-
-                            else:
-
-                                self.tracks = np.insert(self.tracks, i,
-                                                        [sel[0], 0, 0, 0, self.track_ind, self.current_frame, 0, 0], 0)
-                                self.features['tracking'][self.features['tracking'][:, 0] == sel[0], 11] = self.map_ind
+                        self.tracks.insert_segment(self.track_ind[0],
+                                                   [sel[0], 0, 0, 0, self.track_ind[0], self.current_frame, 0, 0])
+                        self.features['tracking'][self.features['tracking'][:, ft.ID] == sel[0], ft.COLOR] = self.map_ind
 
                     mod_flag = True
                     self.modify_update()
@@ -643,11 +628,10 @@ class TrackingUI(Widget):
 
                 self.track_btn3.state = 'normal'
 
-                if np.any(mask) and np.min(d) < 50:
-                    self.features['tracking'][self.features['tracking'][:, 0] == sel[0], 11] = 1
+                if sel_tracks and np.min(d) < 50:
+                    self.features['tracking'][self.features['tracking'][:, ft.ID] == sel[0], ft.COLOR] = 1
 
-                    ind = np.where(mask)
-                    self.tracks = np.delete(self.tracks, ind[0][0], 0)
+                    self.tracks.remove_segment(sel[0])
 
                     mod_flag = True
                     self.modify_update()
@@ -657,28 +641,23 @@ class TrackingUI(Widget):
             if flag == 4:
                 self.track_btn4.state = 'normal'
 
-                if np.any(mask) and np.min(d) < 50 and self.current_frame != 0 and self.current_frame != self.movie.frames:
+                if sel_tracks and np.min(d) < 50 and self.current_frame != 0 and self.current_frame != self.movie.frames:
 
-                    # rows of selected track proceeding frame
+                    # track to swap proceeding frame
 
-                    sel_mask = self.tracks[:, 4] == self.track_ind[0]
-                    sel_track = self.tracks[sel_mask, :]
-
-                    # rows of track to swap proceeding frame
-
-                    swap_ind = self.tracks[mask, 4]
+                    swap_ind = sel_tracks[0]
 
                     if swap_ind == self.track_ind[0]:
                         return
 
-                    swap_mask = self.tracks[:, 4] == swap_ind
+                    # rows of selected track and track to swap
 
-                    if not np.count_nonzero(swap_mask):
-                        return
+                    sel_track = np.zeros((0, 8))
 
-                    swap_track = self.tracks[swap_mask, :]
+                    if self.track_ind[0] in self.tracks:
+                        sel_track = self.tracks.remove(self.track_ind[0])
 
-                    self.tracks = self.tracks[np.logical_not(np.logical_or(sel_mask, swap_mask)), :]
+                    swap_track = self.tracks.remove(swap_ind)
 
                     # perform swap
 
@@ -722,14 +701,14 @@ class TrackingUI(Widget):
                     # update labels
 
                     if np.count_nonzero(swapped_1):
-                        self.tracks = np.vstack((self.tracks, swapped_1))
-                        map_ind1 = self.features['tracking'][int(swapped_1[0, 0]), 11]
-                        self.features['tracking'][swapped_1[:, 0].astype(int), 11] = map_ind1
+                        self.tracks.add(swapped_1)
+                        map_ind1 = self.features['tracking'][int(swapped_1[0, 0]), ft.COLOR]
+                        self.features['tracking'][swapped_1[:, 0].astype(int), ft.COLOR] = map_ind1
 
                     if np.count_nonzero(swapped_2):
-                        self.tracks = np.vstack((self.tracks, swapped_2))
-                        map_ind2 = self.features['tracking'][int(swapped_2[0, 0]), 11]
-                        self.features['tracking'][swapped_2[:, 0].astype(int), 11] = map_ind2
+                        self.tracks.add(swapped_2)
+                        map_ind2 = self.features['tracking'][int(swapped_2[0, 0]), ft.COLOR]
+                        self.features['tracking'][swapped_2[:, 0].astype(int), ft.COLOR] = map_ind2
 
                     mod_flag = True
                     self.modify_update()
@@ -740,16 +719,16 @@ class TrackingUI(Widget):
 
                 self.track_btn6.state = 'normal'
 
-                if not np.any(mask) and np.min(d) < 50:
+                if not sel_tracks and np.min(d) < 50:
 
                     # Create new track
-                    self.track_ind = np.asarray([max(self.tracks[:, 4]) + 1])
+                    self.track_ind = np.asarray([self.tracks.max_id() + 1], dtype=float)
 
                     r = 252 * np.random.rand() + 3
                     self.map_ind = r.astype(int)
 
-                    self.tracks = np.vstack((self.tracks, [sel[0], 0, 0, 0, self.track_ind, self.current_frame, 0, 0]))
-                    self.features['tracking'][self.features['tracking'][:, 0] == sel[0], 11] = r
+                    self.tracks.add(np.asarray([[sel[0], 0, 0, 0, self.track_ind[0], self.current_frame, 0, 0]]))
+                    self.features['tracking'][self.features['tracking'][:, ft.ID] == sel[0], ft.COLOR] = r
 
                     self.modify_update()
 
@@ -764,7 +743,7 @@ class TrackingUI(Widget):
 
         if mod_flag:
             del self.parent.fov['tracks']
-            self.parent.fov.create_dataset("tracks", data=self.tracks)
+            self.parent.fov.create_dataset("tracks", data=self.tracks.to_array())
 
     def keyboard_closed(self):
         self.keyboard.unbind(on_key_down=self.key_print)
@@ -876,31 +855,32 @@ class TrackingUI(Widget):
 
         if self.parent.fov['tracks_stored'][int(self.track_ind)] == 0:
             self.parent.fov['tracks_stored'][int(self.track_ind)] = 1
-            self.store_ids = self.store_ids.union(set(self.tracks[self.tracks[:, 4] == self.track_ind, 0]))
+            self.store_ids = self.store_ids.union(set(self.tracks.get(self.track_ind[0])[:, 0]))
 
         else:
             self.parent.fov['tracks_stored'][int(self.track_ind)] = 0
-            self.store_ids = self.store_ids.difference(set(self.tracks[self.tracks[:, 4] == self.track_ind, 0]))
+            self.store_ids = self.store_ids.difference(set(self.tracks.get(self.track_ind[0])[:, 0]))
 
         self.modify_update()
 
     def save_csv(self, instance):
 
-        trackcells.save_csv(self.features, self.tracks, self.parent.csv_file)
+        trackcells.save_csv(self.features, self.tracks.to_array(), self.parent.csv_file)
         #trackcells.save_iscb(self.features, self.tracks, self.parent.csv_file, self.labels, self.frames) # Need to update since changes
 
     def save_sel_csv(self, instance):
 
-        trackcells.save_sel_csv(self.features, self.tracks, self.parent.fov['tracks_stored'], self.parent.sel_csv_file)
+        trackcells.save_sel_csv(self.features, self.tracks.to_array(), self.parent.fov['tracks_stored'],
+                                self.parent.sel_csv_file)
 
     def feat_change(self, flag, instance):
 
         if instance.text.isdigit():
             num = int(''.join([instance.text]))-1
 
-            if 0 <= num < self.features['data'].shape[1]:
+            if 0 <= num < len(self.measured):
 
-                self.show_feat[flag] = num
+                self.show_feat[flag] = self.measured[num]
 
             self.modify_update()
 
@@ -14,6 +14,7 @@ from scipy.spatial import distance
 
 from ..nuclitrack_guitools.imagewidget import IndexedDisplay, ImDisplay
 from ..nuclitrack_tools import classifycells
+from ..nuclitrack_tools import featuretable as ft
 from ..nuclitrack_guitools import guitools
 
 class ClassifyCells(Widget):
@@ -74,19 +75,19 @@ class TrainingUI(Widget):
         self.training['data'] = np.zeros([1, features['data'].shape[1]])
         self.training['tracking'] = np.zeros([1, features['tracking'].shape[1]])
 
-        mask = np.where(features['tracking'][:, 5] > 1)[0]
+        mask = np.where(features['tracking'][:, ft.TRAINING_CLASS] > 1)[0]
         if np.count_nonzero(mask):
 
             self.training['data'] = np.vstack((self.training['data'], features['data'][mask, :]))
             self.training['tracking'] = np.vstack((self.training['tracking'], features['tracking'][mask, :]))
             for i in range(1, self.training['tracking'].shape[0]):
-                val = features['tracking'][mask[i-1], 5]
+                val = features['tracking'][mask[i-1], ft.TRAINING_CLASS]
                 self.training['tracking'][i, int(4 + val)] = 1
 
         self.layout = FloatLayout(size=(Window.width, Window.height))
 
         im_temp = self.labels[0, :, :].astype(float)
-        mapping = self.features['tracking'][:, 5].astype(int)
+        mapping = self.features['tracking'][:, ft.TRAINING_CLASS].astype(int)
 
         self.im_disp = IndexedDisplay(size_hint=(.65, .65), pos_hint={'x': .015, 'y': .15})
         self.layout.add_widget(self.im_disp)
@@ -102,11 +103,11 @@ class TrainingUI(Widget):
 
         self.movie = movie
         self.mov_disp.create_im(self.movie.read_im(0, 0), 'PastelHeat')
-        inds = self.features['tracking'][:, 1]
 
-        mask = inds == self.current_frame
-        if np.count_nonzero(mask):
-            self.frame_inds = np.where(mask)[0]
+        self.frame_index = ft.frame_index(features)
+
+        if self.frame_index[1] > self.frame_index[0]:
+            self.frame_inds = np.arange(self.frame_index[0], self.frame_index[1])
 
         self.frame_slider = guitools.FrameSlider(self.movie.frames, self.change_frame,
                                                  size_hint=(.27, .06), pos_hint={'x': .01, 'y': .88})
@@ -171,26 +172,25 @@ class TrainingUI(Widget):
         self.current_frame = val
         im_temp = self.labels[int(val), :, :]
 
-        mapping = self.features['tracking'][:, 5].astype(int)
+        mapping = self.features['tracking'][:, ft.TRAINING_CLASS].astype(int)
         self.im_disp.update_im(im_temp, mapping)
         self.label_disp.update_im(np.mod(im_temp, 64))
 
         self.mov_disp.update_im(self.movie.read_im(0, self.current_frame))
 
-        inds = self.features['tracking'][:, 1]
+        frame = int(self.current_frame)
 
-        mask = inds == self.current_frame
-        if np.count_nonzero(mask):
-            self.frame_inds = np.where(mask)[0]
+        if self.frame_index[frame + 1] > self.frame_index[frame]:
+            self.frame_inds = np.arange(self.frame_index[frame], self.frame_index[frame + 1])
 
     def update_training(self, pos, val):
 
         try:
             pos = np.asarray([pos[0] * self.dims[1], pos[1] * self.dims[0]])
-            d = distance.cdist(self.features['tracking'][self.frame_inds, 2:4], [pos])
+            d = distance.cdist(self.features['tracking'][self.frame_inds, ft.X:ft.Y + 1], [pos])
 
             selected_loc = self.frame_inds[np.argmin(d)]
-            selected_ind = self.features['tracking'][selected_loc, 0]
+            selected_ind = self.features['tracking'][selected_loc, ft.ID]
 
             if min(d) < 50:
 
@@ -201,21 +201,21 @@ class TrainingUI(Widget):
                     ind = np.nonzero(mask)
                     self.training['data'] = np.delete(self.training['data'], ind, 0)
                     self.training['tracking'] = np.delete(self.training['tracking'], ind, 0)
-                    self.features['tracking'][int(selected_ind), 5] = 1.
+                    self.features['tracking'][int(selected_ind), ft.TRAINING_CLASS] = 1.
 
                 else:
                     sel_data = self.features['data'][int(selected_ind), :].copy()
                     sel_tracking = self.features['tracking'][int(selected_ind), :].copy()
-                    sel_tracking[6:11] = 0
-                    sel_tracking[5 + val] = 1
+                    sel_tracking[ft.P_ZERO:ft.COLOR] = 0
+                    sel_tracking[ft.TRAINING_CLASS + val] = 1
 
                     self.training['data'] = np.vstack((self.training['data'], sel_data))
                     self.training['tracking'] = np.vstack((self.training['tracking'], sel_tracking))
 
-                    self.features['tracking'][int(selected_ind), 5] = 1.0 + val
+                    self.features['tracking'][int(selected_ind), ft.TRAINING_CLASS] = 1.0 + val
 
             im_temp = self.labels[self.current_frame, :, :]
-            mapping = self.features['tracking'][:, 5].astype(int)
+            mapping = self.features['tracking'][:, ft.TRAINING_CLASS].astype(int)
             self.im_disp.update_im(im_temp, mapping)
             self.canvas.ask_update()
 
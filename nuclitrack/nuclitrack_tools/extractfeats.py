@@ -1,13 +1,115 @@
+import multiprocessing
+from functools import partial
+from multiprocessing import Pool
+
 import numpy as np
+from scipy import ndimage
 from skimage.measure import regionprops
-from skimage.morphology import dilation
-from skimage.morphology import square
 
+from . import featuretable as ft
+
+
+''' Registry of the measurements in the data columns. Each feature lists the columns it fills, per channel features
+    give offsets within the six column block of each channel, the features it depends on and a relative cost. Entries
+    with no columns are intermediate results shared by other features. framefeats only computes the requested features
+    and their dependencies, other columns are left as zero.'''
+
+FEATURES = {'area': {'columns': [0], 'channel': False, 'requires': [], 'cost': 1},
+            'eccentricity': {'columns': [1], 'channel': False, 'requires': [], 'cost': 2},
+            'major_axis_length': {'columns': [2], 'channel': False, 'requires': [], 'cost': 2},
+            'perimeter': {'columns': [3], 'channel': False, 'requires': [], 'cost': 4},
+            'mean_intensity': {'columns': [0], 'channel': True, 'requires': [], 'cost': 1},
+            'pixels': {'columns': [], 'channel': True, 'requires': [], 'cost': 2},
+            'median_intensity': {'columns': [1], 'channel': True, 'requires': ['pixels'], 'cost': 4},
+            'std_intensity': {'columns': [2], 'channel': True, 'requires': ['pixels'], 'cost': 2},
+            'floored_mean': {'columns': [3], 'channel': True, 'requires': ['pixels', 'mean_intensity'], 'cost': 2},
+            'ring_region': {'columns': [], 'channel': False, 'requires': ['perimeter'], 'cost': 4},
+            'ring_mean': {'columns': [4], 'channel': True, 'requires': ['ring_region'], 'cost': 1},
+            'ring_median': {'columns': [5], 'channel': True, 'requires': ['ring_region'], 'cost': 3}}
+
+
+def all_features(ring_flag):
+
+    # Default feature set, ring features are only measured when requested by the ring flag
+
+    names = set(FEATURES)
+
+    if not ring_flag:
+        names -= {'ring_region', 'ring_mean', 'ring_median'}
+
+    return names
+
+
+def resolve_features(names):
+
+    ''' Close a set of feature names over their dependencies.'''
+
+    resolved = set()
+    pending = list(names)
+
+    while pending:
+
+        name = pending.pop()
+
+        if name not in FEATURES:
+            raise KeyError('Unknown feature: ' + str(name))
+
+        if name not in resolved:
+            resolved.add(name)
+            pending.extend(FEATURES[name]['requires'])
+
+    return resolved
+
+
+def feature_columns(name):
+
+    # Data columns filled by a feature across all three channels
+
+    if FEATURES[name]['channel']:
+        return [k*6 + 4 + c for k in range(3) for c in FEATURES[name]['columns']]
 
-def framefeats(movie, frame, labels, counter, ring_flag):
+    return list(FEATURES[name]['columns'])
+
+
+def measured_columns(names):
+
+    # Data columns filled when measuring a feature set and its dependencies
+
+    return sorted(set(c for name in resolve_features(names) for c in feature_columns(name)))
+
+
+def feature_cost(names):
+
+    return sum([FEATURES[name]['cost'] for name in resolve_features(names)])
+
+
+def required_features(training=None, export_columns=None, graph_columns=None):
+
+    ''' Features needed by the downstream consumers. The classifier needs every column that was measured in its
+    training data, the CSV export and the track graph need the data columns they show.'''
+
+    columns = set()
+
+    if training is not None:
+        columns |= set(np.where(np.any(training['data'][...] != 0, axis=0))[0])
+
+    if export_columns is not None:
+        columns |= set(export_columns)
+
+    if graph_columns is not None:
+        columns |= set(graph_columns)
+
+    return resolve_features([name for name in FEATURES if columns.intersection(feature_columns(name))])
+
+
+def framefeats(movie, frame, labels, counter, ring_flag, feature_set=None):
+
+    if feature_set is None:
+        feature_set = all_features(ring_flag)
+
+    feature_set = resolve_features(feature_set)
 
     labels = labels.astype(int)
-    labels_bin = labels == 0
     features_temp = []
     ims = []
 
@@ -15,74 +117,81 @@ def framefeats(movie, frame, labels, counter, ring_flag):
 
         im = movie.read_raw(j, frame)
         features_temp.append(regionprops(labels, im))
-        if ring_flag:
+        if 'ring_region' in feature_set:
             ims.append(im)
 
     features = dict()
-    features['tracking'] = np.zeros((len(features_temp[0]), 13))
-    features['data'] = np.zeros((len(features_temp[0]), 22))
+    features['tracking'] = np.zeros((len(features_temp[0]), len(ft.TRACKING_COLUMNS)))
+    features['data'] = np.zeros((len(features_temp[0]), len(ft.DATA_COLUMNS)))
 
     new_label = np.zeros((movie.dims[0], movie.dims[1]))
 
-    for j in range(len(features_temp[0])):
+    # Ring regions for all cells are found in a single pass and measured per label
 
-        # Tracking Features
+    if 'ring_region' in feature_set and len(features_temp[0]) > 0:
 
-        cell_temp = features_temp[0][j]
-        ypos = cell_temp.centroid[0]
-        xpos = cell_temp.centroid[1]
+        label_ids = [cell.label for cell in features_temp[0]]
+        radii = np.zeros(np.max(labels) + 1, dtype=int)
 
-        features['tracking'][j, 0] = counter
-        features['tracking'][j, 2] = xpos
-        features['tracking'][j, 3] = ypos
-        features['tracking'][j, 4] = min([ypos, movie.dims[0] - ypos, xpos, movie.dims[1] - xpos])
+        for cell in features_temp[0]:
+            radii[cell.label] = int(np.round(cell.perimeter/5)) // 2
 
-        # Morphology Features
+        ring = ring_regions(labels, radii)
+        ring_stats = [ring_intensity(im, ring, label_ids) for im in ims]
 
-        features['data'][j, 0] = cell_temp.area
-        features['data'][j, 1] = cell_temp.eccentricity
-        features['data'][j, 2] = cell_temp.major_axis_length
-        features['data'][j, 3] = cell_temp.perimeter
+    for j in range(len(features_temp[0])):
 
-        # Determine region for dilation
+        # Tracking Features
 
-        if ring_flag:
-            r = int(np.round(cell_temp.perimeter/5))
+        cell_temp = features_temp[0][j]
+        ypos = cell_temp.centroid[0]
+        xpos = cell_temp.centroid[1]
 
-            bbox = cell_temp.bbox
-            bbox_dil = (np.maximum(0, bbox[0]-r), np.maximum(0, bbox[1]-r),
-                        np.minimum(movie.dims[0], bbox[2]+r-1), np.minimum(movie.dims[1], bbox[3]+r-1))
-            pad = ((bbox[0]-bbox_dil[0], bbox_dil[2]-bbox[2]), (bbox[1] - bbox_dil[1], bbox_dil[3]-bbox[3]))
+        features['tracking'][j, ft.ID] = counter
+        features['tracking'][j, ft.FRAME] = frame
+        features['tracking'][j, ft.X] = xpos
+        features['tracking'][j, ft.Y] = ypos
+        features['tracking'][j, ft.EDGE_DISTANCE] = min([ypos, movie.dims[0] - ypos, xpos, movie.dims[1] - xpos])
+        features['tracking'][j, ft.TRAINING_CLASS] = 1.
 
-            image_dil = np.pad(cell_temp.image, pad, 'constant')
-            image_dil = dilation(image_dil, square(r))
+        # Morphology Features, regionprops only evaluates the properties that are read
 
-            bin_roi = labels_bin[bbox_dil[0]:bbox_dil[2], bbox_dil[1]:bbox_dil[3]]
-            ring_region = np.logical_and(image_dil, bin_roi)
+        if 'area' in feature_set:
+            features['data'][j, 0] = cell_temp.area
+        if 'eccentricity' in feature_set:
+            features['data'][j, 1] = cell_temp.eccentricity
+        if 'major_axis_length' in feature_set:
+            features['data'][j, 2] = cell_temp.major_axis_length
+        if 'perimeter' in feature_set:
+            features['data'][j, 3] = cell_temp.perimeter
 
         # Intensity Measurements for classification
 
         for k in range(0, movie.channels):
 
             cell_temp = features_temp[k][j]
-            mu = cell_temp.mean_intensity
-            im_temp = cell_temp.intensity_image.flatten()
-            bin_temp = cell_temp.image.flatten()
-            im_temp = im_temp[bin_temp]
-
             ind = k*6 + 4
-            features['data'][j, ind] = mu
-            features['data'][j, ind+1] = np.median(im_temp)
-            features['data'][j, ind+2] = np.std(im_temp)
-            features['data'][j, ind+3] = np.std(im_temp[im_temp > mu])
 
-            if ring_flag:
+            if 'mean_intensity' in feature_set:
+                mu = cell_temp.mean_intensity
+                features['data'][j, ind] = mu
+
+            if 'pixels' in feature_set:
+                im_temp = cell_temp.intensity_image.flatten()
+                bin_temp = cell_temp.image.flatten()
+                im_temp = im_temp[bin_temp]
 
-                im_roi = ims[k][bbox_dil[0]:bbox_dil[2], bbox_dil[1]:bbox_dil[3]]
-                ring_region_vals = im_roi[ring_region].flatten()
+            if 'median_intensity' in feature_set:
+                features['data'][j, ind+1] = np.median(im_temp)
+            if 'std_intensity' in feature_set:
+                features['data'][j, ind+2] = np.std(im_temp)
+            if 'floored_mean' in feature_set:
+                features['data'][j, ind+3] = np.std(im_temp[im_temp > mu])
 
-                features['data'][j, ind+4] = np.mean(ring_region_vals)
-                features['data'][j, ind+5] = np.median(ring_region_vals)
+            if 'ring_mean' in feature_set:
+                features['data'][j, ind+4] = ring_stats[k][0][j]
+            if 'ring_median' in feature_set:
+                features['data'][j, ind+5] = ring_stats[k][1][j]
 
         new_label[labels == cell_temp.label] = counter
         counter += 1
@@ -93,16 +202,99 @@ def framefeats(movie, frame, labels, counter, ring_flag):
     return features, new_label, counter
 
 
+def frame_job(movie, ring_flag, frame, labels, feature_set=None):
+
+    # Features of a single frame with frame local IDs starting from one, used by the process pool
+
+    features, new_label, counter = framefeats(movie, frame, labels, 1, ring_flag, feature_set)
+
+    return features, new_label
+
+
+def parallel_features(movie, labels, ring_flag, group=None, feature_set=None):
+
+    ''' Extract features from all frames in parallel. Frames are measured independently with local IDs, a prefix
+    sum over the segment counts then gives each frame its offset so global IDs and labels match serial extraction.
+    If an HDF5 group is given the returned feature table is written through to it.'''
+
+    cpu_count = multiprocessing.cpu_count()
+    pool = Pool(cpu_count)
+
+    results = pool.starmap(partial(frame_job, movie, ring_flag),
+                           [(i, labels[i, :, :], feature_set) for i in range(movie.frames)])
+
+    pool.close()
+    pool.join()
+
+    measured = None if feature_set is None else measured_columns(feature_set)
+    features = ft.FeatureTable(group=group, capacity=1 + sum([result[0]['tracking'].shape[0] for result in results]),
+                               measured=measured)
+
+    for i in range(movie.frames):
+        labels[i, :, :] = add_frame(features, results[i][0], results[i][1])
+
+    return features, labels
+
+
+def add_frame(features, frame_feats, new_label):
+
+    ''' Append features measured with frame local IDs to the table. IDs and labels are offset by the number of
+    segments already in the table, so frames must be added in order. Returns the relabelled frame.'''
+
+    offset = features.size - 1
+
+    frame_feats['tracking'][:, ft.ID] += offset
+    new_label[new_label > 0] += offset
+
+    features.append(frame_feats['tracking'], frame_feats['data'])
+
+    return new_label
+
+
+def ring_regions(labels, radii):
+
+    ''' Expand every label into the background by its own radius in one pass. Each background pixel is given to
+    the nearest segment (chessboard distance, equivalent to dilation with a square) if it lies within that
+    segment's radius, so rings are clipped against other cells and shared pixels go to the closest cell.'''
+
+    dist, inds = ndimage.distance_transform_cdt(labels == 0, metric='chessboard', return_indices=True)
+    nearest = labels[inds[0], inds[1]]
+
+    ring = np.where(dist <= radii[nearest], nearest, 0)
+    ring[labels > 0] = 0
+
+    return ring
+
+
+def ring_intensity(im, ring, label_ids):
+
+    # Mean and median of ring pixels for each label, empty rings give zero
+
+    counts = ndimage.sum(np.ones(ring.shape), ring, label_ids)
+    mean_vals = np.zeros(len(label_ids))
+    median_vals = np.zeros(len(label_ids))
+
+    if np.count_nonzero(counts):
+
+        mask = counts > 0
+        present = np.asarray(label_ids)[mask]
+        mean_vals[mask] = ndimage.mean(im, ring, present)
+        median_vals[mask] = ndimage.median(im, ring, present)
+
+    return mean_vals, median_vals
+
+
 def features_labels():
 
-    return ['Area', 'Eccentricity', 'Major Axis Length', 'Perimeter', 'CH1 Mean Intensity', 'CH1 Median Intensity',
-            'CH1 StdDev Intensity', 'CH1 Floored Mean', 'CH1 Ring Region Mean', 'CH1 Ring Region Median',
-            'CH2 Mean Intensity', 'CH2 Median Intensity', 'CH2 StdDev Intensity',  'CH2 Floored Mean',
-            'CH2 Ring Region Mean', 'CH2 Ring Region Median', 'CH3 Mean Intensity', 'CH3 Median Intensity',
-            'CH3 StdDev Intensity', 'CH3 Floored Mean', 'CH3 Ring Region Mean', 'CH3 Ring Region Median']
+    return list(ft.DATA_COLUMNS)
+
+
+def bfeatures_labels(columns=None):
 
+    # CSV header of the data columns, by default all of them
 
-def bfeatures_labels():
+    if columns is not None and list(columns) != list(range(len(ft.DATA_COLUMNS))):
+        return [', '.join([ft.DATA_COLUMNS[c] for c in columns]).encode()]
 
     return [b'Area, Eccentricity, Major Axis Length, Perimeter, CH1 Mean Intensity, CH1 Median Intensity, '
             b'CH1 StdDev Intensity, CH1 Floored Mean, CH1 Ring Region Mean, CH1 Ring Region Median, '
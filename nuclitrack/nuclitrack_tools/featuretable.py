@@ -0,0 +1,217 @@
+import numpy as np
+
+''' Named columns of the feature table. Tracking columns hold positions, classifier probabilities and display state,
+    data columns hold the measurements used for classification and export. Row 0 of the table is an empty placeholder
+    so that the ID of a segment is also its row index.'''
+
+TRACKING_COLUMNS = ['id', 'frame', 'x', 'y', 'edge_distance', 'training_class', 'p_zero', 'p_one', 'p_two',
+                    'p_mitosis_entry', 'p_mitosis_exit', 'color', 'event']
+
+DATA_COLUMNS = ['Area', 'Eccentricity', 'Major Axis Length', 'Perimeter', 'CH1 Mean Intensity', 'CH1 Median Intensity',
+                'CH1 StdDev Intensity', 'CH1 Floored Mean', 'CH1 Ring Region Mean', 'CH1 Ring Region Median',
+                'CH2 Mean Intensity', 'CH2 Median Intensity', 'CH2 StdDev Intensity',  'CH2 Floored Mean',
+                'CH2 Ring Region Mean', 'CH2 Ring Region Median', 'CH3 Mean Intensity', 'CH3 Median Intensity',
+                'CH3 StdDev Intensity', 'CH3 Floored Mean', 'CH3 Ring Region Mean', 'CH3 Ring Region Median']
+
+ID = 0
+FRAME = 1
+X = 2
+Y = 3
+EDGE_DISTANCE = 4
+TRAINING_CLASS = 5
+P_ZERO = 6
+P_ONE = 7
+P_TWO = 8
+P_MITOSIS_ENTRY = 9
+P_MITOSIS_EXIT = 10
+COLOR = 11
+EVENT = 12
+
+
+class FeatureTable(object):
+
+    ''' Growable table of segment features. Rows are appended a frame at a time into preallocated arrays that double
+    in size when full, and the first row of every frame is recorded so a frame's rows can be found without masking.
+    Tracking columns are float64 so IDs and frames stay exact row indices past the 2^24 rows float32 can count,
+    data columns are float32. If an HDF5 group is given the table is also written through to resizable chunked datasets
+    in that group, tracking and data, with the frame index stored in frame_index.
+
+    The table can be indexed like the features dictionary used elsewhere, table['tracking'] and table['data']
+    return views of the filled rows. measured lists the data columns that were measured, by default all of them,
+    other columns are zero and are left out of exports and graphs.'''
+
+    def __init__(self, group=None, capacity=1024, chunk_rows=4096, measured=None):
+
+        self.tracking_columns = TRACKING_COLUMNS
+        self.data_columns = DATA_COLUMNS
+        self.measured = list(range(len(DATA_COLUMNS))) if measured is None else sorted(measured)
+
+        capacity = max(capacity, 1)
+
+        self._tracking = np.zeros((capacity, len(self.tracking_columns)), dtype=np.float64)
+        self._data = np.zeros((capacity, len(self.data_columns)), dtype=np.float32)
+        self.size = 1
+
+        self.frame_index = [1]
+        self.group = group
+
+        if group is not None:
+
+            group.create_dataset('tracking', (1, len(self.tracking_columns)), dtype='f8',
+                                 maxshape=(None, len(self.tracking_columns)),
+                                 chunks=(chunk_rows, len(self.tracking_columns)))
+            group.create_dataset('data', (1, len(self.data_columns)), dtype='f',
+                                 maxshape=(None, len(self.data_columns)), chunks=(chunk_rows, len(self.data_columns)))
+            group.create_dataset('frame_index', data=np.asarray(self.frame_index), maxshape=(None,), chunks=True)
+
+            group.attrs['tracking_columns'] = np.asarray(self.tracking_columns, dtype='S')
+            group.attrs['data_columns'] = np.asarray(self.data_columns, dtype='S')
+            group.attrs['measured_columns'] = np.asarray(self.measured, dtype=int)
+
+    def __getitem__(self, key):
+
+        if key == 'tracking':
+            return self._tracking[:self.size, :]
+
+        if key == 'data':
+            return self._data[:self.size, :]
+
+        raise KeyError(key)
+
+    def __contains__(self, key):
+
+        return key in ['tracking', 'data']
+
+    @property
+    def frames(self):
+
+        return len(self.frame_index) - 1
+
+    def reserve(self, rows):
+
+        # Grow the backing arrays geometrically so appending n rows costs O(n) overall
+
+        if rows > self._tracking.shape[0]:
+
+            capacity = max(rows, 2 * self._tracking.shape[0])
+
+            tracking = np.zeros((capacity, self._tracking.shape[1]), dtype=np.float64)
+            data = np.zeros((capacity, self._data.shape[1]), dtype=np.float32)
+
+            tracking[:self.size, :] = self._tracking[:self.size, :]
+            data[:self.size, :] = self._data[:self.size, :]
+
+            self._tracking = tracking
+            self._data = data
+
+    def append(self, tracking, data):
+
+        ''' Add the rows of the next frame, tracking and data must have the same number of rows.'''
+
+        n = tracking.shape[0]
+        start = self.size
+
+        self.reserve(start + n)
+
+        self._tracking[start:start + n, :] = tracking
+        self._data[start:start + n, :] = data
+        self.size += n
+        self.frame_index.append(self.size)
+
+        if self.group is not None:
+
+            self.group['tracking'].resize((self.size, self._tracking.shape[1]))
+            self.group['data'].resize((self.size, self._data.shape[1]))
+            self.group['frame_index'].resize((len(self.frame_index),))
+
+            self.group['tracking'][start:self.size, :] = self._tracking[start:self.size, :]
+            self.group['data'][start:self.size, :] = self._data[start:self.size, :]
+            self.group['frame_index'][-1] = self.size
+
+        return start
+
+    def frame_rows(self, frame):
+
+        ''' Slice of the rows belonging to a frame.'''
+
+        return slice(self.frame_index[frame], self.frame_index[frame + 1])
+
+    def column(self, name):
+
+        if name in self.tracking_columns:
+            return self['tracking'][:, self.tracking_columns.index(name)]
+
+        return self['data'][:, self.data_columns.index(name)]
+
+    def flush(self):
+
+        # Write columns that have been changed in memory, eg. by classification or tracking, to the HDF5 group
+
+        if self.group is not None:
+            self.group['tracking'][...] = self['tracking']
+            self.group['data'][...] = self['data']
+
+    def save(self, group, chunk_rows=4096):
+
+        ''' Write the table to an empty HDF5 group as resizable chunked datasets.'''
+
+        chunks = min(chunk_rows, self.size)
+
+        group.create_dataset('tracking', data=self['tracking'], maxshape=(None, self._tracking.shape[1]),
+                             chunks=(chunks, self._tracking.shape[1]))
+        group.create_dataset('data', data=self['data'], maxshape=(None, self._data.shape[1]),
+                             chunks=(chunks, self._data.shape[1]))
+        group.create_dataset('frame_index', data=np.asarray(self.frame_index), maxshape=(None,), chunks=True)
+
+        group.attrs['tracking_columns'] = np.asarray(self.tracking_columns, dtype='S')
+        group.attrs['data_columns'] = np.asarray(self.data_columns, dtype='S')
+        group.attrs['measured_columns'] = np.asarray(self.measured, dtype=int)
+
+    @classmethod
+    def load(cls, group, write_through=False):
+
+        ''' Read a table from an HDF5 features group, older files without a frame index are indexed from the
+        frame column. With write_through the table flushes back to the group.'''
+
+        tracking = group['tracking'][...]
+        data = group['data'][...]
+
+        table = cls(capacity=tracking.shape[0], measured=measured_columns(group))
+        table.append(tracking[1:, :], data[1:, :])
+
+        table._tracking[0, :] = tracking[0, :]  # The placeholder row as saved, classification also fills it
+        table._data[0, :] = data[0, :]
+        table.frame_index = frame_index(group)
+
+        if write_through:
+            table.group = group
+
+        return table
+
+
+def frame_index(group):
+
+    ''' First row of every frame in an HDF5 features group, with the end of the table appended, so the rows of frame f
+    are frame_index[f]:frame_index[f+1]. Files written before the index was stored are indexed from the frame column.'''
+
+    if 'frame_index' in group:
+        return [int(i) for i in group['frame_index'][...]]
+
+    frames = group['tracking'][1:, FRAME]
+    frame_num = int(np.max(frames)) + 1 if len(frames) > 0 else 0
+
+    return [1] + [1 + int(i) for i in np.searchsorted(frames, np.arange(frame_num), side='right')]
+
+
+def measured_columns(features):
+
+    ''' Data columns measured in a feature table or HDF5 features group. Files written before this was stored had
+    every column measured.'''
+
+    if isinstance(features, FeatureTable):
+        return list(features.measured)
+
+    if hasattr(features, 'attrs') and 'measured_columns' in features.attrs:
+        return [int(c) for c in features.attrs['measured_columns']]
+
+    return list(range(len(DATA_COLUMNS)))
@@ -5,19 +5,23 @@ import os
 
 def loadlabels(file_list):
 
-    im_temp = Image.open(file_list[0])
-    im_test = np.asarray(im_temp, dtype='float')
-    dims = im_test.shape
+    dims = loadlabel(file_list[0]).shape
 
     labels = np.zeros((len(file_list), dims[0], dims[1]))
 
     for i in range(len(file_list)):
-        im_temp = Image.open(file_list[i])
-        labels[i, :, :] = np.asarray(im_temp, dtype='float')
+        labels[i, :, :] = loadlabel(file_list[i])
 
     return labels
 
 
+def loadlabel(file_name):
+
+    im_temp = Image.open(file_name)
+
+    return np.asarray(im_temp, dtype='float')
+
+
 def savefilelist(file_list, fov):
 
     # Save file list in hdf5 format, requires conversion to bytes and numpy array
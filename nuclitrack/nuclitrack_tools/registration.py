@@ -0,0 +1,159 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+from . import featuretable as ft
+
+''' Registration of frames for drift corrected tracking. The translation of every frame relative to the first is
+    estimated by phase correlation of consecutive frames of the movie, or from the label centroids, and returned as
+    offsets [frames, 2] of (x, y) in pixels, x along image columns and y along rows as in the feature table.
+
+    Subtracting the offsets from the positions of the segments before the tracking graph is built removes stage
+    drift from the movements, so the max movement distance, track_param[1], only has to cover the motion of the
+    nuclei.'''
+
+
+def phase_correlation(im1, im2, sigma=2.):
+
+    ''' Translation (x, y) of im2 relative to im1 from the peak of the normalised cross power spectrum, refined to
+    subpixel precision by a parabola through the peak and its neighbours. The spectrum is weighted by a Gaussian
+    low pass filter of sigma pixels, as normalising it otherwise gives the noise of the two frames as much weight as
+    the nuclei.'''
+
+    window = np.outer(np.hanning(im1.shape[0]), np.hanning(im1.shape[1]))
+
+    f1 = np.fft.fft2((im1 - np.mean(im1)) * window)
+    f2 = np.fft.fft2((im2 - np.mean(im2)) * window)
+
+    cross = f2 * np.conj(f1)
+    cross /= np.abs(cross) + 1e-12
+
+    if sigma:
+        ky = np.fft.fftfreq(im1.shape[0])[:, np.newaxis]
+        kx = np.fft.fftfreq(im1.shape[1])[np.newaxis, :]
+        cross *= np.exp(-2 * (np.pi * sigma) ** 2 * (kx ** 2 + ky ** 2))
+
+    corr = np.real(np.fft.ifft2(cross))
+    peak = np.unravel_index(np.argmax(corr), corr.shape)
+
+    shift = np.zeros(2)
+
+    for axis in range(2):
+
+        size = corr.shape[axis]
+
+        before = list(peak)
+        after = list(peak)
+        before[axis] = (peak[axis] - 1) % size
+        after[axis] = (peak[axis] + 1) % size
+
+        c0, c1, c2 = corr[tuple(before)], corr[peak], corr[tuple(after)]
+        denom = c0 - 2 * c1 + c2
+
+        shift[axis] = peak[axis]
+
+        if denom != 0:
+            shift[axis] += 0.5 * (c0 - c2) / denom
+
+        if shift[axis] > size / 2:  # Shifts past half the image wrap around to negative
+            shift[axis] -= size
+
+    return shift[1], shift[0]
+
+
+def movie_offsets(movie, channel=0, sigma=2.):
+
+    # Offsets of every frame of a movie by phase correlation of consecutive frames
+
+    offsets = np.zeros((movie.frames, 2))
+    im1 = movie.read_im(channel, 0)
+
+    for i in range(1, movie.frames):
+
+        im2 = movie.read_im(channel, i)
+        offsets[i, :] = offsets[i - 1, :] + phase_correlation(im1, im2, sigma)
+        im1 = im2
+
+    return offsets
+
+
+def centroid_image(points, origin, shape, bin_size):
+
+    # Histogram of positions on a grid of bin_size pixels starting at origin
+
+    image = np.zeros(shape)
+    cells = np.floor((points - origin) / bin_size).astype(int)
+
+    np.add.at(image, (cells[:, 1], cells[:, 0]), 1)
+
+    return image
+
+
+def coarse_shift(prev, cur, bin_size, sigma=1.):
+
+    ''' Translation (x, y) of the positions cur relative to prev by phase correlation of their histograms, sigma in
+    bins. The grid is padded to twice the extent of the positions so shifts up to the size of the field do not wrap
+    around.'''
+
+    points = np.vstack((prev, cur))
+    low = np.min(points, axis=0)
+    extent = np.max(points, axis=0) - low
+
+    origin = low - extent / 2 - bin_size
+    shape = tuple(int(np.ceil(2 * extent[k] / bin_size)) + 3 for k in (1, 0))
+
+    shift = phase_correlation(centroid_image(prev, origin, shape, bin_size),
+                              centroid_image(cur, origin, shape, bin_size), sigma)
+
+    return np.asarray(shift) * bin_size
+
+
+def centroid_offsets(features, frames, radius, iterations=3):
+
+    ''' Offsets of every frame from the label centroids. The translation between consecutive frames is first found
+    to within a few pixels by phase correlation of the centroid histograms, with bins of radius / 2, so drift larger
+    than radius is found. It is then refined as the median movement of segments to their nearest segment in the
+    previous frame within radius, repeating the matching with the previous frame moved by the estimate.'''
+
+    bounds = np.searchsorted(features[:, ft.FRAME], np.arange(frames + 1), side='left')
+    bounds[0] = 1  # Row 0 is the empty placeholder
+
+    offsets = np.zeros((frames, 2))
+
+    for i in range(1, frames):
+
+        prev = features[bounds[i - 1]:bounds[i], ft.X:ft.Y + 1]
+        cur = features[bounds[i]:bounds[i + 1], ft.X:ft.Y + 1]
+
+        shift = np.zeros(2)
+
+        if prev.shape[0] > 0 and cur.shape[0] > 0:
+
+            shift = coarse_shift(prev, cur, max(radius / 2., 1.))
+            tree = cKDTree(prev)
+
+            for j in range(iterations):
+
+                d, ind = tree.query(cur - shift, distance_upper_bound=radius)
+                found = np.isfinite(d)
+
+                if not np.any(found):
+                    break
+
+                shift = np.median(cur[found, :] - prev[ind[found], :], axis=0)
+
+        offsets[i, :] = offsets[i - 1, :] + shift
+
+    return offsets
+
+
+def correct_drift(features, offsets):
+
+    # Copy of the features with the offset of each frame subtracted from the positions
+
+    features = np.array(features, dtype=float)
+    frame = features[1:, ft.FRAME].astype(int)
+
+    features[1:, ft.X] -= offsets[frame, 0]
+    features[1:, ft.Y] -= offsets[frame, 1]
+
+    return features
@@ -0,0 +1,359 @@
+import os
+
+import h5py
+import numpy as np
+from PIL import Image
+from scipy import ndimage
+
+from . import extractfeats
+from . import featuretable as ft
+from . import movieobj
+
+''' Synthetic fluorescence movies of nuclei with ground truth, for testing and benchmarking every stage from a few
+    to 100k nuclei per frame without private data. Nuclei move by Brownian motion of step pixels per frame plus a
+    common drift, divide into two smaller daughters, appear and disappear at random and leave by the edges. They are
+    rendered as discs, brighter during mitosis, blurred by the optics and with Gaussian noise on a background.
+
+    The cells of each frame are an array [cells, 6], Col0 = cell ID; Col1 = x (image column); Col2 = y (row);
+    Col3 = radius; Col4 = brightness; Col5 = state, 0 for interphase, 1 in the last frame before division and 2 in
+    the first frame of a daughter. Every cell keeps its ID from appearance or division until it divides or
+    disappears. The lineage is an array [cells, 4], Col0 = cell ID; Col1 = ID of the mother or 0; Col2 & Col3 = first
+    and last frame.
+
+    write_movie saves a movie in a directory in the formats read by batch_analyse: TIFF sequences of every channel
+    with file lists, a parameter file with segmentation and tracking parameters and classifier training made from
+    the ground truth, and the ground truth labels as TIFFs with the cells and lineage in ground_truth.hdf5. The
+    file list file_list_gt.txt also lists the ground truth labels, so batch_analyse uses them in place of
+    segmentation.'''
+
+CELL_ID = 0
+CELL_X = 1
+CELL_Y = 2
+CELL_RADIUS = 3
+CELL_BRIGHTNESS = 4
+CELL_STATE = 5
+
+INTERPHASE = 0
+MITOSIS_ENTRY = 1
+MITOSIS_EXIT = 2
+
+
+def frame_dims(nuclei, radius, density):
+
+    # Square frame where nuclei of the given radius cover a fraction density of the area
+
+    side = int(np.ceil(np.sqrt(nuclei * np.pi * radius ** 2 / density)))
+
+    return side, side
+
+
+def new_cells(rng, n, dims, radius, radius_sd, first_id):
+
+    # Interphase cells at random positions
+
+    cells = np.zeros((n, 6))
+    cells[:, CELL_ID] = np.arange(first_id, first_id + n)
+    cells[:, CELL_X] = rng.uniform(0, dims[1], n)
+    cells[:, CELL_Y] = rng.uniform(0, dims[0], n)
+    cells[:, CELL_RADIUS] = np.maximum(radius + rng.normal(0, radius_sd, n), 2)
+    cells[:, CELL_BRIGHTNESS] = rng.lognormal(0, 0.2, n)
+
+    return cells
+
+
+def divide(rng, cells, first_id):
+
+    # Two daughters for each cell, either side of the mother along a random axis
+
+    n = cells.shape[0]
+    angle = rng.uniform(0, np.pi, n)
+    offset = 0.6 * cells[:, CELL_RADIUS]
+
+    daughters = np.vstack((cells, cells))
+    daughters[:n, CELL_X] += offset * np.cos(angle)
+    daughters[:n, CELL_Y] += offset * np.sin(angle)
+    daughters[n:, CELL_X] -= offset * np.cos(angle)
+    daughters[n:, CELL_Y] -= offset * np.sin(angle)
+
+    daughters[:, CELL_ID] = np.arange(first_id, first_id + 2 * n)
+    daughters[:, CELL_RADIUS] /= np.sqrt(2)
+    daughters[:, CELL_STATE] = MITOSIS_EXIT
+
+    return daughters, np.concatenate((cells[:, CELL_ID], cells[:, CELL_ID]))
+
+
+def simulate_cells(frames, nuclei, dims, radius=8., radius_sd=1., step=2., drift=(0., 0.), division_rate=0.01,
+                   appear_rate=0.005, disappear_rate=0.005, seed=0):
+
+    ''' Simulate nuclei over frames, starting with nuclei cells in a frame of dims (rows, columns). Rates are
+    probabilities per cell and frame, appear_rate is relative to the starting number of nuclei. Returns a list of
+    the cells of every frame and the lineage.'''
+
+    rng = np.random.default_rng(seed)
+
+    cells = new_cells(rng, nuclei, dims, radius, radius_sd, 1)
+    count = nuclei + 1
+    parents = []
+    movie = []
+
+    for frame in range(frames):
+
+        if frame > 0:
+
+            # Cells marked in the last frame divide, the rest move
+
+            dividing = cells[:, CELL_STATE] == MITOSIS_ENTRY
+            cells = cells[np.logical_not(dividing), :]
+            cells[:, CELL_STATE] = INTERPHASE
+
+            cells[:, CELL_X] += rng.normal(0, step, cells.shape[0]) + drift[0]
+            cells[:, CELL_Y] += rng.normal(0, step, cells.shape[0]) + drift[1]
+
+            daughters, mothers = divide(rng, movie[-1][movie[-1][:, CELL_STATE] == MITOSIS_ENTRY, :], count)
+            daughters[:, CELL_BRIGHTNESS] /= 1.5
+            parents.append(np.column_stack((daughters[:, CELL_ID], mothers)))
+            count += daughters.shape[0]
+
+            # Cells disappear at random or by leaving the frame, and new cells appear
+
+            keep = rng.random(cells.shape[0]) >= disappear_rate
+            cells = np.vstack((cells[keep, :], daughters))
+
+            inside = np.logical_and.reduce((cells[:, CELL_X] >= 0, cells[:, CELL_X] < dims[1],
+                                            cells[:, CELL_Y] >= 0, cells[:, CELL_Y] < dims[0]))
+            cells = cells[inside, :]
+
+            n = rng.poisson(appear_rate * nuclei)
+            cells = np.vstack((cells, new_cells(rng, n, dims, radius, radius_sd, count)))
+            count += n
+
+        # Cells in their last frame before division are condensed and brighter
+
+        entering = np.logical_and(cells[:, CELL_STATE] == INTERPHASE, rng.random(cells.shape[0]) < division_rate)
+        cells[entering, CELL_STATE] = MITOSIS_ENTRY
+        cells[entering, CELL_BRIGHTNESS] *= 1.5
+
+        # Daughters grow back towards the mean radius
+
+        growing = np.logical_and(cells[:, CELL_STATE] == INTERPHASE, cells[:, CELL_RADIUS] < radius)
+        cells[growing, CELL_RADIUS] = np.minimum(cells[growing, CELL_RADIUS] * 1.05, radius)
+
+        movie.append(cells.copy())
+
+    return movie, lineage(movie, parents, count)
+
+
+def lineage(movie, parents, count):
+
+    # First and last frame of every cell and its mother
+
+    ids = np.concatenate([cells[:, CELL_ID] for cells in movie]).astype(int)
+    frames = np.concatenate([np.full(movie[i].shape[0], i) for i in range(len(movie))])
+
+    first = np.full(count, len(movie))
+    last = np.full(count, -1)
+
+    np.minimum.at(first, ids, frames)
+    np.maximum.at(last, ids, frames)
+
+    mother = np.zeros(count)
+
+    if parents:
+        parents = np.vstack(parents).astype(int)
+        mother[parents[:, 0]] = parents[:, 1]
+
+    found = np.nonzero(last >= 0)[0]
+
+    return np.column_stack((found, mother[found], first[found], last[found]))
+
+
+def disc_offsets(radius):
+
+    # Row and column offsets of the pixels of a disc
+
+    r = int(np.ceil(radius))
+    dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+    inside = dx ** 2 + dy ** 2 <= radius ** 2
+
+    return dy[inside], dx[inside]
+
+
+def render_labels(cells, dims):
+
+    ''' Labels of a frame with the cell ID as value. Cells are drawn in groups of equal rounded radius, where cells
+    overlap the later cell is on top.'''
+
+    labels = np.zeros(dims, dtype=np.int32)
+    radii = np.round(cells[:, CELL_RADIUS] * 2) / 2
+
+    for radius in np.unique(radii):
+
+        group = cells[radii == radius, :]
+        dy, dx = disc_offsets(radius)
+
+        rows = np.round(group[:, CELL_Y])[:, np.newaxis].astype(int) + dy[np.newaxis, :]
+        cols = np.round(group[:, CELL_X])[:, np.newaxis].astype(int) + dx[np.newaxis, :]
+        ids = np.repeat(group[:, CELL_ID][:, np.newaxis], dy.shape[0], axis=1)
+
+        inside = np.logical_and.reduce((rows >= 0, rows < dims[0], cols >= 0, cols < dims[1]))
+        labels[rows[inside], cols[inside]] = ids[inside]
+
+    return labels
+
+
+def render_frame(rng, cells, dims, brightness=(1000.,), background=100., noise=10., blur=1.5):
+
+    ''' Labels and an image for each channel of a frame. Channel k has nuclei of brightness[k] above the
+    background, scaled by the brightness of each cell.'''
+
+    labels = render_labels(cells, dims)
+
+    # Brightness of each labelled pixel from its cell, in single precision to limit the memory of large frames
+
+    order = np.argsort(cells[:, CELL_ID])
+    cell_ids = cells[order, CELL_ID]
+    values = np.concatenate(([0.], cells[order, CELL_BRIGHTNESS])).astype(np.float32)
+
+    index = np.searchsorted(cell_ids, labels)
+    index[labels > 0] += 1
+    index[labels == 0] = 0
+
+    intensity = values[index]
+    ims = []
+
+    for level in brightness:
+
+        im = ndimage.gaussian_filter(np.float32(level) * intensity, blur) + np.float32(background)
+        im += np.float32(noise) * rng.standard_normal(dims, dtype=np.float32)
+
+        ims.append(np.clip(np.round(im), 0, 65535).astype(np.uint16))
+
+    return labels, ims
+
+
+def movie_params(radius, step, drift, channels):
+
+    # Segmentation and tracking parameters for a simulated movie
+
+    seg_param = np.zeros(18)
+    seg_param[2] = 1  # Image blur
+    seg_param[3] = 0.25  # Threshold
+    seg_param[4] = int(0.25 * np.pi * radius ** 2)  # Smallest object
+    seg_param[5] = 0.5  # Distance to intensity
+    seg_param[6] = int(radius)  # Separation distance
+    seg_param[7] = 1  # Edge blur
+    seg_param[8] = 0.5  # Watershed ratio
+    seg_param[15:15 + min(channels, 3)] = 1
+
+    search = max(5 * step + np.hypot(drift[0], drift[1]), 2 * radius)
+    track_param = np.asarray([0.05, search, 1, 5, 0, 1, 3])
+
+    return seg_param, track_param
+
+
+def training_data(movie, cells, labels, frames):
+
+    ''' Classifier training from the ground truth of the given frames, nuclei in interphase are labelled as one cell
+    and the nuclei either side of a division as mitosis entry and exit.'''
+
+    classes = {INTERPHASE: ft.P_ONE, MITOSIS_ENTRY: ft.P_MITOSIS_ENTRY, MITOSIS_EXIT: ft.P_MITOSIS_EXIT}
+
+    training = {'data': [np.zeros((1, len(ft.DATA_COLUMNS)))], 'tracking': [np.zeros((1, len(ft.TRACKING_COLUMNS)))]}
+
+    for frame in frames:
+
+        features = extractfeats.framefeats(movie, frame, labels[frame], 1, False)[0]
+
+        # Feature rows follow the order of the labels
+
+        present = np.unique(labels[frame])
+        present = present[present > 0]
+
+        state = dict(zip(cells[frame][:, CELL_ID].astype(int).tolist(), cells[frame][:, CELL_STATE].tolist()))
+
+        tracking = features['tracking']
+        tracking[:, ft.P_ZERO:ft.COLOR] = 0
+
+        for j in range(present.shape[0]):
+            tracking[j, classes[state[int(present[j])]]] = 1
+
+        training['data'].append(features['data'])
+        training['tracking'].append(tracking)
+
+    return np.vstack(training['data']), np.vstack(training['tracking'])
+
+
+def write_movie(path, frames=50, nuclei=100, dims=None, density=0.1, channels=1, radius=8., radius_sd=1., step=2.,
+                drift=(0., 0.), division_rate=0.01, appear_rate=0.005, disappear_rate=0.005, brightness=None,
+                background=100., noise=10., blur=1.5, training_frames=5, seed=0):
+
+    ''' Simulate a movie and save it in the directory path, see the module notes for the files. If dims is None the
+    frame size is chosen so nuclei cover a fraction density of the area. brightness gives the brightness of the
+    nuclei in each channel, by default 1000 in the first channel and halving with each further channel. Returns the
+    file list of the images, the ground truth labels, the cells of every frame and the lineage.'''
+
+    if dims is None:
+        dims = frame_dims(nuclei, radius, density)
+
+    if brightness is None:
+        brightness = [1000. / 2 ** k for k in range(channels)]
+
+    os.makedirs(path, exist_ok=True)
+
+    cells, cell_lineage = simulate_cells(frames, nuclei, dims, radius, radius_sd, step, drift, division_rate,
+                                         appear_rate, disappear_rate, seed)
+
+    rng = np.random.default_rng(seed + 1)
+
+    file_list = [['ch{:d}_t{:04d}.tif'.format(k + 1, i) for i in range(frames)] for k in range(channels)]
+    label_files = ['gt_t{:04d}.tif'.format(i) for i in range(frames)]
+
+    for i in range(frames):
+
+        labels, ims = render_frame(rng, cells[i], dims, brightness, background, noise, blur)
+
+        Image.fromarray(labels).save(os.path.join(path, label_files[i]))
+
+        for k in range(channels):
+            Image.fromarray(ims[k]).save(os.path.join(path, file_list[k][i]))
+
+    # File lists with channel numbers, channel 0 are labels
+
+    lines = ['{:d}, {:s}\n'.format(k + 1, name) for k in range(channels) for name in file_list[k]]
+
+    with open(os.path.join(path, 'file_list.txt'), 'w') as f:
+        f.writelines(lines)
+
+    with open(os.path.join(path, 'file_list_gt.txt'), 'w') as f:
+        f.writelines(lines + ['0, {:s}\n'.format(name) for name in label_files])
+
+    with h5py.File(os.path.join(path, 'ground_truth.hdf5'), 'w') as truth:
+
+        truth.create_dataset('cells', data=np.vstack([np.column_stack((np.full(cells[i].shape[0], i), cells[i]))
+                                                      for i in range(frames)]))
+        truth.create_dataset('lineage', data=cell_lineage)
+        truth.attrs['cells_columns'] = np.asarray(['frame', 'id', 'x', 'y', 'radius', 'brightness', 'state'],
+                                                  dtype='S')
+        truth.attrs['lineage_columns'] = np.asarray(['id', 'mother', 'first_frame', 'last_frame'], dtype='S')
+
+    # Parameters with training from the ground truth
+
+    file_list = [[os.path.join(path, name) for name in channel] for channel in file_list]
+    label_files = [os.path.join(path, name) for name in label_files]
+
+    movie = movieobj.MovieObj(file_list)
+    truth_labels = [np.asarray(Image.open(label_files[i]), dtype=float) for i in range(min(training_frames, frames))]
+
+    data, tracking = training_data(movie, cells, truth_labels, range(len(truth_labels)))
+    seg_param, track_param = movie_params(radius, step, drift, channels)
+
+    with h5py.File(os.path.join(path, 'params.hdf5'), 'w') as params:
+
+        params.create_dataset('seg_param', data=seg_param)
+        params.create_dataset('track_param', data=track_param)
+
+        training = params.create_group('training')
+        training.create_dataset('data', data=data)
+        training.create_dataset('tracking', data=tracking)
+
+    return file_list, label_files, cells, cell_lineage
@@ -1,10 +1,27 @@
-import ctooltracking
+import os
+import time
+
 import numpy as np
+from PIL import Image
+
+try:
+    import ctooltrackingnogil as ctooltracking  # Same kernels without the GIL, if built
+except ImportError:
+    import ctooltracking
 
 from . import extractfeats
+from . import featuretable as ft
+from . import trackcheckpoint
+from . import trackgaps
+from . import trackgraph
+from . import tracklap
+from . import trackscores
+from . import trackstats
+from . import trackstore
 
 ''' Create matrix tracks, Col0 = ID from feature matrix; Col1 = Score difference; Col2 = total Score;
-    Col3 = mitosis; Col4 = Track_id; Col5 = frame.
+    Col3 = mitosis; Col4 = Track_id; Col5 = frame. Tracks are held in a trackstore.TrackStore while tracking and
+    exported as the tracks matrix by get.
 
     Tracking parameters are; 0) distance penalty (smaller means
     less penalty); 1) max distance searched in previous frame; 2 & 3) weighting for adding segments based
@@ -13,27 +30,183 @@ from . import extractfeats
 
 class TrackCells(object):
 
-    def __init__(self, features, frames, track_param):
+    def __init__(self, features, frames, track_param, incremental=False, engine='greedy', gap_closing=False,
+                 debris_threshold=None, mitosis_threshold=None, checkpoint=None, checkpoint_every=100, stats=False):
+
+        ''' incremental keeps the score matrix between tracks and rescores only what the last change affects, see
+        trackscores. engine 'lap' solves all tracks at once, see tracklap, addtrack then adds one solved track per
+        call and optimisetrack has nothing to do. gap_closing builds edges between consecutive frames only and get
+        closes the gaps, see trackgaps. debris_threshold and mitosis_threshold prune likely debris from the edges and
+        limit mitotic parents by the classifier probabilities, see trackgraph. checkpoint, an HDF5 group, keeps the
+        graph and the progress so a new TrackCells resumes, see trackcheckpoint. stats records counters and timings
+        in a trackstats.TrackingStats.'''
 
-        self.features = features
+        if engine not in ('greedy', 'lap'):
+            raise ValueError('Unknown tracking engine: ' + str(engine))
+
+        self.features = np.asarray(features, dtype=float)  # Tracking kernels work in double precision
         self.track_param = track_param
 
-        self.states = np.zeros(self.features.shape[0], dtype=int)
-        self.tracks = np.zeros([1, 8])
+        self.score_features = self.features
+        self.candidates = None
+
+        if mitosis_threshold is not None:
+            self.score_features = trackgraph.mitosis_candidates(self.features, mitosis_threshold)
+            self.candidates = self.features[:, ft.P_MITOSIS_ENTRY] >= mitosis_threshold
+
+        self.states = np.zeros(self.features.shape[0], dtype=np.int_)  # Integer type of the tracking kernels
+        self.tracks = trackstore.TrackStore(np.zeros([1, 8]))
+
+        self.engine = engine
+        self.gap_closing = gap_closing
+        self.lap_tracks = None
+
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+
+        self.stats = None
+
+        if stats:
+            self.stats = trackstats.TrackingStats()
+
+        # Edge and swap matrices, from the checkpoint if they were built from the same inputs
+
+        key = trackcheckpoint.input_key(self.features, frames, track_param,
+                                        {'engine': engine, 'gap_closing': gap_closing,
+                                         'debris_threshold': debris_threshold, 'mitosis_threshold': mitosis_threshold})
+        cached = None
+
+        if checkpoint is not None:
+            cached = trackcheckpoint.load_graph(checkpoint, key)
+
+        if cached is not None:
+
+            self.d_mat, self.s_mat = cached
+
+            if self.stats is not None:
+                self.stats.set('graph_cached', 1)
+
+        else:
+
+            graph_param = track_param
+
+            if gap_closing:
+                graph_param = np.array(track_param, dtype=float)
+                graph_param[6] = min(graph_param[6], 2)  # Edges between consecutive frames only
+
+            start = time.time()
+            self.d_mat = trackgraph.distance_mat(self.features, frames, graph_param, stats=self.stats)
+            self.record_time('distance_mat', start)
+
+            if self.stats is not None:
+                self.stats.set('edges', self.d_mat.shape[0] - 1)
+
+            if debris_threshold is not None:
+                self.d_mat = trackgraph.prune_edges(self.d_mat, self.features, debris_threshold)
+
+            self.s_mat = None
+
+            if engine == 'greedy':
+
+                start = time.time()
+                self.s_mat = trackgraph.swaps_mat(self.d_mat, frames)
+                self.record_time('swaps_mat', start)
+
+            if checkpoint is not None:
+                trackcheckpoint.save_graph(checkpoint, key, self.d_mat, self.s_mat)
 
-        self.d_mat = ctooltracking.distance_mat(self.features, frames, track_param)
+        if self.stats is not None:
 
-        self.s_mat = ctooltracking.swaps_mat(self.d_mat, frames)
+            self.stats.set('segments', self.features.shape[0] - 1)
+            self.stats.set('edges_pruned', self.d_mat.shape[0] - 1)
+
+            if self.s_mat is not None:
+                self.stats.set('swap_rows', self.s_mat.shape[0] - 1)
+
+        self.edge_scores = trackgraph.edge_scores(self.d_mat)
+        self.swap_index = dict()
+
+        if self.s_mat is not None:
+            self.swap_index = trackgraph.swap_index(self.s_mat)
 
         self.cum_score = 0.
-        self.count = 5
+        self.first_count = 5
+        self.count = self.first_count
         self.optimise_count = 0
         self.min_score = 1
         self.max_score = self.min_score+1
 
+        self.adding = True
+        self.sweeps = 0
+        self.steps = 0
+
+        self.gains = []
+        self.sweep_gains = []
+        self.sweep_start = 0.
+        self.converged = False
+
+        self.saved_flags = None  # Swap flags last written to the checkpoint
+
+        if checkpoint is not None:
+            trackcheckpoint.load_progress(checkpoint, self)
+
+        self.scores = None
+
+        if incremental and engine == 'greedy':
+
+            start = time.time()
+            self.scores = trackscores.ScoreMatrix(self.score_features, self.d_mat, self.s_mat, self.states,
+                                                  self.track_param, self.candidates)
+            self.record_time('score_matrix', start)
+
+        if self.stats is not None:
+            self.stats.end_iteration(step=self.steps)  # Graph construction
+
+    def forward_pass(self):
+
+        start = time.time()
+
+        if self.scores is not None:
+            score_mat = self.scores.update(self.states, self.s_mat)
+        else:
+            score_mat = ctooltracking.forward_pass(self.score_features, self.d_mat, self.s_mat, self.states,
+                                                   self.track_param)
+
+        self.record_time('forward_pass', start)
+
+        return score_mat
+
+    def record_time(self, name, start):
+
+        if self.stats is not None:
+            self.stats.add_time(name, time.time() - start)
+
     def addtrack(self):
 
-        score_mat = ctooltracking.forward_pass(self.features, self.d_mat, self.s_mat, self.states, self.track_param)
+        if not self.adding:
+            return False
+
+        score = self.cum_score
+
+        if self.engine == 'lap':
+            self.adding = self.add_lap_track()
+        else:
+            self.adding = self.add_best_track()
+
+        self.gains.append(self.cum_score - score)
+
+        if not self.adding:
+            self.sweep_start = self.cum_score
+
+        self.step(not self.adding)
+
+        return self.adding
+
+    def add_best_track(self):
+
+        # Add the track with the best score
+
+        score_mat = self.forward_pass()
         max_score = max(score_mat[:, 3])
 
         if max_score > self.min_score:
@@ -42,57 +215,87 @@ class TrackCells(object):
             track_temp, self.s_mat, self.states = ctooltracking.track_back(score_mat, self.states, self.s_mat)
             track_temp[:, 4] = self.count
 
-            self.tracks, track_temp = ctooltracking.swap_test(self.tracks, track_temp, self.d_mat, self.count)
-            self.tracks = np.vstack((self.tracks, track_temp))
+            self.record_track(max_score, track_temp)
+
+            track_temp = trackstore.swap_test(self.tracks, track_temp, self.edge_scores, self.count, self.stats)
+            self.tracks.add(track_temp)
+            self.count += 1
+
+            return True
+
+        else:
+            self.track_num = self.tracks.max_id()
+            return False
+
+    def add_lap_track(self):
+
+        # Add the next track of the global assignment, solving it on the first call
+
+        if self.lap_tracks is None:
+
+            start = time.time()
+            lap_tracks = tracklap.lap_tracks(self.score_features, self.d_mat, self.track_param, self.min_score,
+                                             self.first_count)
+
+            self.lap_tracks = [track for track in lap_tracks if track[0, 4] not in self.tracks]  # Not yet added
+            self.lap_tracks.reverse()
+
+            self.record_time('lap_tracks', start)
+
+        if self.lap_tracks:
+
+            track_temp = self.lap_tracks.pop()
+            self.record_track(track_temp[-1, 2], track_temp)
+
+            self.cum_score += track_temp[-1, 2]
+            np.add.at(self.states, track_temp[:, 0].astype(int), 1)
+
+            self.tracks.add(track_temp)
             self.count += 1
 
             return True
 
         else:
-            self.track_num = np.max(self.tracks[:, 4])
+            self.track_num = self.tracks.max_id()
             return False
 
     def optimisetrack(self):
 
-        if self.optimise_count < self.track_num:
+        score = self.cum_score
+        optimising = self.optimise_next()
 
-            track_ind = self.optimise_count
-            replace_mask = self.tracks[:, 4] == track_ind
+        self.gains.append(self.cum_score - score)
 
-            if np.count_nonzero(replace_mask) > 0:
+        if not optimising:
 
-                track_store = self.tracks[replace_mask, :]
+            self.sweeps += 1
+            self.sweep_gains.append(self.cum_score - self.sweep_start)
+            self.sweep_start = self.cum_score
 
-                self.tracks = self.tracks[np.logical_not(replace_mask), :]
+        self.step(not optimising)
 
-                for j in range(track_store.shape[0]):  # Remove track
+        return optimising
 
-                    self.states[int(track_store[j, 0])] -= 1
+    def optimise_next(self):
 
-                    if j > 0:
+        # Retrack the next track if a better track can replace it, False at the end of a sweep
 
-                        ind1 = track_store[j - 1, 0]
-                        ind2 = track_store[j, 0]
+        if self.engine == 'greedy' and self.optimise_count < self.track_num:
+
+            track_ind = self.optimise_count
 
-                        m1 = np.logical_and(self.s_mat[:, 1] == ind1, self.s_mat[:, 3] == ind2)
-                        m2 = np.logical_and(self.s_mat[:, 2] == ind1, self.s_mat[:, 3] == ind2)
-                        m3 = np.logical_and(self.s_mat[:, 1] == ind1, self.s_mat[:, 4] == ind2)
-                        m4 = np.logical_and(self.s_mat[:, 2] == ind1, self.s_mat[:, 4] == ind2)
+            if track_ind in self.tracks:
 
-                        if any(m1):
-                            self.s_mat[m1, 5] = 0
-                            self.s_mat[m1, 7] = 0
-                        if any(m2):
-                            self.s_mat[m2, 6] = 0
-                            self.s_mat[m2, 7] = 0
-                        if any(m3):
-                            self.s_mat[m3, 5] = 0
-                            self.s_mat[m3, 8] = 0
-                        if any(m4):
-                            self.s_mat[m4, 6] = 0
-                            self.s_mat[m4, 8] = 0
+                track_store = self.tracks.remove(track_ind)
 
-                score_mat = ctooltracking.forward_pass(self.features, self.d_mat, self.s_mat, self.states, self.track_param)
+                # Remove track, freeing its segments and the edges between them
+
+                segments = track_store[:, 0].astype(int)
+
+                np.subtract.at(self.states, segments, 1)
+                self.set_swap_flags(segments, 0)
+
+                score_mat = self.forward_pass()
                 max_score = max(score_mat[:, 3])
 
                 if max_score > track_store[-1, 2]:
@@ -101,38 +304,17 @@ class TrackCells(object):
                     track_replace, self.s_mat, self.states = ctooltracking.track_back(score_mat, self.states, self.s_mat)
                     track_replace[:, 4] = track_ind
 
-                    self.tracks, track_replace = ctooltracking.swap_test(self.tracks, track_replace, self.d_mat, track_ind)
-                    self.tracks = np.vstack((self.tracks, track_replace))
-
-                else:
-                    self.tracks = np.vstack((self.tracks, track_store))
-
-                    for j in range(track_store.shape[0]):
-
-                        self.states[int(track_store[j, 0])] += 1
+                    self.record_track(max_score, track_replace)
 
-                        if j > 0:
+                    track_replace = trackstore.swap_test(self.tracks, track_replace, self.edge_scores, track_ind,
+                                                         self.stats)
+                    self.tracks.add(track_replace)
 
-                            ind1 = track_store[j - 1, 0]
-                            ind2 = track_store[j - 1, 0]
-
-                            m1 = np.logical_and(self.s_mat[:, 1] == ind1, self.s_mat[:, 3] == ind2)
-                            m2 = np.logical_and(self.s_mat[:, 2] == ind1, self.s_mat[:, 3] == ind2)
-                            m3 = np.logical_and(self.s_mat[:, 1] == ind1, self.s_mat[:, 4] == ind2)
-                            m4 = np.logical_and(self.s_mat[:, 2] == ind1, self.s_mat[:, 4] == ind2)
+                else:
+                    self.tracks.add(track_store)
 
-                            if any(m1):
-                                self.s_mat[m1, 5] = 1
-                                self.s_mat[m1, 7] = 1
-                            if any(m2):
-                                self.s_mat[m2, 6] = 1
-                                self.s_mat[m2, 7] = 1
-                            if any(m3):
-                                self.s_mat[m3, 5] = 1
-                                self.s_mat[m3, 8] = 1
-                            if any(m4):
-                                self.s_mat[m4, 6] = 1
-                                self.s_mat[m4, 8] = 1
+                    np.add.at(self.states, segments, 1)
+                    self.set_swap_flags(segments, 1)
 
             self.optimise_count += 1
 
@@ -143,48 +325,164 @@ class TrackCells(object):
             self.optimise_count = 0
             return False
 
-    def get(self):
+    def run(self, time_budget=None, max_steps=None, sweeps=2, tol=None, report=None):
+
+        ''' Add and optimise tracks within a budget of time_budget seconds and max_steps calls of addtrack and
+        optimisetrack. Optimisation stops after sweeps sweeps, or when a sweep improves the total score by less than
+        tol. report is called with progress() after every step. Returns True if tracking finished, False if the
+        budget ran out, in which case get returns the tracks found so far and run can be called again to continue.'''
+
+        start = time.time()
+        steps = 0
+
+        while self.adding or (self.sweeps < sweeps and not self.converged):
+
+            if time_budget is not None and time.time() - start >= time_budget:
+                return False
+
+            if max_steps is not None and steps >= max_steps:
+                return False
+
+            if self.adding:
+                self.addtrack()
+
+            elif not self.optimisetrack():
+
+                if tol is not None and self.sweep_gains[-1] < tol:
+                    self.converged = True
+
+            steps += 1
+
+            if report is not None:
+                report(self.progress())
+
+        return True
+
+    def progress(self):
+
+        ''' Progress of tracking, the stage, the number of steps and tracks, the total score, the gain in score of
+        the last step and of each completed sweep, and whether optimisation has converged.'''
+
+        return {'stage': 'add' if self.adding else 'optimise', 'steps': self.steps, 'sweeps': self.sweeps,
+                'tracks': len(self.tracks) - (0 in self.tracks), 'cum_score': self.cum_score,
+                'gain': self.gains[-1] if self.gains else 0., 'sweep_gains': list(self.sweep_gains),
+                'converged': self.converged}
+
+    def record_track(self, score, track):
+
+        # Score and length of a track found by the last step
+
+        if self.stats is not None:
+            self.stats.count('tracks_found')
+            self.stats.record(score=score, track_segments=track.shape[0])
+
+    def step(self, save=False):
+
+        # Save a checkpoint every checkpoint_every steps and at the end of each stage
+
+        self.steps += 1
+
+        if self.stats is not None:
+            self.stats.end_iteration(step=self.steps, adding=int(self.adding), cum_score=self.cum_score)
+
+        if self.checkpoint is not None and (save or self.steps % self.checkpoint_every == 0):
+            trackcheckpoint.save_progress(self.checkpoint, self)
 
-        self.tracks[:, 0] = self.tracks[:, 0] - 1
-        unique, counts = np.unique(self.tracks[:, 0], return_counts=True)
+    def set_swap_flags(self, segments, val):
 
-        self.segment_count = len(counts)
-        self.double_segment = sum(counts > 1)
+        ''' Mark the edges between consecutive segments of a track as in use (1) or free (0) in the swap matrix.'''
 
-        double_seg = unique[counts > 1]
+        segments = np.asarray(segments).tolist()
+        links = [self.swap_index.get((segments[j - 1], segments[j])) for j in range(1, len(segments))]
+        links = [link for link in links if link is not None]
 
-        for val in double_seg:
-            self.tracks = self.tracks[np.logical_not(self.tracks[:, 0] == val), :]
+        if links:
 
-        # ISCB HACK
+            links = np.vstack(links)
 
-        #for val in double_seg:
-        #    inds = np.where(self.tracks[:, 0] == val)
-        #    inds = inds[0]
-        #    self.tracks = np.delete(self.tracks, inds[0], 0)
+            self.s_mat[links[:, 0], links[:, 1]] = val
+            self.s_mat[links[:, 0], links[:, 2]] = val
 
-        # Color labels
+    def get(self, keep_progress=False):
 
-        self.tracks[:, 0] = self.tracks[:, 0] + 1
+        # Tracks found so far, the checkpoint keeps the progress if keep_progress so an unfinished run can resume
 
-        r = np.round(252 * np.random.rand()) + 3
-        ind = self.tracks[0, 4]
+        if self.checkpoint is not None:
+            if keep_progress:
+                trackcheckpoint.save_progress(self.checkpoint, self)
+            else:
+                trackcheckpoint.clear_progress(self.checkpoint)
 
-        for j in range(self.tracks.shape[0]):
+        tracks = self.found_tracks()
+        tracks, self.features, self.segment_count, self.double_segment = label_tracks(tracks, self.features)
 
-            if self.tracks[j, 4] != ind:
-                ind = self.tracks[j, 4]
-                r = np.round(252 * np.random.rand()) + 3
+        return tracks, self.features, self.segment_count, self.double_segment
 
-            self.features[int(self.tracks[j, 0]), 11] = r
+    def found_tracks(self):
 
-            if self.tracks[j, 3] > 0:
-                self.features[int(self.tracks[j, 0]), 11] = 5
+        # Tracks found so far with gaps closed, segments in more than one track are kept
 
-        self.features[:, 12] = 0
-        self.features[0, :] = 0
+        tracks = self.tracks.to_array()
 
-        return self.tracks, self.features, self.segment_count, self.double_segment
+        if self.gap_closing:
+            tracks = trackgaps.close_gaps(tracks, self.features, self.track_param)
+
+        return tracks
+
+
+def remove_double_segments(tracks):
+
+    ''' Remove the rows of segments assigned to more than one track. Returns the tracks, the number of tracked
+    segments and the number of segments that were in more than one track.'''
+
+    unique, counts = np.unique(tracks[:, 0], return_counts=True)
+
+    segment_count = len(counts)
+    double_segment = sum(counts > 1)
+
+    tracks = tracks[np.logical_not(np.isin(tracks[:, 0], unique[counts > 1])), :]
+
+    return tracks, segment_count, double_segment
+
+
+def label_tracks(tracks, features):
+
+    ''' Remove segments assigned to more than one track and colour the features by track, mitotic segments are
+    coloured 5. Returns the tracks, the features, the number of tracked segments and the number of segments that
+    were in more than one track.'''
+
+    tracks[:, 0] = tracks[:, 0] - 1
+    tracks, segment_count, double_segment = remove_double_segments(tracks)
+
+    # ISCB HACK
+
+    #for val in double_seg:
+    #    inds = np.where(tracks[:, 0] == val)
+    #    inds = inds[0]
+    #    tracks = np.delete(tracks, inds[0], 0)
+
+    # Color labels
+
+    tracks[:, 0] = tracks[:, 0] + 1
+
+    r = np.round(252 * np.random.rand()) + 3
+    ind = tracks[0, 4]
+
+    for j in range(tracks.shape[0]):
+
+        if tracks[j, 4] != ind:
+            ind = tracks[j, 4]
+            r = np.round(252 * np.random.rand()) + 3
+
+        features[int(tracks[j, 0]), ft.COLOR] = r
+
+        if tracks[j, 3] > 0:
+            features[int(tracks[j, 0]), ft.COLOR] = 5
+
+    features[:, ft.EVENT] = 0
+    features[0, :] = 0
+
+    return tracks, features, segment_count, double_segment
 
 
 ''' Create matrix and write to csv for features. Features are: Track_id, Frame, X_center, Y_center, Area,
@@ -196,10 +494,13 @@ def save_csv(features, tracks, file_name):
 
     ''' Create matrix and write to csv for features. Features are: Track_id, Frame, X_center, Y_center, Area,
     Eccentricity, Solidity, Perimeter, CH1 Mean Intensity, CH1 StdDev Intensity, CH1 Floored Mean, CH2 Mean Intensity,
-    CH2 StdDev Intensity, CH3 Mean Intensity, CH3 StdDev Intensity, '''
+    CH2 StdDev Intensity, CH3 Mean Intensity, CH3 StdDev Intensity. Data columns that were not measured are left
+    out.'''
+
+    columns = ft.measured_columns(features)
 
     t_num = 9
-    f_num = features['data'].shape[1]
+    f_num = len(columns)
 
     feat_mat = np.zeros((1, t_num + f_num))
 
@@ -210,17 +511,17 @@ def save_csv(features, tracks, file_name):
             track_temp = tracks[mask_i, :]
 
             for j in range(track_temp.shape[0]):
-                mask = features['tracking'][:, 0] == track_temp[j, 0]
+                mask = features['tracking'][:, ft.ID] == track_temp[j, 0]
 
                 t_v = features['tracking'][mask, :]
-                f_v = features['data'][mask, :]
-                v = np.hstack(([i, track_temp[j, 5], t_v[0, 2], t_v[0, 3], track_temp[j, 3],
-                                       track_temp[j, 0], 0, t_v[0, 12], i], f_v[0, :]))
+                f_v = features['data'][mask, :][:, columns]
+                v = np.hstack(([i, track_temp[j, 5], t_v[0, ft.X], t_v[0, ft.Y], track_temp[j, 3],
+                                       track_temp[j, 0], 0, t_v[0, ft.EVENT], i], f_v[0, :]))
                 feat_mat = np.vstack((feat_mat, v))
 
     feat_mat = np.delete(feat_mat, 0, 0)
 
-    for i in range(int(np.max(feat_mat[:, 1]))):  # Progress in time
+    for i in range(int(np.max(feat_mat[:, 1], initial=0))):  # Progress in time, none if no tracks were found yet
 
         items_to_test = np.where(feat_mat[:, 1] == i)[0]
 
@@ -258,7 +559,7 @@ def save_csv(features, tracks, file_name):
     with open(file_name, 'wb') as f:
 
         f.write(b'Track ID, Frame, X center, Y center, Parent Track ID, Event Flag, Tree Label, '
-                + extractfeats.bfeatures_labels()[0] + b'\n')
+                + extractfeats.bfeatures_labels(columns)[0] + b'\n')
 
         feat_mat2 = np.delete(feat_mat, [4, 5], 1)
         np.savetxt(f, feat_mat2, delimiter=",", fmt='%10.4f')
@@ -266,8 +567,10 @@ def save_csv(features, tracks, file_name):
 
 def save_sel_csv(features, tracks, tracks_stored, file_name):
 
+    columns = ft.measured_columns(features)
+
     t_num = 9
-    f_num = features['data'].shape[1]
+    f_num = len(columns)
 
     feat_mat = np.zeros((1, t_num + f_num))
 
@@ -280,17 +583,17 @@ def save_sel_csv(features, tracks, tracks_stored, file_name):
                 track_temp = tracks[mask_i, :]
 
                 for j in range(track_temp.shape[0]):
-                    mask = features['tracking'][:, 0] == track_temp[j, 0]
+                    mask = features['tracking'][:, ft.ID] == track_temp[j, 0]
 
                     t_v = features['tracking'][mask, :]
-                    f_v = features['data'][mask, :]
-                    v = np.hstack(([i, track_temp[j, 5], t_v[0, 2], t_v[0, 3], track_temp[j, 3],
-                                    track_temp[j, 0], 0, t_v[0, 12], i], f_v[0, :]))
+                    f_v = features['data'][mask, :][:, columns]
+                    v = np.hstack(([i, track_temp[j, 5], t_v[0, ft.X], t_v[0, ft.Y], track_temp[j, 3],
+                                    track_temp[j, 0], 0, t_v[0, ft.EVENT], i], f_v[0, :]))
                     feat_mat = np.vstack((feat_mat, v))
 
     feat_mat = np.delete(feat_mat, 0, 0)
 
-    for i in range(int(np.max(feat_mat[:, 1]))):  # Progress in time
+    for i in range(int(np.max(feat_mat[:, 1], initial=0))):  # Progress in time, none if no tracks were found yet
 
         items_to_test = np.where(feat_mat[:, 1] == i)[0]
 
@@ -328,19 +631,25 @@ def save_sel_csv(features, tracks, tracks_stored, file_name):
     with open(file_name, 'wb') as f:
 
         f.write(b'Track ID, Frame, X center, Y center, Parent Track ID, Event Flag, Tree Label, '
-                + extractfeats.bfeatures_labels()[0] + b'\n')
+                + extractfeats.bfeatures_labels(columns)[0] + b'\n')
 
         feat_mat2 = np.delete(feat_mat, [4, 5], 1)
         np.savetxt(f, feat_mat2, delimiter=",", fmt='%10.4f')
 
 
-# NEEDS UPDATING
+ISCB_COLUMNS = ['Area', 'Eccentricity', 'Major Axis Length', 'Perimeter', 'CH1 Mean Intensity', 'CH1 StdDev Intensity',
+                'CH1 Floored Mean', 'CH2 Mean Intensity', 'CH2 StdDev Intensity', 'CH3 Mean Intensity',
+                'CH3 StdDev Intensity']
+
 
 def save_iscb(features, tracks, file_name, labels, frames):
-    from skimage.external import tifffile
-    ''' Create matrix and write to csv for features. Features are: Track_id, Frame, X_center, Y_center, Area,
-    Eccentricity, Solidity, Perimeter, CH1 Mean Intensity, CH1 StdDev Intensity, CH1 Floored Mean, CH2 Mean Intensity,
-    CH2 StdDev Intensity, CH3 Mean Intensity, CH3 StdDev Intensity, '''
+
+    ''' Write the tracks in the format of the ISBI cell tracking challenge, res_track.txt and a mask TIFF of track ids
+    for every frame, in the directory of file_name, with the features of every tracked segment in res_feats.csv.
+    Tracks are split at gaps and at mitoses, where the parent track continues as a new daughter track.'''
+
+    path = os.path.dirname(file_name)
+    tracks = tracks.copy()
 
     # Remove gaps
 
@@ -351,6 +660,10 @@ def save_iscb(features, tracks, file_name, labels, frames):
         mask = tracks[:, 4] == i
         inds = np.where(mask)
         inds = inds[0]
+
+        if len(inds) == 0:
+            continue
+
         prev = tracks[inds[0], 5]
 
         for j in range(1, len(inds)):
@@ -374,11 +687,7 @@ def save_iscb(features, tracks, file_name, labels, frames):
             tracks = tracks[np.logical_not(mask), :]
             tracks[tracks[:, 4] > val, 4] -= 1
 
-    if features.shape[1] == 21:
-        features = np.insert(features, [-1], np.zeros((features.shape[0], 6)), 1)
-
-    if features.shape[1] == 24:
-        features = np.insert(features, [-1], np.zeros((features.shape[0], 3)), 1)
+    columns = [ft.DATA_COLUMNS.index(name) for name in ISCB_COLUMNS]
 
     feat_mat = np.zeros((1, 18))
 
@@ -388,16 +697,16 @@ def save_iscb(features, tracks, file_name, labels, frames):
             track_temp = tracks[tracks[:, 4] == i, :]
             feat_mat_temp = np.zeros((track_temp.shape[0], 18))
             for j in range(track_temp.shape[0]):
-                mask = features[:, 0] == track_temp[j, 0]
-                fv = features[mask, :]
-                feat_mat_temp[j, :] = np.asarray([i, track_temp[j, 5], fv[0, 2], fv[0, 3], fv[0, 5], fv[0, 6], fv[0, 7],
-                                                  fv[0, 8], fv[0, 9], fv[0, 10], fv[0, 11], fv[0, 20], fv[0, 21],
-                                                  fv[0, 23], fv[0, 24], track_temp[j, 3], track_temp[j, 0], 0])
+                mask = features['tracking'][:, ft.ID] == track_temp[j, 0]
+                t_v = features['tracking'][mask, :]
+                f_v = features['data'][mask, :][:, columns]
+                feat_mat_temp[j, :] = np.hstack(([i, track_temp[j, 5], t_v[0, ft.X], t_v[0, ft.Y]], f_v[0, :],
+                                                 [track_temp[j, 3], track_temp[j, 0], 0]))
 
             feat_mat = np.vstack((feat_mat, feat_mat_temp))
 
     feat_mat = np.delete(feat_mat, 0, 0)
-    np.savetxt("res_feats.csv", feat_mat, fmt='%10.3f', delimiter=",")
+    np.savetxt(os.path.join(path, "res_feats.csv"), feat_mat, fmt='%10.3f', delimiter=",")
 
     ### Data formatting for iscb benchmark dataset
 
@@ -409,7 +718,7 @@ def save_iscb(features, tracks, file_name, labels, frames):
             ind_change = feat_mat[mask, 0]
 
             frame_change = feat_mat[mask, 1]
-            if len(frame_change) > 1:
+            if len(frame_change) > 0:
                 mask_change = np.logical_and(feat_mat[:,0] == ind_change, feat_mat[:,1] > frame_change)
 
                 if np.any(mask_change):
@@ -417,8 +726,8 @@ def save_iscb(features, tracks, file_name, labels, frames):
                     feat_mat[mask_change, 0] = np.max(feat_mat[:, 0]) + 1
                     change_list = np.where(mask_change)
                     feat_mat[change_list[0][0], 17] = ind_change
-                    feat_mat[i, 17] = ind_change
 
+                feat_mat[i, 17] = ind_change  # The daughter track starts from the parent track
 
     track_text = np.zeros((int(np.max(feat_mat[:, 0])), 4))
 
@@ -432,7 +741,7 @@ def save_iscb(features, tracks, file_name, labels, frames):
         else:
             print('skip)')
 
-    np.savetxt("res_track.txt", track_text.astype(int), fmt='%i', delimiter=" ")
+    np.savetxt(os.path.join(path, "res_track.txt"), track_text.astype(int), fmt='%i', delimiter=" ")
 
     for i in range(frames):
 
@@ -448,6 +757,4 @@ def save_iscb(features, tracks, file_name, labels, frames):
         n = n.zfill(3)
         n = 'mask' + n + '.tif'
         im_tracked = im_tracked.astype(np.uint16)
-        tifffile.imsave(n, im_tracked)
-
-
+        Image.fromarray(im_tracked).save(os.path.join(path, n))
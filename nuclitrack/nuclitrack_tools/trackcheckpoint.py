@@ -0,0 +1,164 @@
+import hashlib
+
+import numpy as np
+
+from . import featuretable as ft
+from . import trackstore
+
+''' Checkpoints of TrackCells in an HDF5 group, 'tracking_checkpoint' of the FOV file. The group holds the edge and
+    swap matrices with a key of the inputs they were built from, so they are reused while the features and tracking
+    options are unchanged. While tracking runs it also holds the progress, the states, swap flags, tracks and
+    counters, so tracking can resume from the last checkpoint after the process is stopped. TrackCells saves the
+    progress every checkpoint_every calls of addtrack and optimisetrack and at the end of adding and of each sweep,
+    and get removes it. Swap flags are kept apart from the swap matrix as uint8, and only the rows changed since the
+    last checkpoint are rewritten.
+
+    The key covers the feature columns used for tracking, not the colour and event columns written by get, so the
+    features saved with the tracks still match.'''
+
+PROGRESS = ['states', 'tracks']
+
+
+def input_key(features, frames, track_param, options):
+
+    # Hash of the inputs of the tracking graph and scores
+
+    key = hashlib.sha1()
+    key.update(np.ascontiguousarray(features[:, :ft.COLOR], dtype=float).tobytes())
+    key.update(np.asarray(track_param, dtype=float).tobytes())
+    key.update(repr((int(frames), sorted(options.items()))).encode())
+
+    return key.hexdigest()
+
+
+def write(group, name, data):
+
+    if name in group:
+        del group[name]
+
+    group.create_dataset(name, data=data)
+
+
+def load_graph(group, key):
+
+    ''' Edge and swap matrices built from inputs with the same key, swap flags cleared. Returns None if there are
+    none.'''
+
+    if group.attrs.get('key') != key or 'd_mat' not in group:
+        return None
+
+    d_mat = group['d_mat'][...]
+    s_mat = None
+
+    if 's_mat' in group:
+        s_mat = group['s_mat'][...]
+        s_mat[:, 5:9] = 0
+
+    return d_mat, s_mat
+
+
+def save_graph(group, key, d_mat, s_mat):
+
+    # Replace the contents of the group with new matrices
+
+    for name in list(group.keys()):
+        del group[name]
+
+    for name in list(group.attrs.keys()):
+        del group.attrs[name]
+
+    write(group, 'd_mat', d_mat)
+
+    if s_mat is not None:
+        write(group, 's_mat', s_mat)
+
+    group.attrs['key'] = key
+    group.file.flush()
+
+
+def save_flags(group, s_mat, saved):
+
+    ''' Write the swap flags, Col5 to Col8 of the swap matrix, rewriting only the rows that differ from saved, the
+    flags written last. Returns the flags written.'''
+
+    flags = s_mat[:, 5:9].astype(np.uint8)
+
+    if saved is None or 'swap_flags' not in group or group['swap_flags'].shape != flags.shape:
+        write(group, 'swap_flags', flags)
+
+    else:
+
+        rows = np.nonzero(np.any(flags != saved, axis=1))[0]
+
+        if len(rows):
+            group['swap_flags'][rows, :] = flags[rows, :]
+
+    return flags
+
+
+def save_progress(group, tracker):
+
+    ''' Save the state of a tracker.'''
+
+    write(group, 'states', tracker.states)
+    write(group, 'tracks', tracker.tracks.to_array())
+
+    if tracker.s_mat is not None:
+        tracker.saved_flags = save_flags(group, tracker.s_mat, tracker.saved_flags)
+
+    group.attrs['count'] = tracker.count
+    group.attrs['optimise_count'] = tracker.optimise_count
+    group.attrs['cum_score'] = tracker.cum_score
+    group.attrs['track_num'] = getattr(tracker, 'track_num', -1)
+    group.attrs['adding'] = tracker.adding
+    group.attrs['sweeps'] = tracker.sweeps
+    group.attrs['steps'] = tracker.steps
+    group.attrs['sweep_start'] = tracker.sweep_start
+    group.attrs['sweep_gains'] = np.asarray(tracker.sweep_gains, dtype=float)
+    group.attrs['converged'] = tracker.converged
+
+    group.file.flush()  # A checkpoint must survive the process being killed
+
+
+def load_progress(group, tracker):
+
+    ''' Restore the state of a tracker from the last checkpoint. Returns False if there is none.'''
+
+    if not all(name in group for name in PROGRESS):
+        return False
+
+    tracker.states = group['states'][...].astype(np.int_)
+    tracker.tracks = trackstore.TrackStore(group['tracks'][...])
+
+    if tracker.s_mat is not None:
+
+        if 'swap_flags' in group:
+            tracker.saved_flags = group['swap_flags'][...]
+        else:
+            tracker.saved_flags = group['s_mat'][:, 5:9].astype(np.uint8)  # Written with the swap matrix before
+
+        tracker.s_mat[:, 5:9] = tracker.saved_flags
+
+    tracker.count = int(group.attrs['count'])
+    tracker.optimise_count = int(group.attrs['optimise_count'])
+    tracker.cum_score = float(group.attrs['cum_score'])
+    tracker.adding = bool(group.attrs['adding'])
+    tracker.sweeps = int(group.attrs['sweeps'])
+    tracker.steps = int(group.attrs['steps'])
+    tracker.sweep_start = float(group.attrs['sweep_start'])
+    tracker.sweep_gains = group.attrs['sweep_gains'].tolist()
+    tracker.converged = bool(group.attrs['converged'])
+
+    if group.attrs['track_num'] >= 0:
+        tracker.track_num = int(group.attrs['track_num'])
+
+    return True
+
+
+def clear_progress(group):
+
+    # Remove the progress of a finished run, keeping the matrices
+
+    for name in PROGRESS + ['swap_flags']:
+        if name in group:
+            del group[name]
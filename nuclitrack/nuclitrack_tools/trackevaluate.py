@@ -0,0 +1,307 @@
+import multiprocessing
+import os
+import time
+from functools import partial
+from multiprocessing import Pool
+
+import h5py
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+from skimage.measure import regionprops
+
+from . import featuretable as ft
+from . import loadimages
+from . import trackcells
+from . import tracklap
+from . import trackregions
+from . import trackwindows
+
+''' Accuracy of tracking against ground truth, as from simulatemovie, and its trade-off with speed. Tracks are
+    compared as detections [n, 4], Col0 = frame; Col1 = track id; Col2 = x; Col3 = y, and divisions [m, 2], the rows
+    of the detections of the parent and of the first segment of the daughter track. They are built from the tracks
+    matrix by track_detections or read from the res_track.txt and mask TIFFs of trackcells.save_iscb by load_iscb.
+
+    In every frame detections are matched to true cells that are each other's nearest neighbour within radius, which
+    for non overlapping nuclei and a radius below their spacing is the optimal matching. From the matches:
+
+    MOTA = 1 - (misses + false positives + ID switches) / true cells, CLEAR MOT, where an ID switch is a true cell
+    matched to a different track than when it was last matched.
+    IDF1 = 2 IDTP / (true cells + detections), where IDTP is the number of matches that agree with the best one to
+    one assignment of true cells to tracks over the whole movie.
+    Division F1 from the divisions of each parent, found where the parent matches the mother and a daughter track
+    starts at one of its daughters.
+
+    evaluate_configs tracks the same features with several engines and options in parallel, and pareto_table lists
+    their runtime with the metrics, marking the configurations that no faster configuration beats.'''
+
+
+def load_truth(file_name):
+
+    ''' Cells [n, 4], Col0 = frame; Col1 = cell ID; Col2 = x; Col3 = y, and the lineage from ground_truth.hdf5.'''
+
+    with h5py.File(file_name, 'r') as truth:
+        cells = truth['cells'][...]
+        lineage = truth['lineage'][...]
+
+    return cells[:, :4], lineage
+
+
+def track_detections(tracks, features):
+
+    ''' Detections and divisions of a tracks matrix. The parent of a division is the segment in Col3 of the first
+    row of the daughter track.'''
+
+    tracks = tracks[tracks[:, 0] != 0, :]
+    segments = tracks[:, 0].astype(int)
+
+    detections = np.column_stack((features[segments, ft.FRAME], tracks[:, 4], features[segments, ft.X],
+                                  features[segments, ft.Y]))
+
+    row = dict(zip(segments.tolist(), range(len(segments))))
+    divisions = [(row[int(tracks[j, 3])], j) for j in np.nonzero(tracks[:, 3] > 0)[0] if int(tracks[j, 3]) in row]
+
+    return detections, np.asarray(divisions, dtype=int).reshape(-1, 2)
+
+
+def load_iscb(path, frames):
+
+    ''' Detections and divisions from res_track.txt and the mask TIFFs written by trackcells.save_iscb in path. The
+    parent of a division is the last detection of the parent track.'''
+
+    detections = []
+
+    for i in range(frames):
+
+        mask = loadimages.loadlabel(os.path.join(path, 'mask' + str(i).zfill(3) + '.tif')).astype(int)
+
+        for region in regionprops(mask):
+            detections.append([i, region.label, region.centroid[1], region.centroid[0]])
+
+    detections = np.asarray(detections, dtype=float).reshape(-1, 4)
+    detections = detections[np.lexsort((detections[:, 0], detections[:, 1])), :]
+
+    track_text = np.loadtxt(os.path.join(path, 'res_track.txt'), ndmin=2)
+    divisions = []
+
+    for label, begin, end, parent in track_text.astype(int):
+
+        first = np.nonzero(detections[:, 1] == label)[0]
+        last = np.nonzero(detections[:, 1] == parent)[0]
+
+        if parent > 0 and first.shape[0] > 0 and last.shape[0] > 0:
+            divisions.append((last[-1], first[0]))
+
+    return detections, np.asarray(divisions, dtype=int).reshape(-1, 2)
+
+
+def match_frames(detections, cells, radius):
+
+    ''' True cell matched to each detection, or 0, pairing detections and cells that are each other's nearest
+    neighbour within radius in every frame.'''
+
+    matched = np.zeros(detections.shape[0])
+
+    for frame in np.unique(detections[:, 0]):
+
+        det = np.nonzero(detections[:, 0] == frame)[0]
+        true = np.nonzero(cells[:, 0] == frame)[0]
+
+        if true.shape[0] == 0:
+            continue
+
+        d1, nearest_true = cKDTree(cells[true, 2:4]).query(detections[det, 2:4], distance_upper_bound=radius)
+        d2, nearest_det = cKDTree(detections[det, 2:4]).query(cells[true, 2:4], distance_upper_bound=radius)
+
+        found = np.nonzero(np.isfinite(d1))[0]
+        mutual = found[nearest_det[nearest_true[found]] == found]
+
+        matched[det[mutual]] = cells[true[nearest_true[mutual]], 1]
+
+    return matched
+
+
+def best_assignment(rows, cols, weights):
+
+    ''' Total weight of the best one to one assignment of rows to cols, solved separately for each connected
+    component of the pairs.'''
+
+    if rows.shape[0] == 0:
+        return 0.
+
+    row_ids, r = np.unique(rows, return_inverse=True)
+    col_ids, c = np.unique(cols, return_inverse=True)
+
+    n = len(row_ids) + len(col_ids)
+    graph = coo_matrix((np.ones(len(r)), (r, len(row_ids) + c)), shape=(n, n))
+    component = connected_components(graph, directed=False)[1][r]
+
+    total = 0.
+
+    for k in np.unique(component):
+
+        pairs = component == k
+        chosen = tracklap.assign_pairs(r[pairs], c[pairs], weights[pairs])
+
+        gain = dict(zip(zip(r[pairs].tolist(), c[pairs].tolist()), weights[pairs].tolist()))
+        total += sum(gain[(source, target)] for target, source in chosen.items())
+
+    return total
+
+
+def evaluate(detections, divisions, cells, lineage, radius=5.):
+
+    ''' Tracking metrics of detections and divisions against the true cells and lineage, see the module notes.'''
+
+    matched = match_frames(detections, cells, radius)
+    hit = matched > 0
+
+    # ID switches, in frame order
+
+    switches = 0
+    last_track = dict()
+
+    hits = np.nonzero(hit)[0]
+
+    for j in hits[np.lexsort((detections[hits, 1], detections[hits, 0]))]:
+
+        cell = int(matched[j])
+        track = detections[j, 1]
+
+        if cell in last_track and last_track[cell] != track:
+            switches += 1
+
+        last_track[cell] = track
+
+    tp = np.count_nonzero(hit)
+    fp = detections.shape[0] - tp
+    fn = cells.shape[0] - tp
+
+    # Identity matching of true cells to tracks
+
+    pairs, counts = np.unique(np.column_stack((matched[hit], detections[hit, 1])), axis=0, return_counts=True)
+    idtp = best_assignment(pairs[:, 0], pairs[:, 1], counts.astype(float)) if tp else 0.
+
+    # Divisions are events of the parent, found if any of its daughters matches a daughter of the mother
+
+    mother = dict(zip(lineage[:, 0].astype(int).tolist(), lineage[:, 1].astype(int).tolist()))
+    true_divisions = set(int(m) for m in lineage[lineage[:, 1] > 0, 1])
+
+    events = dict()
+
+    for parent, daughter in divisions:
+
+        cell = int(matched[daughter])
+        events.setdefault(parent, 0)
+
+        if cell > 0 and mother.get(cell, 0) > 0 and mother[cell] == int(matched[parent]):
+            events[parent] = mother[cell]
+
+    found = set(m for m in events.values() if m > 0)
+
+    division_tp = len(found)
+    division_fp = len(events) - division_tp
+    division_fn = len(true_divisions) - division_tp
+
+    return {'mota': 1 - (fn + fp + switches) / max(cells.shape[0], 1),
+            'idf1': 2 * idtp / max(cells.shape[0] + detections.shape[0], 1),
+            'division_f1': 2 * division_tp / max(2 * division_tp + division_fp + division_fn, 1),
+            'tp': tp, 'fp': fp, 'fn': fn, 'id_switches': switches,
+            'divisions': len(true_divisions), 'division_tp': division_tp, 'division_fp': division_fp}
+
+
+def run_config(features, frames, track_param, config):
+
+    ''' Track with a configuration, a dictionary with a name and optionally track_param, a dictionary of changed
+    parameters by index, window and overlap or regions and halo to track with trackwindows or trackregions, and the
+    options of TrackCells, incremental unless set, also used for every window or region. Returns the tracks, the
+    features and the runtime in seconds.'''
+
+    options = dict(config)
+    options.pop('name')
+    options.setdefault('incremental', True)
+
+    param = np.array(track_param, dtype=float)
+
+    for index, value in options.pop('track_param', dict()).items():
+        param[int(index)] = value
+
+    start = time.time()
+
+    if 'window' in options:
+
+        tracks, features = trackwindows.track_windows(features, frames, param, window=options.pop('window'),
+                                                      overlap=options.pop('overlap', 20), parallel=False,
+                                                      **options)[:2]
+
+    elif 'regions' in options:
+
+        tracks, features = trackregions.track_regions(features, frames, param, regions=options.pop('regions'),
+                                                      halo=options.pop('halo', None), parallel=False, **options)[:2]
+
+    else:
+
+        tracking_object = trackcells.TrackCells(features=features, frames=frames, track_param=param, **options)
+        tracking_object.run()
+        tracks, features = tracking_object.get()[:2]
+
+    return tracks, features, time.time() - start
+
+
+def evaluate_configs(features, frames, track_param, configs, cells, lineage, radius=5., parallel=True):
+
+    ''' Track the features with every configuration and evaluate the tracks against the true cells and lineage.
+    Configurations run in parallel processes if parallel, where they share the cores so runtimes are only
+    comparable with each other. Returns a list of the metrics of each configuration with its name and runtime.'''
+
+    features = np.asarray(features, dtype=float)
+    job = partial(run_config, features, frames, track_param)
+
+    if parallel and len(configs) > 1:
+
+        cpu_count = multiprocessing.cpu_count()
+        pool = Pool(min(cpu_count, len(configs)))
+        runs = pool.map(job, configs)
+
+        pool.close()
+        pool.join()
+
+    else:
+        runs = [job(config) for config in configs]
+
+    results = []
+
+    for config, (tracks, tracked_features, runtime) in zip(configs, runs):
+
+        detections, divisions = track_detections(tracks, tracked_features)
+
+        result = evaluate(detections, divisions, cells, lineage, radius)
+        result['name'] = config['name']
+        result['time'] = runtime
+
+        results.append(result)
+
+    return results
+
+
+def pareto_table(results, metric='idf1', columns=('mota', 'idf1', 'division_f1')):
+
+    ''' Table of the results ordered by runtime as text. Configurations marked * are on the Pareto front, more
+    accurate by metric than every faster configuration.'''
+
+    results = sorted(results, key=lambda result: result['time'])
+    width = max([len('config')] + [len(result['name']) for result in results])
+
+    lines = ['  ' + 'config'.ljust(width) + ' ' + 'time (s)'.rjust(9) + ''.join(c.rjust(12) for c in columns)]
+    best = -np.inf
+
+    for result in results:
+
+        front = result[metric] > best
+        best = max(best, result[metric])
+
+        lines.append(('* ' if front else '  ') + result['name'].ljust(width) + ' ' +
+                     '{:9.2f}'.format(result['time']) + ''.join('{:12.3f}'.format(result[c]) for c in columns))
+
+    return '\n'.join(lines)
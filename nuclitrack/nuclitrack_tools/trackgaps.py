@@ -0,0 +1,114 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+from . import featuretable as ft
+from . import tracklap
+
+''' Gap closing after tracking. Instead of adding edges for every gap to the tracking graph, which multiplies the
+    edges, swaps and cost of every forward pass by the max gap, cells are tracked with edges between consecutive
+    frames only and track ends are then joined to track starts 2 to track_param[6] - 1 frames later.
+
+    Candidate joins are found with a KD-tree over the positions of the track starts, within the max distance
+    track_param[1]. A join scores as an edge of the tracking graph, the distance score less gap - 1 plus the score of
+    the segment on a track, and is made if it scores better than the start of the later track. Joins are chosen by
+    linear assignment, so each track end and start is joined at most once, and tracks starting with a mitosis are
+    not joined.'''
+
+
+def split_tracks(tracks):
+
+    # Tracks of a tracks matrix in row order, without the placeholder track 0
+
+    ids, first = np.unique(tracks[:, 4], return_index=True)
+    ids = ids[np.argsort(first)]
+
+    return [tracks[tracks[:, 4] == track_id, :] for track_id in ids if track_id != 0]
+
+
+def gap_joins(parts, features, track_param):
+
+    ''' Joins of track ends to later track starts. Returns a dictionary of index of the later track to (index of the
+    earlier track, score of the join).'''
+
+    max_t = int(track_param[6])
+    radius = track_param[1]
+
+    if max_t < 3 or len(parts) < 2:
+        return dict()
+
+    ends = np.asarray([part[-1, 0] for part in parts], dtype=int)
+    starts = np.asarray([part[0, 0] for part in parts], dtype=int)
+    mitotic = np.asarray([part[0, 3] != 0 for part in parts])
+
+    tree = cKDTree(features[starts, ft.X:ft.Y + 1])
+    neighbours = tree.query_ball_point(features[ends, ft.X:ft.Y + 1], radius)
+
+    counts = np.asarray([len(n) for n in neighbours], dtype=int)
+
+    if np.sum(counts) == 0:
+        return dict()
+
+    earlier = np.repeat(np.arange(len(parts)), counts)
+    later = np.concatenate([n for n in neighbours if n]).astype(int)
+
+    # Gap in frames and distance, rounded to single precision as in trackgraph.distance_mat
+
+    t = features[starts[later], ft.FRAME] - features[ends[earlier], ft.FRAME]
+
+    d = np.sqrt((features[starts[later], ft.Y] - features[ends[earlier], ft.Y])**2 +
+                (features[starts[later], ft.X] - features[ends[earlier], ft.X])**2)
+    d = d.astype(np.float32).astype(float)
+
+    keep = np.logical_and(np.logical_and(t >= 2, t < max_t), d < radius)
+    keep = np.logical_and(keep, np.logical_not(mitotic[later]))
+
+    earlier, later, t, d = earlier[keep], later[keep], t[keep], d[keep]
+
+    on_track = track_param[2] * features[:, ft.P_ONE] - track_param[3] * features[:, ft.P_ZERO]
+    score = on_track[starts[later]] + 1 - (track_param[0] * d)**2 - t + 1
+
+    start_score = np.asarray([part[0, 1] for part in parts])
+    joins = tracklap.assign_pairs(earlier, later, score - start_score[later])
+
+    link_score = dict(zip(zip(earlier.tolist(), later.tolist()), score.tolist()))
+
+    return dict((k, (e, link_score[(e, k)])) for k, e in joins.items())
+
+
+def close_gaps(tracks, features, track_param):
+
+    ''' Join track ends to the starts of tracks up to track_param[6] - 1 frames later. The joined track keeps the id
+    of its first part, and scores in Col1 and Col2 are updated.'''
+
+    parts = split_tracks(tracks)
+    joins = gap_joins(parts, features, track_param)
+
+    if not joins:
+        return tracks
+
+    following = dict((e, (k, score)) for k, (e, score) in joins.items())
+
+    joined = [tracks[tracks[:, 4] == 0, :]]
+
+    for p in range(len(parts)):
+
+        if p in joins:
+            continue
+
+        chain = [parts[p]]
+
+        while p in following:
+
+            p, score = following[p]
+
+            part = parts[p].copy()
+            part[0, 1] = score
+            part[:, 4] = chain[0][0, 4]
+            chain.append(part)
+
+        track = np.vstack(chain)
+        track[:, 2] = np.cumsum(track[:, 1])
+
+        joined.append(track)
+
+    return np.vstack(joined)
@@ -0,0 +1,273 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+from . import featuretable as ft
+
+''' Construction of the tracking graph. Edges are candidate movements between segments in frame i - t and frame i,
+    Col0 = frame after movement; Col1 = ID before movement; Col2 = ID after movement; Col3 = distance score;
+    Col4 = gap t. Edges are grouped by the ID after movement and end with a row of zeros, as produced by
+    ctooltracking.distance_mat.'''
+
+
+def frame_bounds(features, frames):
+
+    # First row of every frame, features are ordered by ID and therefore by frame
+
+    return np.searchsorted(features[:, ft.FRAME], np.arange(frames + 1), side='left')
+
+
+def grow(buffer, rows):
+
+    # Double the capacity of a buffer until it holds at least rows rows
+
+    if rows <= buffer.shape[0]:
+        return buffer
+
+    capacity = max(rows, 2 * buffer.shape[0])
+    new_buffer = np.zeros((capacity, buffer.shape[1]))
+    new_buffer[:buffer.shape[0], :] = buffer
+
+    return new_buffer
+
+
+def frame_pairs(ind1A, ind1B, ind2A, ind2B, tree1, tree2, radius):
+
+    # Candidate pairs between segments of two frames, from the KD-trees if given or from all pairs of the two frames
+
+    if tree1 is not None:
+
+        neighbours = tree1.query_ball_tree(tree2, radius * (1 + 1e-6) + 1e-6)
+        counts = np.asarray([len(n) for n in neighbours], dtype=int)
+
+        if np.sum(counts) == 0:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+        ind1 = ind1A + np.repeat(np.arange(len(neighbours)), counts)
+        ind2 = ind2A + np.concatenate([n for n in neighbours if n]).astype(int)
+
+    else:
+
+        ind1 = np.repeat(np.arange(ind1A, ind1B), ind2B - ind2A)
+        ind2 = np.tile(np.arange(ind2A, ind2B), ind1B - ind1A)
+
+    return ind1, ind2
+
+
+def distance_mat(features, frames, param, index='kdtree', stats=None):
+
+    ''' Candidate edges within the search radius param[1] for gaps 1 to param[6] - 1. Edges are built in a single
+    pass over the frames after movement, and only accepted edges are written to a buffer that grows geometrically.
+    Each frame's edges are ordered locally by ID after movement, gap and ID before movement, and as IDs increase
+    with frame the buffer is grouped by target segment without a global sort.
+
+    With index='kdtree' a KD-tree of each frame's positions is queried so only pairs inside the radius are generated,
+    with index=None all pairs of each frame pair are tested. Distances are rounded to single precision before
+    filtering to match the Cython implementation. The number of candidate pairs tested is counted in stats, a
+    trackstats.TrackingStats, if given.'''
+
+    max_t = int(param[6])
+    radius = param[1]
+
+    bounds = frame_bounds(features, frames)
+    trees = [None] * frames
+
+    if index == 'kdtree':
+        for i in range(frames):
+            if bounds[i + 1] > bounds[i]:
+                trees[i] = cKDTree(features[bounds[i]:bounds[i + 1], ft.X:ft.Y + 1])
+
+    edges = np.zeros((1024, 5))  # Grown as edges are accepted
+    count = 0
+
+    for i in range(1, frames):
+
+        blocks = []
+
+        for t in range(1, min(max_t, i + 1)):
+
+            if bounds[i + 1] == bounds[i] or bounds[i - t + 1] == bounds[i - t]:
+                continue
+
+            ind1, ind2 = frame_pairs(bounds[i], bounds[i + 1], bounds[i - t], bounds[i - t + 1], trees[i], trees[i - t],
+                                     radius)
+
+            if stats is not None:
+                stats.count('candidate_pairs', ind1.shape[0])
+
+            d = np.sqrt((features[ind1, ft.Y] - features[ind2, ft.Y])**2 +
+                        (features[ind1, ft.X] - features[ind2, ft.X])**2)
+            d = d.astype(np.float32).astype(float)
+
+            mask = np.logical_and(d < radius, features[ind2, ft.ID] != 0)
+
+            block = np.zeros((np.count_nonzero(mask), 5))
+            block[:, 0] = i
+            block[:, 1] = features[ind2[mask], ft.ID]
+            block[:, 2] = features[ind1[mask], ft.ID]
+            block[:, 3] = 1 - (param[0]*d[mask])**2  # Distance score function
+            block[:, 4] = t
+
+            blocks.append(block)
+
+        if blocks:
+
+            block = np.vstack(blocks)
+            block = block[np.lexsort((block[:, 1], block[:, 4], block[:, 2])), :]
+
+            edges = grow(edges, count + block.shape[0] + 1)
+            edges[count:count + block.shape[0], :] = block
+            count += block.shape[0]
+
+    # Final row of zeros marks the end of the edges
+
+    edges[count, :] = 0
+
+    return edges[:count + 1, :].copy()
+
+
+def prune_edges(edges, features, debris):
+
+    ''' Edges without segments that are almost certainly debris, with a probability of zero cells above debris.
+    The edges keep their order and the row of zeros at the end.'''
+
+    p_zero = features[:, ft.P_ZERO]
+
+    keep = np.logical_and(p_zero[edges[:, 1].astype(int)] <= debris, p_zero[edges[:, 2].astype(int)] <= debris)
+    keep[-1] = True
+
+    return edges[keep, :]
+
+
+def mitosis_candidates(features, mitosis):
+
+    ''' Copy of the features for scoring where only segments with a probability of mitosis entry of at least
+    mitosis can be the parent of a mitosis. The probability of other segments is set to -inf so the mitosis scores
+    of their edges are never chosen.'''
+
+    features = features.copy()
+    features[features[:, ft.P_MITOSIS_ENTRY] < mitosis, ft.P_MITOSIS_ENTRY] = -np.inf
+
+    return features
+
+
+def edge_scores(edges):
+
+    ''' Distance score of each edge by (ID before movement, ID after movement).'''
+
+    keys = zip(edges[:-1, 1].astype(int).tolist(), edges[:-1, 2].astype(int).tolist())
+
+    return dict(zip(keys, edges[:-1, 3].tolist()))
+
+
+def swaps_mat(edges, frames):
+
+    ''' Candidate swaps, pairs of segments in frame i that share at least two segments they could have moved from.
+    Col0 = frame; Col1 & Col2 = IDs before movement; Col3 & Col4 = IDs after movement; Col5 - Col8 = flags for
+    edges that are in use, set during tracking; Col9 = score of swapping the two assignments. The first row is
+    zero, as produced by ctooltracking.swaps_mat.
+
+    Each frame's edges are indexed by source, giving the targets reachable from it, and by (source, target), giving
+    the edge score and position. Target pairs are then collected from the sources they share, so the work depends on
+    the number of swaps found rather than on all pairs of targets, and scores are looked up in constant time. Shared
+    sources are listed in the iteration order of the set intersection used by the Cython implementation, as the
+    order of swaps affects the scores accumulated in main_loop.'''
+
+    s_mat = np.zeros((max(16, edges.shape[0]), 10))
+    count = 1
+
+    bounds = np.searchsorted(edges[:-1, 0], np.arange(frames + 1), side='left')
+
+    for i in range(frames):
+
+        frame_edges = edges[bounds[i]:bounds[i + 1], :]
+
+        targets = dict()
+        sources = dict()
+        scores = dict()
+
+        for e in range(frame_edges.shape[0]):
+
+            source = int(frame_edges[e, 1])
+            target = int(frame_edges[e, 2])
+
+            targets.setdefault(source, []).append(target)
+            sources.setdefault(target, set()).add(frame_edges[e, 1])
+            scores[(source, target)] = (e, frame_edges[e, 3])
+
+        # Number of sources shared by each pair of targets
+
+        shared = dict()
+
+        for source in sorted(targets):
+
+            source_targets = sorted(targets[source])
+
+            for j in range(len(source_targets) - 1):
+                for k in range(j + 1, len(source_targets)):
+                    pair = (source_targets[j], source_targets[k])
+                    shared[pair] = shared.get(pair, 0) + 1
+
+        for pair in sorted(shared):
+
+            if shared[pair] > 1:
+
+                union = [int(source) for source in sources[pair[0]].intersection(sources[pair[1]])]
+                lng = len(union)
+
+                s_mat = grow(s_mat, count + lng * (lng - 1) // 2)
+
+                for m in range(lng - 1):
+                    for n in range(m + 1, lng):
+
+                        s_mat[count, 0] = i
+                        s_mat[count, 1] = union[m]
+                        s_mat[count, 2] = union[n]
+                        s_mat[count, 3] = pair[0]
+                        s_mat[count, 4] = pair[1]
+                        s_mat[count, 9] = swap_cost(scores, union[m], union[n], pair[0], pair[1])
+
+                        count += 1
+
+    return s_mat[:count, :].copy()
+
+
+def swap_index(s_mat):
+
+    ''' Index of the swap flags of each edge. Maps (ID before movement, ID after movement) to an array with a row for
+    every swap that contains the edge, Col0 = row of s_mat; Col1 = flag column of the ID before movement (5 or 6);
+    Col2 = flag column of the ID after movement (7 or 8).'''
+
+    hgt = s_mat.shape[0]
+
+    sources = np.concatenate((s_mat[:, 1], s_mat[:, 2], s_mat[:, 1], s_mat[:, 2])).astype(int)
+    targets = np.concatenate((s_mat[:, 3], s_mat[:, 3], s_mat[:, 4], s_mat[:, 4])).astype(int)
+
+    entries = np.zeros((4 * hgt, 3), dtype=int)
+    entries[:, 0] = np.tile(np.arange(hgt), 4)
+    entries[:, 1] = np.repeat([5, 6, 5, 6], hgt)
+    entries[:, 2] = np.repeat([7, 7, 8, 8], hgt)
+
+    order = np.lexsort((entries[:, 0], targets, sources))
+    sources = sources[order]
+    targets = targets[order]
+    entries = entries[order, :]
+
+    starts = np.nonzero(np.logical_or(np.diff(sources) != 0, np.diff(targets) != 0))[0] + 1
+    keys = zip(sources[np.r_[0, starts]].tolist(), targets[np.r_[0, starts]].tolist())
+
+    return dict(zip(keys, np.split(entries, starts)))
+
+
+def swap_cost(scores, a, b, c, d):
+
+    # Score of a to c and b to d over b to c and a to d, summed in edge order with single precision as in cost_calc
+
+    terms = sorted([scores[(a, c)], scores[(b, d)], (scores[(b, c)][0], -scores[(b, c)][1]),
+                    (scores[(a, d)][0], -scores[(a, d)][1])])
+
+    cost = np.float32(0)
+
+    for term in terms:
+        cost = np.float32(cost + term[1])
+
+    return cost
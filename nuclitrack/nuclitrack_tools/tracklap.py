@@ -0,0 +1,179 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+from . import featuretable as ft
+
+''' Global assignment engine for TrackCells. Instead of adding the best track one at a time, all segments are linked
+    at once by solving a linear assignment problem over the edges of trackgraph.distance_mat, in two steps.
+
+    Linking: every segment is either continued by one of its edges or ends a track, and is either reached by one of
+    its edges or starts a track. The edges of all gaps are in a single sparse assignment of size 2n, with the block
+    structure of Jaqaman et al. (2008): edges, track ends on the diagonal, track starts on the diagonal and the
+    transposed edges, so gap closing is solved together with frame to frame linking.
+
+    Mitosis: segments that start a track are assigned to tracked segments they have an edge from if the mitosis
+    score is better than the start score, each segment being the parent of at most one extra track.
+
+    Scores follow ctooltracking.forward_pass. A segment on a track scores p2*P(one) - p3*P(zero), an edge adds the
+    distance score less gap - 1, a track starts with P(one) - P(zero), plus the edge distance score after the first
+    frame, and a mitotic track with the distance, gap and mitosis probabilities less the mitosis penalty. Tracks
+    with a total score below the minimum score are not kept. Each segment is in at most one track and there are no
+    swaps, so Col6 and Col7 of the tracks are zero.'''
+
+
+def segment_scores(features, param):
+
+    # Score of a segment on a track and of starting a track at it
+
+    on_track = param[2] * features[:, ft.P_ONE] - param[3] * features[:, ft.P_ZERO]
+
+    start = 1 - (param[0] * features[:, ft.EDGE_DISTANCE]) ** 2 + features[:, ft.P_ONE] - features[:, ft.P_ZERO]
+    start = np.maximum(start, -3.)
+
+    first = features[:, ft.FRAME] == 0
+    start[first] = features[first, ft.P_ONE] - features[first, ft.P_ZERO]
+
+    return on_track, start
+
+
+def link_segments(n, sources, targets, link, start):
+
+    ''' Solve the linking assignment for segments 1 to n - 1. Returns the previous segment of every segment, zero
+    for segments that start a track.'''
+
+    m = n - 1
+    k = len(sources)
+    seg = np.arange(m)
+
+    # Rows: segments continued by an edge, then track starts. Columns: segments reached by an edge, then track ends.
+
+    rows = np.concatenate((sources - 1, seg, m + seg, m + targets - 1))
+    cols = np.concatenate((targets - 1, m + seg, seg, m + sources - 1))
+    cost = np.concatenate((-link, np.zeros(m), -start[1:], np.zeros(k)))
+
+    # The matching is perfect so shifting all costs leaves it unchanged, and keeps every entry nonzero
+
+    cost = cost - np.min(cost) + 1
+
+    graph = coo_matrix((cost, (rows, cols)), shape=(2 * m, 2 * m)).tocsr()
+    match = min_weight_full_bipartite_matching(graph)[1]
+
+    previous = np.zeros(n, dtype=int)
+
+    linked = match[:m] < m
+    previous[match[:m][linked] + 1] = seg[linked] + 1
+
+    return previous
+
+
+def assign_pairs(sources, targets, gain):
+
+    ''' Choose pairs of source and target with the greatest total gain, each source and each target in at most one
+    pair and only pairs with positive gain. Returns a dictionary of target to source.'''
+
+    keep = gain > 0
+
+    if not np.any(keep):
+        return dict()
+
+    rows, r = np.unique(sources[keep], return_inverse=True)
+    cols, c = np.unique(targets[keep], return_inverse=True)
+
+    cost = np.zeros((len(rows), len(cols)))
+    np.minimum.at(cost, (r, c), -gain[keep])
+
+    row, col = linear_sum_assignment(cost)
+    chosen = cost[row, col] < 0
+
+    return dict(zip(cols[col[chosen]].tolist(), rows[row[chosen]].tolist()))
+
+
+def mitosis_parents(starts, sources, targets, mitosis, start):
+
+    ''' Assign tracks starting at segments in starts to mitotic parents where the mitosis score is better than the
+    start score, at most one track per parent. Returns a dictionary of starting segment to parent.'''
+
+    gain = np.where(np.isin(targets, starts), mitosis - start[targets], 0)
+
+    return assign_pairs(sources, targets, gain)
+
+
+def lap_tracks(features, edges, param, min_score=1, count=5):
+
+    ''' Tracks of all segments from the global assignment, as a list of [m, 8] arrays in the format of the tracks
+    matrix with track ids from count. Tracks are ordered by the frame and ID of their first segment.'''
+
+    n = features.shape[0]
+
+    edges = edges[:-1, :]  # Drop the trailing row of zeros
+    sources = edges[:, 1].astype(int)
+    targets = edges[:, 2].astype(int)
+
+    on_track, start = segment_scores(features, param)
+
+    link = on_track[targets] + edges[:, 3] - edges[:, 4] + 1
+    mitosis = (on_track[targets] + edges[:, 3] - param[5] * (edges[:, 4] + 1)
+               + features[sources, ft.P_MITOSIS_ENTRY] + features[targets, ft.P_MITOSIS_EXIT] - param[4])
+
+    previous = link_segments(n, sources, targets, link, start) if n > 1 else np.zeros(n, dtype=int)
+
+    # Follow the links from each starting segment
+
+    following = np.zeros(n, dtype=int)
+    following[previous[1:]] = np.arange(1, n)
+    following[0] = 0
+
+    starts = np.nonzero(previous[1:] == 0)[0] + 1
+    parents = mitosis_parents(starts, sources, targets, mitosis, start)
+
+    link_score = dict(zip(zip(sources.tolist(), targets.tolist()), link.tolist()))
+    mitosis_score = dict(zip(zip(sources.tolist(), targets.tolist()), mitosis.tolist()))
+
+    tracks = []
+    kept = set()
+
+    for first in starts.tolist():
+
+        chain = [first]
+
+        while following[chain[-1]] != 0:
+            chain.append(int(following[chain[-1]]))
+
+        track = np.zeros((len(chain), 8))
+        track[:, 0] = chain
+        track[:, 5] = features[chain, ft.FRAME]
+
+        if first in parents:
+            track[0, 1] = mitosis_score[(parents[first], first)]
+            track[0, 3] = parents[first]
+        else:
+            track[0, 1] = start[first]
+
+        for j in range(1, len(chain)):
+            track[j, 1] = link_score[(chain[j - 1], chain[j])]
+
+        track[:, 2] = np.cumsum(track[:, 1])
+
+        if track[-1, 2] > min_score:
+            tracks.append(track)
+            kept.update(chain)
+
+    tracks.sort(key=lambda track: (track[0, 5], track[0, 0]))
+
+    for j in range(len(tracks)):
+
+        tracks[j][:, 4] = count + j
+
+        # Mitoses from segments of tracks that were not kept become track starts
+
+        if tracks[j][0, 3] != 0 and int(tracks[j][0, 3]) not in kept:
+
+            first = int(tracks[j][0, 0])
+
+            tracks[j][0, 1] = start[first]
+            tracks[j][0, 3] = 0
+            tracks[j][:, 2] = np.cumsum(tracks[j][:, 1])
+
+    return tracks
@@ -0,0 +1,202 @@
+import multiprocessing
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+
+from . import featuretable as ft
+from . import trackcells
+
+''' Tracking of large fields in spatial regions. The field is divided into a grid of regions and every segment is
+    owned by the region its centre lies in. Each region is tracked independently in its own process, together with a
+    halo of segments from neighbouring regions at least the max movement distance, track_param[1], wide, so that
+    movements across the region boundary are seen from both sides.
+
+    Each region keeps the parts of its tracks on segments it owns. Parts of different regions are merged where a
+    region's track continues onto segments owned by a neighbour, merging the pairs with the most shared segments
+    first and never merging parts that have segments in the same frame. As cells in distant regions never share
+    edges the graph, swaps and scores of each region only depend on the cells in and next to it, so the cost grows
+    with the number of regions rather than faster than linearly with the total number of cells.'''
+
+
+def region_grid(features, regions):
+
+    # Edges of the grid of regions covering the positions of all segments
+
+    x = features[1:, ft.X]
+    y = features[1:, ft.Y]
+
+    x_edges = np.linspace(np.min(x), np.max(x), regions[0] + 1)
+    y_edges = np.linspace(np.min(y), np.max(y), regions[1] + 1)
+
+    return x_edges, y_edges
+
+
+def region_owner(features, x_edges, y_edges):
+
+    ''' Index of the region that owns each segment, row 0 is owned by no region.'''
+
+    ix = np.clip(np.searchsorted(x_edges, features[:, ft.X], side='right') - 1, 0, len(x_edges) - 2)
+    iy = np.clip(np.searchsorted(y_edges, features[:, ft.Y], side='right') - 1, 0, len(y_edges) - 2)
+
+    owner = iy * (len(x_edges) - 1) + ix
+    owner[0] = -1
+
+    return owner
+
+
+def region_features(features, box):
+
+    ''' Features of segments inside a box, (x0, x1, y0, y1), with IDs renumbered from one. Returns the features and
+    the movie IDs of the segments.'''
+
+    inside = np.logical_and(np.logical_and(features[:, ft.X] >= box[0], features[:, ft.X] <= box[1]),
+                            np.logical_and(features[:, ft.Y] >= box[2], features[:, ft.Y] <= box[3]))
+    inside[0] = False
+
+    ids = np.nonzero(inside)[0]
+
+    local = np.zeros((len(ids) + 1, features.shape[1]))
+    local[1:, :] = features[ids, :]
+    local[1:, ft.ID] = np.arange(1, len(ids) + 1)
+
+    return local, ids
+
+
+def track_region(track_param, frames, features, ids, **options):
+
+    # Track one region with the options of TrackCells and return its tracks with movie IDs
+
+    if features.shape[0] < 2:
+        return np.zeros((0, 8))
+
+    options.setdefault('incremental', True)
+
+    tracking_object = trackcells.TrackCells(features=features, frames=frames, track_param=track_param, **options)
+
+    while tracking_object.addtrack():
+        pass
+
+    for i in range(2):
+        while tracking_object.optimisetrack():
+            pass
+
+    tracks = tracking_object.found_tracks()
+    tracks = tracks[tracks[:, 0] != 0, :]
+
+    lut = np.concatenate(([0], ids))
+
+    for col in [0, 3, 6]:  # Segment, mitotic parent and swap IDs
+        tracks[:, col] = lut[tracks[:, col].astype(int)]
+
+    return tracks
+
+
+def merge_regions(region_tracks, owner):
+
+    ''' Merge the owned parts of region tracks into tracks across region boundaries.'''
+
+    parts = []
+    part_of = dict()
+
+    for r in range(len(region_tracks)):
+
+        tracks = region_tracks[r]
+
+        for track_id in np.unique(tracks[:, 4]):
+
+            track = tracks[tracks[:, 4] == track_id, :]
+            owned = track[owner[track[:, 0].astype(int)] == r, :]
+
+            if owned.shape[0] > 0:
+
+                for segment in owned[:, 0].astype(int).tolist():
+                    part_of.setdefault(segment, []).append(len(parts))
+
+                parts.append((r, track, owned))
+
+    # Votes for joining a part to the parts owning the segments its track continues onto
+
+    votes = dict()
+
+    for p in range(len(parts)):
+
+        r, track, owned = parts[p]
+
+        for segment in track[owner[track[:, 0].astype(int)] != r, 0].astype(int).tolist():
+            for q in part_of.get(segment, []):
+                key = (min(p, q), max(p, q))
+                votes[key] = votes.get(key, 0) + 1
+
+    # Union of parts with most votes first, parts sharing a frame are not joined
+
+    group = list(range(len(parts)))
+    frames = [set(part[2][:, 5].tolist()) for part in parts]
+
+    def find(p):
+        while group[p] != p:
+            group[p] = group[group[p]]
+            p = group[p]
+        return p
+
+    for (p, q), n in sorted(votes.items(), key=lambda item: (-item[1], item[0])):
+
+        p, q = find(p), find(q)
+
+        if p != q and not frames[p].intersection(frames[q]):
+            group[q] = p
+            frames[p] |= frames[q]
+
+    merged = dict()
+
+    for p in range(len(parts)):
+        merged.setdefault(find(p), []).append(parts[p][2])
+
+    tracks = [np.zeros((1, 8))]
+
+    for count, p in enumerate(sorted(merged)):
+
+        track = np.vstack(merged[p])
+        track = track[np.argsort(track[:, 5], kind='stable'), :]
+        track[:, 4] = count + 1
+        tracks.append(track)
+
+    return np.vstack(tracks)
+
+
+def track_regions(features, frames, track_param, regions=(2, 2), halo=None, parallel=True, **options):
+
+    ''' Track a field in a grid of regions, regions = (columns, rows). The halo around each region is track_param[1]
+    or halo if that is larger. Each region is tracked by TrackCells with options, such as engine, except checkpoint
+    and stats. Returns the tracks, features, segment count and double segment count as TrackCells.get.'''
+
+    features = np.asarray(features, dtype=float)
+
+    halo = track_param[1] if halo is None else max(halo, track_param[1])
+
+    x_edges, y_edges = region_grid(features, regions)
+    owner = region_owner(features, x_edges, y_edges)
+
+    jobs = []
+
+    for iy in range(regions[1]):
+        for ix in range(regions[0]):
+
+            box = (x_edges[ix] - halo, x_edges[ix + 1] + halo, y_edges[iy] - halo, y_edges[iy + 1] + halo)
+            jobs.append(region_features(features, box))
+
+    if parallel and len(jobs) > 1:
+
+        cpu_count = multiprocessing.cpu_count()
+        pool = Pool(min(cpu_count, len(jobs)))
+        region_tracks = pool.starmap(partial(track_region, track_param, frames, **options), jobs)
+
+        pool.close()
+        pool.join()
+
+    else:
+        region_tracks = [track_region(track_param, frames, *job, **options) for job in jobs]
+
+    tracks = merge_regions(region_tracks, owner)
+
+    return trackcells.label_tracks(tracks, features)
@@ -0,0 +1,343 @@
+import heapq
+import struct
+
+import numpy as np
+
+from . import featuretable as ft
+
+''' Incremental version of ctooltracking.forward_pass. Score matrix, Col0 = frame; Col1 = ID; Col2 = ID of previous
+    segment; Col3 = score of best track ending at the segment; Col4 = mitosis flag; Col5 = ID of segment to swap with;
+    Col6 = swap score.
+
+    The score of a segment depends only on its own state, the states and scores of the segments it has edges from
+    and the swap flags of those edges. After a track is added or removed only the segments on it and the swaps next
+    to it change, so the score matrix is kept between iterations and only segments whose inputs changed are
+    rescored. Segments are rescored in ID order, which is time order, and a segment whose score changes marks the
+    segments it has edges to, so changes propagate forward as a frontier that stops where scores are unchanged.
+
+    Arithmetic follows the Cython kernels, including rounding to single precision, so the scores are identical to a
+    full forward pass.'''
+
+
+SINGLE = struct.Struct('f')
+
+
+def f32(val):
+
+    # Round to single precision as when assigning to a cdef float
+
+    return SINGLE.unpack(SINGLE.pack(val))[0]
+
+
+class ScoreMatrix(object):
+
+    def __init__(self, features, edges, swaps, states, param, candidates=None):
+
+        ''' candidates marks the segments that can be mitotic parents, by default all segments. Edges from other
+        segments are left out of the mitotic entry scores, which they can never win.'''
+
+        self.f = features.tolist()
+        self.param = [float(p) for p in param]
+
+        n = features.shape[0]
+        self.n = n
+
+        # First segment after the entry frame
+
+        self.first = int(np.argmax(features[:, ft.FRAME] != 0)) if np.any(features[:, ft.FRAME] != 0) else n
+
+        # Edges into each segment, edges are grouped by ID after movement and end with a row of zeros
+
+        targets = edges[:-1, 2].astype(int)
+        sources = edges[:-1, 1].astype(int)
+
+        self.e_start = np.searchsorted(targets, np.arange(n), side='left').tolist()
+        self.e_end = np.searchsorted(targets, np.arange(n), side='right').tolist()
+        self.src = sources.tolist()
+        self.e_score = edges[:-1, 3].tolist()
+        self.e_gap = edges[:-1, 4].tolist()
+
+        # Edges into each segment from segments that can be mitotic parents
+
+        parents = np.nonzero(np.ones(len(sources), dtype=bool) if candidates is None else candidates[sources])[0]
+
+        self.m_edge = parents.tolist()
+        self.m_start = np.searchsorted(targets[parents], np.arange(n), side='left').tolist()
+        self.m_end = np.searchsorted(targets[parents], np.arange(n), side='right').tolist()
+
+        # Edges out of each segment
+
+        order = np.argsort(sources, kind='stable')
+        self.succ = targets[order].tolist()
+        self.s_start = np.searchsorted(sources[order], np.arange(n), side='left').tolist()
+        self.s_end = np.searchsorted(sources[order], np.arange(n), side='right').tolist()
+
+        # Segments with edges in ID order, the swap score left by the previous segment carries over in main_loop
+
+        grouped = np.unique(targets).tolist()
+        self.prev_group = dict(zip(grouped[1:], grouped[:-1]))
+        self.next_group = dict(zip(grouped[:-1], grouped[1:]))
+
+        # Swaps tested for each edge, main_loop does not reach the last row of the swap matrix
+
+        self.pair_swaps = dict()
+        self.swap_pairs = [[] for i in range(swaps.shape[0])]
+
+        for r in range(1, swaps.shape[0]):
+
+            row = swaps[r, :]
+
+            for prev in (int(row[1]), int(row[2])):
+                for seg in (int(row[3]), int(row[4])):
+
+                    self.swap_pairs[r].append(seg)
+
+                    if r < swaps.shape[0] - 1:
+                        self.pair_swaps.setdefault((prev, seg), []).append(r)
+
+        self.swap_rows = swaps[:, 1:5].tolist()
+        self.swap_cost = swaps[:, 9].tolist()
+        self.swap_flags = swaps[:, 5:9].copy()
+        self.flags = self.swap_flags.tolist()
+
+        # A swap can only be taken when one edge of each pair is in use, most swaps are not tested further
+
+        usable = np.logical_and(self.swap_flags[:, 0] != self.swap_flags[:, 1],
+                                self.swap_flags[:, 2] != self.swap_flags[:, 3])
+
+        self.active_swaps = dict()
+        self.refresh_swaps(np.nonzero(usable)[0].tolist())
+
+        self.states = states.copy()
+        self.state_list = self.states.tolist()
+        self.blocked = bool(np.any(self.states[self.first:] >= 2))
+
+        self.scores = np.zeros((n, 7))
+        self.rows = [[0.] * 7 for i in range(n)]
+        self.carry = [0.] * n
+
+        self.rescore(range(n))
+
+    def update(self, states, swaps):
+
+        ''' Rescore the segments affected by changes to states and swap flags since the last call and return the
+        score matrix.'''
+
+        dirty = set()
+
+        changed = np.nonzero(states != self.states)[0]
+
+        if len(changed):
+
+            self.states[changed] = states[changed]
+
+            for i in changed.tolist():
+
+                self.state_list[i] = int(states[i])
+                dirty.add(i)
+                dirty.update(self.succ[self.s_start[i]:self.s_end[i]])
+
+            # Segments after the entry frame with two or more tracks overwrite the entry score of the first one
+
+            blocked = bool(np.any(self.states[self.first:] >= 2))
+
+            if blocked != self.blocked:
+                self.blocked = blocked
+                dirty.add(self.first)
+
+        changed = np.nonzero(np.any(swaps[:, 5:9] != self.swap_flags, axis=1))[0]
+
+        if len(changed):
+
+            self.swap_flags[changed, :] = swaps[changed, 5:9]
+
+            for r in changed.tolist():
+                self.flags[r] = self.swap_flags[r, :].tolist()
+                dirty.update(self.swap_pairs[r])
+
+            self.refresh_swaps(changed.tolist())
+
+        self.rescore(dirty)
+
+        return self.scores
+
+    def refresh_swaps(self, changed):
+
+        # Swaps of the edges next to changed swap rows that have exactly one edge of each pair in use
+
+        keys = set()
+
+        for r in changed:
+            ids = [int(i) for i in self.swap_rows[r]]
+            keys.update([(ids[0], ids[2]), (ids[0], ids[3]), (ids[1], ids[2]), (ids[1], ids[3])])
+
+        for key in keys:
+
+            if key in self.pair_swaps:
+
+                flags = self.flags
+                active = [r for r in self.pair_swaps[key] if flags[r][0] != flags[r][1] and flags[r][2] != flags[r][3]]
+
+                if active:
+                    self.active_swaps[key] = active
+                else:
+                    self.active_swaps.pop(key, None)
+
+    def rescore(self, dirty):
+
+        heap = list(set(dirty))
+        heapq.heapify(heap)
+        done = -1
+
+        while heap:
+
+            k = heapq.heappop(heap)
+
+            if k == done or k >= self.n:
+                continue
+
+            done = k
+
+            row, carry = self.score(k)
+
+            if row[3] != self.rows[k][3]:
+                for seg in self.succ[self.s_start[k]:self.s_end[k]]:
+                    heapq.heappush(heap, seg)
+
+            if carry != self.carry[k] and k in self.next_group:
+                heapq.heappush(heap, self.next_group[k])
+
+            self.rows[k] = row
+            self.carry[k] = carry
+            self.scores[k, :] = row
+
+    def score(self, k):
+
+        # Entry, mitosis and migration scores of a segment in the order of forward_pass
+
+        f = self.f[k]
+        p = self.param
+        s = self.state_list[k]
+        row = [0.] * 7
+
+        if k < self.first:
+
+            if s < 2:
+                row[3] = f[7 + s] - f[6 + s]
+                row[1] = f[ft.ID]
+            else:
+                row[3] = -100000.
+
+        else:
+
+            row[1] = float(k)
+
+            if s < 2:
+
+                temp = f32(1 - (p[0] * f[ft.EDGE_DISTANCE]) ** 2 + f[7 + s] - f[6 + s])
+                row[3] = temp if temp > -3. else -3.
+                row[0] = f[ft.FRAME]
+
+            if k == self.first and self.blocked:
+                row[3] = -100000.
+
+        if self.e_start[k] == self.e_end[k]:
+            return row, 0.
+
+        states = self.state_list
+
+        # Mitotic entry
+
+        max_score = -100000.
+        max_id = 0.
+
+        if s < 2:
+            add = f32(p[2] * f[7 + s] - p[3] * f[6 + s])
+        else:
+            add = -100000.
+
+        for i in range(self.m_start[k], self.m_end[k]):
+
+            e = self.m_edge[i]
+            prev = self.src[e]
+
+            if states[prev] > 0:
+
+                temp = f32(add + self.e_score[e] - p[5] * (self.e_gap[e] + 1))
+                temp = f32(temp + (self.f[prev][ft.P_MITOSIS_ENTRY] + f[ft.P_MITOSIS_EXIT]) - p[4])
+
+                if temp > max_score:
+                    max_score = temp
+                    max_id = float(prev)
+
+        if max_score > row[3]:
+            row[2] = max_id
+            row[3] = max_score
+            row[4] = 1.
+
+        # Migration from previous segments and swaps with neighbouring tracks
+
+        max_score = -100000.
+        max_id = 0.
+        swap_id = 0.
+        max_swap = None
+
+        for e in range(self.e_start[k], self.e_end[k]):
+
+            prev = self.src[e]
+
+            if s < 2:
+                add = f32(self.rows[prev][3] + p[2] * f[7 + s] - p[3] * f[6 + s])
+            else:
+                add = -10000.
+
+            temp = f32(add + self.e_score[e] - self.e_gap[e] + 1)
+
+            if temp > max_score:
+                max_score = temp
+                max_id = float(prev)
+                swap_id = 0.
+
+            for r in self.active_swaps.get((prev, k), ()):
+
+                ids = self.swap_rows[r]
+                flags = self.flags[r]
+
+                test1 = ids[0] == prev and flags[0] == 0. and flags[1] == 1.
+                test2 = ids[1] == prev and flags[1] == 0. and flags[0] == 1.
+
+                if test1 or test2:
+
+                    test3 = ids[2] == k and flags[2] == 0. and flags[3] == 1.
+                    test4 = ids[3] == k and flags[3] == 0. and flags[2] == 1.
+
+                    if test3 or test4:
+
+                        swap_score = f32(-self.swap_cost[r]) if test1 == test3 else f32(self.swap_cost[r])
+                        temp = f32(temp + swap_score)
+
+                        if temp > max_score:
+
+                            max_score = temp
+                            max_id = float(prev)
+                            max_swap = swap_score
+
+                            if flags[0] == 1:
+                                swap_id = ids[0]
+                            if flags[1] == 1:
+                                swap_id = ids[1]
+
+        # The swap score is not reset between segments in main_loop, before the first swap it is uninitialised there
+        # and zero here
+
+        if max_swap is None:
+            max_swap = self.carry[self.prev_group[k]] if k in self.prev_group else 0.
+
+        if max_score > row[3]:
+            row[2] = max_id
+            row[3] = max_score
+            row[4] = 0.
+            row[5] = swap_id
+            row[6] = max_swap
+
+        return row, max_swap
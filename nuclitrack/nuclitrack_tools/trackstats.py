@@ -0,0 +1,97 @@
+import json
+
+import numpy as np
+
+''' Counters and timings of tracking, collected by TrackCells when it is created with stats=True. Totals are kept by
+    name, and values counted or timed between two calls of end_iteration are also recorded for that iteration, one
+    iteration for each call of addtrack or optimisetrack, so the cost of every track can be followed.
+
+    Graph construction records the candidate pairs tested by distance_mat, the edges kept within the search radius,
+    the edges left after pruning and the rows of the swap matrix. Iterations record the time of each forward pass,
+    the score and length of the track found and the swaps performed and rejected by swap_test.'''
+
+
+class TrackingStats(object):
+
+    def __init__(self):
+
+        self.counters = dict()
+        self.timings = dict()
+        self.iterations = []
+        self.current = dict()
+
+    def count(self, name, n=1):
+
+        self.counters[name] = self.counters.get(name, 0) + n
+        self.current[name] = self.current.get(name, 0) + n
+
+    def set(self, name, value):
+
+        # Counter with a value rather than a total, eg. the size of a matrix
+
+        self.counters[name] = value
+
+    def add_time(self, name, seconds):
+
+        self.timings[name] = self.timings.get(name, 0.) + seconds
+        self.current[name] = self.current.get(name, 0.) + seconds
+
+    def record(self, **values):
+
+        # Values of the current iteration given as keywords
+
+        self.current.update(values)
+
+    def end_iteration(self, **values):
+
+        ''' Record the values counted and timed since the last iteration, with values given as keywords.'''
+
+        self.record(**values)
+        self.iterations.append(self.current)
+        self.current = dict()
+
+    def iteration_table(self):
+
+        ''' Iterations as an array [iterations, columns] with the names of the columns, values an iteration did not
+        record are zero.'''
+
+        names = sorted(set(name for iteration in self.iterations for name in iteration))
+        table = np.zeros((len(self.iterations), len(names)))
+
+        for i in range(len(self.iterations)):
+            for j in range(len(names)):
+                table[i, j] = self.iterations[i].get(names[j], 0)
+
+        return table, names
+
+    def to_dict(self):
+
+        return {'counters': dict(self.counters), 'timings': dict(self.timings),
+                'iterations': [dict(iteration) for iteration in self.iterations]}
+
+    def save_json(self, file_name):
+
+        with open(file_name, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1, default=float)
+
+    def save(self, group):
+
+        ''' Write the stats to an HDF5 group, counters and timings as attributes and the iterations as a dataset with
+        the column names in its attributes.'''
+
+        for name in list(group.keys()):
+            del group[name]
+
+        for name in list(group.attrs.keys()):
+            del group.attrs[name]
+
+        for name in self.counters:
+            group.attrs[name] = self.counters[name]
+
+        for name in self.timings:
+            group.attrs['time_' + name] = self.timings[name]
+
+        table, names = self.iteration_table()
+
+        group.create_dataset('iterations', data=table)
+        group['iterations'].attrs['columns'] = np.asarray(names, dtype='S')
@@ -0,0 +1,226 @@
+import numpy as np
+
+''' Store of tracks during tracking and editing. Each track is kept as its own contiguous [m, 8] array with the
+    columns of the tracks matrix, Col0 = ID from feature matrix; Col1 = Score difference; Col2 = total Score;
+    Col3 = mitosis; Col4 = Track_id; Col5 = frame; Col6 & Col7 = swap. Tracks are indexed by track id, and
+    segments are indexed by the tracks they belong to, so finding, removing and replacing a track does not
+    depend on the total number of tracked segments.
+
+    Tracks are kept in the order they were last added, which is the row order of the tracks matrix built by
+    stacking, and to_array exports the store in that format.'''
+
+
+class TrackStore(object):
+
+    def __init__(self, tracks=None):
+
+        self.tracks = dict()
+        self.order = dict()
+        self.segment_tracks = dict()
+        self.counter = 0
+
+        if tracks is not None:
+
+            tracks = np.asarray(tracks, dtype=float)
+            ids, first = np.unique(tracks[:, 4], return_index=True)
+
+            for track_id in ids[np.argsort(first)]:
+                self.add(tracks[tracks[:, 4] == track_id, :])
+
+    def __contains__(self, track_id):
+
+        return track_id in self.tracks
+
+    def __len__(self):
+
+        return len(self.tracks)
+
+    def ids(self):
+
+        return list(self.tracks)
+
+    def max_id(self):
+
+        return max(self.tracks) if self.tracks else 0
+
+    def get(self, track_id):
+
+        return self.tracks[track_id]
+
+    def segments(self, track_id):
+
+        if track_id not in self.tracks:
+            return np.zeros(0, dtype=int)
+
+        return self.tracks[track_id][:, 0].astype(int)
+
+    def add(self, track):
+
+        ''' Add a track, the track id is taken from Col4 and replaces any track with the same id.'''
+
+        track_id = int(track[0, 4])
+
+        if track_id in self.tracks:
+            self.remove(track_id)
+
+        self.tracks[track_id] = track
+        self.order[track_id] = self.counter
+        self.counter += 1
+
+        for segment in track[:, 0].astype(int).tolist():
+            self.segment_tracks.setdefault(segment, set()).add(track_id)
+
+    def remove(self, track_id):
+
+        ''' Remove a track and return it.'''
+
+        track = self.tracks.pop(track_id)
+        del self.order[track_id]
+
+        for segment in track[:, 0].astype(int).tolist():
+
+            tracks = self.segment_tracks.get(segment)
+
+            if tracks is not None:
+
+                tracks.discard(track_id)
+
+                if not tracks:
+                    del self.segment_tracks[segment]
+
+        return track
+
+    def track_ids(self, segment):
+
+        ''' Ids of the tracks containing a segment, in row order of the tracks matrix.'''
+
+        return sorted(self.segment_tracks.get(int(segment), ()), key=self.order.get)
+
+    def insert_segment(self, track_id, row):
+
+        # Insert a row into a track before the first segment in a later frame
+
+        track = self.remove(track_id)
+        ind = np.searchsorted(track[:, 5], row[5], side='right')
+        self.add(np.insert(track, ind, row, 0))
+
+    def remove_segment(self, segment):
+
+        # Remove a segment from the first track containing it, tracks left empty are removed
+
+        track_ids = self.track_ids(segment)
+
+        if track_ids:
+
+            track = self.remove(track_ids[0])
+            track = np.delete(track, np.nonzero(track[:, 0] == segment)[0][0], 0)
+
+            if track.shape[0] > 0:
+                self.add(track)
+
+    def replace_segment(self, old, new):
+
+        # Replace a segment in all tracks containing it
+
+        for track_id in self.track_ids(old):
+
+            track = self.remove(track_id)
+            track[track[:, 0] == old, 0] = new
+            self.add(track)
+
+    def to_array(self):
+
+        ''' Tracks matrix of all tracks in row order.'''
+
+        if not self.tracks:
+            return np.zeros((0, 8))
+
+        return np.vstack([self.tracks[track_id] for track_id in sorted(self.tracks, key=self.order.get)])
+
+
+def swap_test(store, track_temp, edge_scores, count, stats=None):
+
+    ''' Apply the swaps marked on a new track by ctooltracking.track_back. Where the track took over a segment from
+    another track, the later parts of the two tracks are exchanged if the edges of the exchange exist, and the
+    scores of both tracks are updated. The swapped track is updated in the store and the new track returned.
+    Follows ctooltracking.swap_test with tracks found through the store and edge scores from a dictionary of
+    (ID before movement, ID after movement). Swaps performed and rejected for missing edges are counted in stats, a
+    trackstats.TrackingStats, if given.'''
+
+    j = 0
+
+    while j < track_temp.shape[0]:
+
+        if track_temp[j, 6] != 0:
+
+            c_frame = track_temp[j, 5]
+            swap_ids = store.track_ids(track_temp[j, 6])
+
+            if swap_ids:
+
+                track_temp[j, 6] = 0
+
+                for swap_id in swap_ids:
+
+                    swap_track = store.get(swap_id)
+
+                    if np.any(swap_track[:, 5] <= c_frame) and np.any(swap_track[:, 5] > c_frame):
+
+                        store.remove(swap_id)
+
+                        # Identify swap position
+
+                        t1 = track_temp[:j + 1, :]
+                        t2 = track_temp[j + 1:, :]
+
+                        st1 = swap_track[swap_track[:, 5] <= c_frame, :]
+                        st2 = swap_track[swap_track[:, 5] > c_frame, :]
+
+                        score_diff1 = st2[0, 2] - t1[-1, 2]
+                        score_diff2 = t2[0, 2] - st1[-1, 2]
+
+                        # Determine old and new distance cost
+
+                        d_score1 = edge_scores.get((int(t1[-1, 0]), int(st2[0, 0])))
+                        d_score2 = edge_scores.get((int(st1[-1, 0]), int(t2[0, 0])))
+
+                        d_score1a = edge_scores.get((int(t1[-1, 0]), int(t2[0, 0])))
+                        d_score2a = edge_scores.get((int(st1[-1, 0]), int(st2[0, 0])))
+
+                        if None not in (d_score1, d_score2, d_score1a, d_score2a):
+
+                            score_swap1 = st2[0, 1] - d_score2a + d_score2
+                            score_swap2 = t2[0, 1] - d_score1a + d_score1 - track_temp[j, 7]
+
+                            # Update scores
+
+                            st2[0, 1] = score_swap1
+                            t2[0, 1] = score_swap2
+
+                            st2[:, 2] = st2[:, 2] - score_diff1 + score_swap1
+                            t2[:, 2] = t2[:, 2] - score_diff2 + score_swap2
+
+                            # Perform swap
+
+                            swap_track_new = np.vstack((t1, st2))
+                            track_temp = np.vstack((st1, t2))
+
+                            swap_track_new[:, 4] = swap_id
+                            track_temp[:, 4] = count
+
+                            store.add(swap_track_new)
+
+                            if stats is not None:
+                                stats.count('swaps_performed')
+
+                            break
+
+                        else:
+                            store.add(swap_track)
+
+                            if stats is not None:
+                                stats.count('swaps_rejected')
+
+        j += 1
+
+    return track_temp
@@ -0,0 +1,149 @@
+import numpy as np
+
+from . import featuretable as ft
+from . import trackcells
+from . import trackwindows
+
+''' Online tracking of a movie while it is acquired. StreamTracker takes the tracking rows of one frame at a time, as
+    returned by extractfeats.framefeats with global IDs and with the classifier probabilities filled in, and keeps
+    only a window of recent frames. Each time window frames have arrived the window is tracked with TrackCells and
+    joined to the previous window as in trackwindows, windows overlap by overlap frames and tracks switch between
+    windows at the middle of the overlap.
+
+    Rows of frames before the next switch can no longer change and are returned as finalised track rows, with the
+    columns of the tracks matrix and track ids that are unique over the whole movie. The frames of the overlap and
+    the rows of tracks that reach into it are all that is kept between windows, so memory is bounded by the window
+    size, and tracks are available window - overlap frames after they are acquired.
+
+    As in trackcells.label_tracks, segments assigned to more than one track are removed from the finalised rows and
+    counted in segment_count and double_segment. All rows of a frame are finalised together, so every assignment of
+    a segment is in the same batch. The rows returned by add_frame and finish together give the same tracks as
+    trackwindows.track_windows with the same window and overlap.'''
+
+
+class StreamTracker(object):
+
+    def __init__(self, track_param, window=30, overlap=10):
+
+        if not 0 < overlap < window:
+            raise ValueError('Overlap must be positive and shorter than the window')
+
+        self.track_param = track_param
+        self.window = window
+        self.overlap = overlap
+
+        self.frames = []  # Tracking rows of the frames in the window
+        self.start = 0  # First frame of the window
+        self.cut = 0  # First frame that is not finalised
+        self.recent = dict()  # Rows of tracks from the start of the next window, by track id
+        self.count = 1
+        self.segment_count = 0  # Finalised segments
+        self.double_segment = 0  # Finalised segments removed for being in more than one track
+
+    def add_frame(self, tracking):
+
+        ''' Add the tracking rows of the next frame. Returns the track rows [m, 8] finalised by the frame, empty
+        until the window is full.'''
+
+        self.frames.append(np.asarray(tracking, dtype=float))
+
+        if len(self.frames) < self.window:
+            return np.zeros((0, 8))
+
+        return self.track_frames(last=False)
+
+    def finish(self):
+
+        ''' Track the frames left at the end of the movie. Returns the remaining track rows.'''
+
+        if not self.frames:
+            rows = np.zeros((0, 8))
+
+        elif len(self.frames) > self.overlap or self.start == 0:
+            rows = self.track_frames(last=True)
+
+        else:
+
+            # No frames since the last window, its rows in the overlap are final
+
+            rows = [track[track[:, 5] >= self.cut, :] for track in self.recent.values()]
+            rows = self.remove_double_segments(np.vstack([np.zeros((0, 8))] + rows))
+
+        self.frames = []
+        self.recent = dict()
+
+        return rows
+
+    def track_frames(self, last):
+
+        # Track the window, join it to the previous window and return the rows up to the next switch
+
+        end = self.start + len(self.frames)
+        next_start = self.start + self.window - self.overlap
+        next_cut = end if last else (next_start + end + 1) // 2
+
+        rows = np.vstack(self.frames)
+
+        local = np.zeros((rows.shape[0] + 1, rows.shape[1]))
+        local[1:, :] = rows
+        local[1:, ft.ID] = np.arange(1, rows.shape[0] + 1)
+        local[1:, ft.FRAME] -= self.start
+
+        fragment = trackwindows.track_window(self.track_param, local, self.start, end, 0)
+
+        ids = np.concatenate(([0], rows[:, ft.ID]))
+
+        for col in [0, 3, 6]:  # Segment, mitotic parent and swap IDs
+            fragment[:, col] = ids[fragment[:, col].astype(int)]
+
+        parts = [fragment[fragment[:, 4] == i, :] for i in np.unique(fragment[:, 4])]
+        matches = trackwindows.match_parts(parts, self.recent, self.start, self.start + self.overlap)
+
+        finalised = [np.zeros((0, 8))]
+        recent = dict()
+
+        # Segments of the previous window already finalised in the overlap
+
+        taken = np.concatenate([track[track[:, 5] < self.cut, 0] for track in self.recent.values()] + [np.zeros(0)])
+
+        for k in range(len(parts)):
+
+            if k in matches:
+
+                g = matches[k]
+                part = parts[k][parts[k][:, 5] >= self.cut, :]
+                part[:, 4] = g
+                track = np.vstack((self.recent[g][self.recent[g][:, 5] < self.cut, :], part))
+
+            else:
+
+                part = trackwindows.new_track_rows(parts[k], self.cut, taken)
+
+                if part.shape[0] == 0:
+                    continue
+
+                g = self.count
+                part[:, 4] = g
+                track = part
+                self.count += 1
+
+            finalised.append(part[part[:, 5] < next_cut, :])
+            recent[g] = track[track[:, 5] >= next_start, :]
+
+        # Keep the frames of the overlap with the next window
+
+        self.frames = self.frames[self.window - self.overlap:]
+        self.start = next_start
+        self.cut = next_cut
+        self.recent = recent
+
+        return self.remove_double_segments(np.vstack(finalised))
+
+    def remove_double_segments(self, rows):
+
+        rows, segment_count, double_segment = trackcells.remove_double_segments(rows)
+
+        self.segment_count += segment_count
+        self.double_segment += double_segment
+
+        return rows
@@ -0,0 +1,221 @@
+import multiprocessing
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+
+from . import featuretable as ft
+from . import trackcells
+
+''' Tracking in overlapping time windows. The movie is split into windows of window frames that overlap by overlap
+    frames, each window is tracked independently with TrackCells in its own process and the track fragments are
+    joined across the overlaps. A fragment is joined to the track of the previous window that shares the most
+    segments with it in the overlap, the joined track follows the previous window up to the middle of the overlap
+    and the new window after it. Fragments that match no track start new tracks, keeping their segments before the
+    middle of the overlap that no track of the previous window holds.
+
+    Accuracy/speed trade-off: the cost of tracking grows faster than linearly with the number of frames, so windows
+    tracked in parallel are much faster on long movies, but a track can only use evidence from within its window.
+    Tracks whose windows disagree in the overlap are split into two tracks, scores in Col1 and Col2 are relative to
+    the start of the window, and mitosis and swaps are only found within a window. Longer overlaps give more
+    agreement at the cost of tracking frames twice, the overlap should be at least the max gap, track_param[6].'''
+
+
+def window_bounds(frames, window, overlap):
+
+    # First and last (exclusive) frame of overlapping windows covering the movie
+
+    step = window - overlap
+    bounds = [(0, min(window, frames))]
+
+    while bounds[-1][1] < frames:
+        start = bounds[-1][0] + step
+        bounds.append((start, min(start + window, frames)))
+
+    return bounds
+
+
+def window_features(features, start, end):
+
+    ''' Features of the frames of a window with IDs renumbered from one and frames from zero, and the offset that
+    returns window IDs to movie IDs.'''
+
+    a, b = 1 + np.searchsorted(features[1:, ft.FRAME], [start, end], side='left')
+
+    local = np.zeros((b - a + 1, features.shape[1]))
+    local[1:, :] = features[a:b, :]
+    local[1:, ft.ID] = np.arange(1, b - a + 1)
+    local[1:, ft.FRAME] -= start
+
+    return local, a - 1
+
+
+def track_window(track_param, features, start, end, offset, **options):
+
+    # Track one window with the options of TrackCells and return its tracks with movie IDs and frames
+
+    if features.shape[0] < 2:
+        return np.zeros((0, 8))
+
+    options.setdefault('incremental', True)
+
+    tracking_object = trackcells.TrackCells(features=features, frames=end - start, track_param=track_param,
+                                            **options)
+
+    while tracking_object.addtrack():
+        pass
+
+    for i in range(2):
+        while tracking_object.optimisetrack():
+            pass
+
+    tracks = tracking_object.found_tracks()
+    tracks = tracks[tracks[:, 0] != 0, :]
+
+    for col in [0, 3, 6]:  # Segment, mitotic parent and swap IDs
+        tracks[tracks[:, col] != 0, col] += offset
+
+    tracks[:, 5] += start
+
+    return tracks
+
+
+def match_parts(parts, tracks, start, end):
+
+    ''' Match the track fragments of a window, parts, to the tracks of the previous window, a dictionary by track
+    id, where the windows overlap from frame start to end (exclusive). Pairs are matched greedily by the number of
+    segments they share in the overlap. Returns a dictionary from part index to track id.'''
+
+    # Owner of each segment of the previous window in the overlap
+
+    owner = dict()
+
+    for g in tracks:
+        track = tracks[g]
+        for segment in track[track[:, 5] >= start, 0].astype(int).tolist():
+            owner[segment] = g
+
+    votes = dict()
+
+    for k in range(len(parts)):
+        part = parts[k]
+        for segment in part[part[:, 5] < end, 0].astype(int).tolist():
+            if segment in owner:
+                votes[(k, owner[segment])] = votes.get((k, owner[segment]), 0) + 1
+
+    matches = dict()
+    used = set()
+
+    for (k, g), n in sorted(votes.items(), key=lambda item: (-item[1], item[0])):
+        if k not in matches and g not in used:
+            matches[k] = g
+            used.add(g)
+
+    return matches
+
+
+def new_track_rows(part, cut, taken):
+
+    # Rows of a fragment that matched no track, rows before the cut are kept unless their segments are taken
+
+    return part[np.logical_or(part[:, 5] >= cut, np.logical_not(np.isin(part[:, 0], taken))), :]
+
+
+def stitch_tracks(fragments, bounds):
+
+    ''' Join the tracks of consecutive windows. Fragments are matched greedily to the tracks of the previous window
+    by the number of segments they share in the overlap, and matched tracks switch from the previous to the new
+    window at the middle of the overlap.'''
+
+    tracks = dict()
+    active = []
+    count = 1
+
+    for w in range(len(bounds)):
+
+        window_tracks = fragments[w]
+        ids = np.unique(window_tracks[:, 4])
+        parts = [window_tracks[window_tracks[:, 4] == i, :] for i in ids]
+
+        cut = bounds[w][0]
+        matches = dict()
+        taken = np.zeros(0)
+
+        if w > 0:
+
+            start, end = bounds[w][0], bounds[w - 1][1]
+            cut = (start + end + 1) // 2
+
+            matches = match_parts(parts, dict((g, tracks[g]) for g in active), start, end)
+            used = set(matches.values())
+
+            # Tracks of the previous window that do not continue end at the cut
+
+            for g in active:
+                if g not in used:
+                    tracks[g] = tracks[g][tracks[g][:, 5] < cut, :]
+                    if tracks[g].shape[0] == 0:
+                        del tracks[g]
+
+            # Segments the previous window keeps before the cut
+
+            taken = np.concatenate([tracks[g][tracks[g][:, 5] < cut, 0] for g in active if g in tracks] + [taken])
+
+        active = []
+
+        for k in range(len(parts)):
+
+            if k in matches:
+
+                g = matches[k]
+                part = parts[k][parts[k][:, 5] >= cut, :]
+                part[:, 4] = g
+                tracks[g] = np.vstack((tracks[g][tracks[g][:, 5] < cut, :], part))
+                active.append(g)
+                continue
+
+            part = new_track_rows(parts[k], cut, taken)
+
+            if part.shape[0] > 0:
+
+                part[:, 4] = count
+                tracks[count] = part
+                active.append(count)
+                count += 1
+
+    return np.vstack([np.zeros((1, 8))] + [tracks[g] for g in sorted(tracks)])
+
+
+def track_windows(features, frames, track_param, window=100, overlap=20, parallel=True, **options):
+
+    ''' Track a movie in overlapping windows of window frames, see the module notes for the trade-off. Each window is
+    tracked by TrackCells with options, such as engine, except checkpoint and stats. Returns the tracks, features,
+    segment count and double segment count as TrackCells.get.'''
+
+    if not 0 < overlap < window:
+        raise ValueError('Overlap must be positive and shorter than the window')
+
+    features = np.asarray(features, dtype=float)
+    bounds = window_bounds(frames, window, overlap)
+
+    jobs = []
+
+    for start, end in bounds:
+        local, offset = window_features(features, start, end)
+        jobs.append((local, start, end, offset))
+
+    if parallel and len(jobs) > 1:
+
+        cpu_count = multiprocessing.cpu_count()
+        pool = Pool(min(cpu_count, len(jobs)))
+        fragments = pool.starmap(partial(track_window, track_param, **options), jobs)
+
+        pool.close()
+        pool.join()
+
+    else:
+        fragments = [track_window(track_param, *job, **options) for job in jobs]
+
+    tracks = stitch_tracks(fragments, bounds)
+
+    return trackcells.label_tracks(tracks, features)
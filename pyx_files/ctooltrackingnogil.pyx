@@ -0,0 +1,464 @@
+import numpy as np
+cimport numpy as np
+cimport cython
+
+from libc.math cimport sqrt
+
+''' Typed memoryview versions of the ctooltracking kernels distance_mat, forward_pass (with main_loop) and
+    track_back. Arguments and results are those of ctooltracking, features, edges, swaps and scores are float64 and
+    states are np.int_, the platform's default integer as in ctooltracking. The loops run without the GIL so
+    tracking can run on a background thread, the GIL is only held to allocate the returned arrays.
+
+    Results are identical to ctooltracking except where it is undefined, max_swap and swap_id start at zero so
+    score Col6 is zero when no swap is made, edges of a segment are ordered by gap then ID before movement as in
+    trackgraph.distance_mat, and track_back stops its swap search at the zero row of the swap matrix.'''
+
+DTYPE1 = np.float64
+DTYPE2 = np.int_
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t _distance_mat(double[:, :] features, Py_ssize_t[:] bounds, int frames, double[:] param,
+                              double[:, :] edges, bint fill) nogil:
+
+    cdef Py_ssize_t i, j, k, count = 0
+    cdef int t
+    cdef int max_t = <int>param[6]
+    cdef float d
+
+    for i in range(frames):
+        for k in range(bounds[i], bounds[i + 1]):
+            for t in range(1, max_t):
+
+                if t > i:
+                    break
+
+                for j in range(bounds[i - t], bounds[i - t + 1]):
+
+                    if features[j, 0] == 0:
+                        continue
+
+                    d = sqrt((features[k, 3] - features[j, 3])**2 + (features[k, 2] - features[j, 2])**2)
+
+                    if d < param[1]:
+
+                        if fill:
+                            edges[count, 0] = i  # Frame of cell after movement
+                            edges[count, 1] = features[j, 0]  # Index of the cell before movement
+                            edges[count, 2] = features[k, 0]  # Index of the cell after movement
+                            edges[count, 3] = 1 - (param[0]*d)**2  # Distance score function
+                            edges[count, 4] = t  # Movement gap
+
+                        count += 1
+
+    return count
+
+
+def distance_mat(features, int frames, param):
+
+    features = np.ascontiguousarray(features, dtype=DTYPE1)
+    param = np.ascontiguousarray(param, dtype=DTYPE1)
+
+    cdef np.ndarray bounds_arr = np.searchsorted(features[:, 1], np.arange(frames + 1), side='left').astype(np.intp)
+
+    cdef double[:, :] f = features
+    cdef double[:] p = param
+    cdef Py_ssize_t[:] bounds = bounds_arr
+    cdef double[:, :] e
+    cdef Py_ssize_t count
+
+    # Count edges, then fill them
+
+    e = np.zeros([1, 5], dtype=DTYPE1)
+
+    with nogil:
+        count = _distance_mat(f, bounds, frames, p, e, False)
+
+    edges = np.zeros([count + 1, 5], dtype=DTYPE1)
+    e = edges
+
+    with nogil:
+        _distance_mat(f, bounds, frames, p, e, True)
+
+    return edges
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _main_loop(double[:, :] scores, double[:, :] features, double[:, :] edges, double[:, :] swaps,
+                     np.int_t[:] states, double[:] param) nogil:
+
+    cdef Py_ssize_t hgt2 = edges.shape[0]
+    cdef Py_ssize_t count2 = 0
+    cdef Py_ssize_t count_swap = 0
+    cdef Py_ssize_t count_frame = 0
+
+    cdef float dist_id = edges[0, 2]
+    cdef float cell_id = edges[0, 2]
+    cdef Py_ssize_t count1 = <Py_ssize_t>edges[0, 2]
+
+    cdef float frame, add_score, swap_score, temp_score, prev_id
+    cdef float swap_id = 0
+    cdef float max_swap = 0
+    cdef bint test1, test2, test3, test4
+    cdef Py_ssize_t hgt_swap = swaps.shape[0] - 1
+    cdef float max_score = -100000
+    cdef float max_id = 0
+    cdef np.int_t s
+
+    while count2 < hgt2:
+
+        dist_id = edges[count2, 2]
+
+        if dist_id != cell_id:
+
+            scores[count1, 1] = cell_id
+            if max_score > scores[count1, 3]:
+
+                scores[count1, 2] = max_id
+                scores[count1, 3] = max_score
+                scores[count1, 4] = 0
+                scores[count1, 5] = swap_id
+                scores[count1, 6] = max_swap
+
+            count1 += <Py_ssize_t>(dist_id - cell_id)
+            cell_id = dist_id
+            max_score = -100000
+
+        s = states[count1]
+
+        prev_id = edges[count2, 1]
+
+        # Track cost plus cost of adding track to the segment in question
+
+        if s < 2:
+            add_score = scores[<Py_ssize_t>prev_id, 3] + param[2]*features[count1, 7 + s] - param[3]*features[count1, 6 + s]
+        else:
+            add_score = -10000
+
+        # Cost associated with movement to the segment in question
+
+        temp_score = add_score + edges[count2, 3] - edges[count2, 4] + 1
+
+        if temp_score > max_score:
+
+            max_score = temp_score
+            max_id = prev_id
+            swap_id = 0
+
+        # Identify frame starting point in swap matrix
+
+        frame = edges[count2, 0]
+
+        while frame > swaps[count_swap, 0] and count_swap < hgt_swap:
+            count_swap += 1
+
+        # Identify swaps in frame
+
+        count_frame = count_swap
+
+        while frame == swaps[count_frame, 0] and count_frame < hgt_swap:
+
+            test1 = swaps[count_frame, 1] == prev_id
+            test2 = swaps[count_frame, 2] == prev_id
+
+            if test1 or test2:
+
+                test3 = swaps[count_frame, 3] == dist_id
+                test4 = swaps[count_frame, 4] == dist_id
+
+                if test3 or test4:
+
+                    test1 = test1 and (swaps[count_frame, 5] == 0.) and (swaps[count_frame, 6] == 1.)
+                    test2 = test2 and (swaps[count_frame, 6] == 0.) and (swaps[count_frame, 5] == 1.)
+
+                    if test1 or test2:
+
+                        test3 = test3 and (swaps[count_frame, 7] == 0.) and (swaps[count_frame, 8] == 1.)
+                        test4 = test4 and (swaps[count_frame, 8] == 0.) and (swaps[count_frame, 7] == 1.)
+
+                        if test3 or test4:
+
+                            if test1 == test3:
+                                swap_score = -swaps[count_frame, 9]
+                            else:
+                                swap_score = swaps[count_frame, 9]
+
+                            temp_score = temp_score + swap_score
+
+                            if temp_score > max_score:
+
+                                max_score = temp_score
+                                max_id = prev_id
+                                max_swap = swap_score
+
+                                if swaps[count_frame, 5] == 1:
+                                    swap_id = swaps[count_frame, 1]
+
+                                if swaps[count_frame, 6] == 1:
+                                    swap_id = swaps[count_frame, 2]
+
+            count_frame += 1
+
+        count2 += 1
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _forward_pass(double[:, :] scores, double[:, :] features, double[:, :] edges, double[:, :] swaps,
+                        np.int_t[:] states, double[:] param) nogil:
+
+    cdef Py_ssize_t hgt1 = features.shape[0]
+    cdef Py_ssize_t hgt2 = edges.shape[0]
+
+    cdef Py_ssize_t count1 = 0
+    cdef float temp_score, add_score
+    cdef float max_score = -100000
+    cdef float max_id = 0
+    cdef float temp_edge
+    cdef np.int_t s
+
+    # First frame entry states
+
+    while count1 < hgt1 and features[count1, 1] == 0:
+
+        s = states[count1]
+
+        if s < 2:
+            scores[count1, 3] = features[count1, 7 + s] - features[count1, 6 + s]
+            scores[count1, 1] = features[count1, 0]
+        else:
+            scores[count1, 3] = -100000
+
+        count1 += 1
+
+    # Edge entry states
+
+    cdef Py_ssize_t count3 = count1
+
+    while count3 < hgt1:
+
+        s = states[count3]
+        scores[count3, 1] = count3
+
+        if s < 2:
+
+            temp_edge = 1 - (param[0]*features[count3, 4])**2 + features[count3, 7 + s] - features[count3, 6 + s]
+
+            if temp_edge > -3.:
+                scores[count3, 3] = temp_edge
+            else:
+                scores[count3, 3] = -3.
+
+            scores[count3, 0] = features[count3, 1]
+
+        else:
+
+            scores[count1, 3] = -100000  # As ctooltracking, marks the first segment after the entry frame
+
+        count3 += 1
+
+    # Mitotic entry states
+
+    cdef Py_ssize_t cell_id = <Py_ssize_t>edges[0, 2]
+    cdef Py_ssize_t dist_id, previous_cell_id
+
+    cdef Py_ssize_t count4 = <Py_ssize_t>edges[0, 2]
+    cdef Py_ssize_t count5 = 0
+
+    while count5 < hgt2:
+
+        dist_id = <Py_ssize_t>edges[count5, 2]
+
+        if dist_id != cell_id:
+
+            if max_score > scores[count4, 3]:
+
+                scores[count4, 2] = max_id
+                scores[count4, 3] = max_score
+                scores[count4, 4] = 1
+
+            count4 += dist_id - cell_id
+            cell_id = dist_id
+            max_score = -100000
+
+        s = states[count4]
+
+        previous_cell_id = <Py_ssize_t>edges[count5, 1]
+
+        if states[previous_cell_id] > 0:
+
+            # Migration component
+
+            if s < 2:
+                add_score = param[2]*features[count4, 7 + s] - param[3]*features[count4, 6 + s]
+            else:
+                add_score = -100000
+
+            # Add distance subtract gap
+
+            temp_score = add_score + edges[count5, 3] - param[5]*(edges[count5, 4] + 1)
+
+            # Mitosis component
+
+            temp_score = temp_score + (features[previous_cell_id, 9] + features[count4, 10]) - param[4]
+
+            if temp_score > max_score:
+
+                max_score = temp_score
+                max_id = edges[count5, 1]
+
+        count5 += 1
+
+    _main_loop(scores, features, edges, swaps, states, param)
+
+
+def main_loop(scores, features, edges, swaps, states, param):
+
+    cdef double[:, :] sc = scores
+    cdef double[:, :] f = features
+    cdef double[:, :] e = edges
+    cdef double[:, :] sw = swaps
+    cdef np.int_t[:] st = states
+    cdef double[:] p = np.ascontiguousarray(param, dtype=DTYPE1)
+
+    with nogil:
+        _main_loop(sc, f, e, sw, st, p)
+
+    return scores
+
+
+def forward_pass(features, edges, swaps, states, param):
+
+    scores = np.zeros([features.shape[0], 7], dtype=DTYPE1)
+
+    cdef double[:, :] sc = scores
+    cdef double[:, :] f = features
+    cdef double[:, :] e = edges
+    cdef double[:, :] sw = swaps
+    cdef np.int_t[:] st = states
+    cdef double[:] p = np.ascontiguousarray(param, dtype=DTYPE1)
+
+    with nogil:
+        _forward_pass(sc, f, e, sw, st, p)
+
+    return scores
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t _track_start(double[:, :] score_mat, Py_ssize_t *length) nogil:
+
+    # Segment with the best score and the number of links of the track ending at it
+
+    cdef Py_ssize_t i, ind
+    cdef Py_ssize_t max_ind = 0
+    cdef float max_score = 0
+
+    for i in range(score_mat.shape[0]):
+        if score_mat[i, 3] > max_score:
+            max_ind = i
+            max_score = score_mat[i, 3]
+
+    ind = max_ind
+    length[0] = 0
+
+    while score_mat[ind, 2] != 0 and score_mat[ind, 4] == 0:
+        ind = <Py_ssize_t>score_mat[ind, 2]
+        length[0] += 1
+
+    return max_ind
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _track_back(double[:, :] score_mat, np.int_t[:] states, double[:, :] swaps, double[:, :] track,
+                      Py_ssize_t max_ind, Py_ssize_t track_length) nogil:
+
+    cdef Py_ssize_t i, ind_prev
+    cdef Py_ssize_t ind = max_ind
+    cdef Py_ssize_t count = track_length
+
+    # Maximum frame where swap may occur
+
+    cdef Py_ssize_t swap_count = swaps.shape[0] - 1
+
+    while score_mat[ind, 2] != 0 and score_mat[ind, 4] == 0:
+
+        track[count, 5] = score_mat[ind, 0]  # Current frame of tracking
+        track[count, 2] = score_mat[ind, 3]  # Total score of track
+        track[count, 0] = ind  # ID from score matrix
+
+        states[ind] += 1
+
+        ind_prev = <Py_ssize_t>score_mat[ind, 2]
+
+        count -= 1
+
+        track[count, 6] = score_mat[ind, 5]  # Mark any swaps that need performing
+        track[count, 7] = score_mat[ind, 6]
+
+        # Identify possible swaps
+
+        while swap_count > 0 and swaps[swap_count, 0] > score_mat[ind, 0]:
+            swap_count -= 1
+
+        # Update availability of swaps
+
+        while swap_count > 0 and swaps[swap_count, 0] == score_mat[ind, 0]:
+
+            if ind_prev == swaps[swap_count, 1] and ind == swaps[swap_count, 3]:
+                swaps[swap_count, 5] = 1
+                swaps[swap_count, 7] = 1
+
+            if ind_prev == swaps[swap_count, 2] and ind == swaps[swap_count, 3]:
+                swaps[swap_count, 6] = 1
+                swaps[swap_count, 7] = 1
+
+            if ind_prev == swaps[swap_count, 1] and ind == swaps[swap_count, 4]:
+                swaps[swap_count, 5] = 1
+                swaps[swap_count, 8] = 1
+
+            if ind_prev == swaps[swap_count, 2] and ind == swaps[swap_count, 4]:
+                swaps[swap_count, 6] = 1
+                swaps[swap_count, 8] = 1
+
+            swap_count -= 1
+
+        ind = ind_prev
+
+    track[count, 5] = score_mat[ind, 0]
+    track[count, 2] = score_mat[ind, 3]
+    track[count, 0] = ind  # ID of first tracked segment
+    states[ind] += 1
+
+    if score_mat[ind, 4] == 1:
+        track[count, 3] = score_mat[ind, 2]  # Flag mitotic event
+
+    # Calculate gradients
+
+    track[0, 1] = track[0, 2]
+
+    for i in range(1, track_length + 1):
+        track[i, 1] = track[i, 2] - track[i - 1, 2]  # Score difference
+
+
+def track_back(score_mat, states, swaps):
+
+    cdef double[:, :] sm = score_mat
+    cdef np.int_t[:] st = states
+    cdef double[:, :] sw = swaps
+    cdef double[:, :] tr
+    cdef Py_ssize_t max_ind, track_length
+
+    with nogil:
+        max_ind = _track_start(sm, &track_length)
+
+    track = np.zeros([track_length + 1, 8], dtype=DTYPE1)
+    tr = track
+
+    with nogil:
+        _track_back(sm, st, sw, tr, max_ind, track_length)
+
+    return track, swaps, states
@@ -11,6 +11,7 @@ setup(
     packages=['nuclitrack', 'nuclitrack.nuclitrack_tools', 'nuclitrack.nuclitrack_ctools'],
     ext_modules=[
         Extension("ctooltracking", ["nuclitrack/nuclitrack_ctools/ctooltracking.c"], include_dirs=[numpy.get_include()]),
+        Extension("ctooltrackingnogil", ["nuclitrack/nuclitrack_ctools/ctooltrackingnogil.c"], include_dirs=[numpy.get_include()]),
         Extension("classifyim", ["nuclitrack/nuclitrack_ctools/classifyim.c"], include_dirs=[numpy.get_include()]),
         Extension("ctoolsegmentation", ["nuclitrack/nuclitrack_ctools/ctoolsegmentation.c"], include_dirs=[numpy.get_include()]),
         Extension("numpytoimage", ["nuclitrack/nuclitrack_ctools/numpytoimage.c"], include_dirs=[numpy.get_include()])]
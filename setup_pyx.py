@@ -12,6 +12,7 @@ setup(
     packages=['nuclitrack'],
     ext_modules=cythonize([
         Extension("ctooltracking", ["pyx_files/ctooltracking.pyx"], include_dirs=[numpy.get_include()]),
+        Extension("ctooltrackingnogil", ["pyx_files/ctooltrackingnogil.pyx"], include_dirs=[numpy.get_include()]),
         Extension("classifyim", ["pyx_files/classifyim.pyx"], include_dirs=[numpy.get_include()]),
         Extension("ctoolsegmentation", ["pyx_files/ctoolsegmentation.pyx"], include_dirs=[numpy.get_include()]),
         Extension("numpytoimage", ["pyx_files/numpytoimage.pyx"], include_dirs=[numpy.get_include()])])
@@ -0,0 +1,157 @@
+import multiprocessing
+import os
+import shutil
+import signal
+
+import h5py
+import numpy as np
+import pytest
+
+pytest.importorskip('ctooltracking')
+
+from nuclitrack import batchanalyse
+from nuclitrack.nuclitrack_tools import classifycells
+from nuclitrack.nuclitrack_tools import featuretable as ft
+from nuclitrack.nuclitrack_tools import trackcells
+
+
+def run_batch(movie_dir, output, **options):
+
+    batchanalyse.batch_analyse(os.path.join(movie_dir, 'file_list_gt.txt'), os.path.join(movie_dir, 'params.hdf5'),
+                               output, **options)
+
+
+def killed_run(movie_dir, output):
+
+    # Run in a child process that kills itself a few steps into optimisation, after adding was checkpointed
+
+    step = trackcells.TrackCells.step
+
+    def step_and_kill(self, save=False):
+
+        step(self, save)
+
+        if not self.adding and self.optimise_count == 3:
+            os.kill(os.getpid(), signal.SIGKILL)
+
+    trackcells.TrackCells.step = step_and_kill
+    run_batch(movie_dir, output)
+
+
+def fail(*args, **kwargs):
+
+    raise AssertionError('Stage should have been resumed')
+
+
+def test_rerun_replaces_outputs(simulated_movie, tmp_path, monkeypatch):
+
+    output = str(tmp_path / 'fov')
+
+    run_batch(simulated_movie['path'], output)
+
+    with h5py.File(output + '.hdf5', 'r') as fov:
+        tracks = fov['tracks'][...]
+
+    monkeypatch.setattr(batchanalyse, 'segment_features', fail)
+    monkeypatch.setattr(classifycells, 'classifycells', fail)
+
+    run_batch(simulated_movie['path'], output)
+
+    with h5py.File(output + '.hdf5', 'r') as fov:
+        assert fov['tracks'].shape == tracks.shape
+
+
+def test_resume_after_kill(simulated_movie, tmp_path, monkeypatch):
+
+    output = str(tmp_path / 'fov')
+
+    child = multiprocessing.get_context('fork').Process(target=killed_run, args=(simulated_movie['path'], output))
+    child.start()
+    child.join()
+
+    assert child.exitcode == -signal.SIGKILL
+
+    with h5py.File(output + '.hdf5', 'r') as fov:
+        checkpoint = fov['tracking_checkpoint']
+        assert 'tracks' in checkpoint and 'tracks' not in fov
+        assert not checkpoint.attrs['adding']
+
+    # Segmentation, classification and adding tracks were finished before the kill and are not repeated
+
+    monkeypatch.setattr(batchanalyse, 'segment_features', fail)
+    monkeypatch.setattr(classifycells, 'classifycells', fail)
+    monkeypatch.setattr(trackcells.TrackCells, 'addtrack', fail)
+
+    run_batch(simulated_movie['path'], output)
+
+    with h5py.File(output + '.hdf5', 'r') as fov:
+        assert fov['tracks'].shape[0] > simulated_movie['frames']
+        assert 'tracks' not in fov['tracking_checkpoint']
+
+
+@pytest.mark.parametrize('option', [{'track_time': 1.}, {'track_stats': True}])
+def test_whole_movie_options_not_for_windows(simulated_movie, tmp_path, option):
+
+    with pytest.raises(ValueError):
+        run_batch(simulated_movie['path'], str(tmp_path / 'fov'), track_window=8, **option)
+
+
+def test_budget_resumes(simulated_movie, tmp_path, monkeypatch):
+
+    output = str(tmp_path / 'fov')
+
+    run_batch(simulated_movie['path'], output, track_time=0.)
+
+    with h5py.File(output + '.hdf5', 'r') as fov:
+        assert 'tracks' in fov['tracking_checkpoint']
+
+    monkeypatch.setattr(batchanalyse, 'segment_features', fail)
+    monkeypatch.setattr(classifycells, 'classifycells', fail)
+
+    run_batch(simulated_movie['path'], output)
+
+    with h5py.File(output + '.hdf5', 'r') as fov:
+        assert fov['tracks'].shape[0] > simulated_movie['frames']
+        assert 'tracks' not in fov['tracking_checkpoint']
+
+
+def test_retrained_classifier(simulated_movie, tmp_path, monkeypatch):
+
+    movie_dir = str(tmp_path / 'movie')
+    output = str(tmp_path / 'fov')
+
+    shutil.copytree(simulated_movie['path'], movie_dir)
+    run_batch(movie_dir, output)
+
+    with h5py.File(output + '.hdf5', 'r') as fov:
+        probabilities = fov['features']['tracking'][1:, ft.P_ZERO:ft.P_MITOSIS_EXIT + 1]
+
+    assert np.any(probabilities[:, ft.P_ONE - ft.P_ZERO] < 1)
+
+    # Train the cells as single cells only, the labels are still reused
+
+    with h5py.File(os.path.join(movie_dir, 'params.hdf5'), 'r+') as params:
+        tracking = params['training']['tracking']
+        tracking[1:, ft.P_ZERO:ft.P_MITOSIS_EXIT + 1] = 0
+        tracking[1:, ft.P_ONE] = 1
+
+    monkeypatch.setattr(batchanalyse, 'segment_features', fail)
+
+    run_batch(movie_dir, output)
+
+    with h5py.File(output + '.hdf5', 'r') as fov:
+        assert np.all(fov['features']['tracking'][1:, ft.P_ONE] == 1)
+
+
+@pytest.mark.parametrize('mode', [{'track_window': 8, 'track_overlap': 3}, {'track_regions': (2, 2)}])
+def test_options_for_windows_and_regions(simulated_movie, tmp_path, mode):
+
+    output = str(tmp_path / 'fov')
+
+    run_batch(simulated_movie['path'], output, track_mitosis=0.5, **mode)
+
+    with h5py.File(output + '.hdf5', 'r') as fov:
+        tracks = fov['tracks'][...]
+        parents = tracks[tracks[:, 3] > 0, 3].astype(int)
+        assert len(parents) > 0
+        assert np.all(fov['features']['tracking'][...][parents, ft.P_MITOSIS_ENTRY] >= 0.5)
@@ -0,0 +1,60 @@
+import sys
+
+import pytest
+
+from nuclitrack import benchmark
+
+
+def results(stages):
+
+    return {'sizes': {'small': {'stages': stages}}}
+
+
+def test_compare():
+
+    baseline = results({'addtrack': {'time': 1., 'peak_mb': 10.}, 'save_csv': {'time': 1., 'peak_mb': 10.},
+                        'segment_image': {'error': 'TypeError()'}})
+
+    unchanged = results({'addtrack': {'time': 1.1, 'peak_mb': 10.}, 'save_csv': {'time': 1., 'peak_mb': 10.},
+                         'segment_image': {'error': 'TypeError()'}})
+    assert benchmark.compare(unchanged, baseline) == []
+
+    regressions = benchmark.compare(results({'addtrack': {'time': 2., 'peak_mb': 10.},
+                                             'segment_image': {'error': 'TypeError()'}}), baseline)
+    assert [r.split(':')[0] for r in regressions] == ['small addtrack time', 'small save_csv']
+
+    failed = results({'addtrack': {'error': 'ValueError()'}, 'save_csv': {'time': 1., 'peak_mb': 10.}})
+    regressions = benchmark.compare(failed, baseline)
+    assert [r.split(':')[0] for r in regressions] == ['small addtrack']
+
+
+def test_missing_baseline(tmp_path):
+
+    with pytest.raises(FileNotFoundError):
+        benchmark.run_benchmarks(str(tmp_path / 'results.json'), str(tmp_path / 'baseline.json'))
+
+
+def test_failures():
+
+    baseline = results({'addtrack': {'time': 1., 'peak_mb': 10.}, 'segment_image': {'error': 'TypeError()'}})
+    failed = results({'addtrack': {'error': 'ValueError()'}, 'segment_image': {'error': 'TypeError()'}})
+
+    assert benchmark.failures(failed, baseline) == [
+        'small addtrack: failed with ValueError()',
+        'small segment_image: failed with TypeError(), also in the baseline so not compared']
+
+
+# Run as a script to benchmark every stage, exits with 1 on a regression, see nuclitrack.benchmark. Options are
+# --update-baseline to save the results as the baseline and --sizes=small,medium to run part of the ladder
+
+if __name__ == '__main__':
+
+    sizes = None
+
+    for arg in sys.argv[1:]:
+        if arg.startswith('--sizes='):
+            sizes = arg[len('--sizes='):].split(',')
+
+    if benchmark.run_benchmarks('benchmark_results.json', 'benchmark_baseline.json', sizes=sizes,
+                                update_baseline='--update-baseline' in sys.argv):
+        sys.exit(1)
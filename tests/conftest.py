@@ -0,0 +1,41 @@
+import os
+
+import h5py
+import numpy as np
+import pytest
+
+from nuclitrack.nuclitrack_tools import classifycells
+from nuclitrack.nuclitrack_tools import extractfeats
+from nuclitrack.nuclitrack_tools import featuretable
+from nuclitrack.nuclitrack_tools import loadimages
+from nuclitrack.nuclitrack_tools import movieobj
+from nuclitrack.nuclitrack_tools import simulatemovie
+
+
+@pytest.fixture(scope='session')
+def simulated_movie(tmp_path_factory):
+
+    ''' A small simulated movie with its classified features measured on the ground truth labels. Returns a
+    dictionary with the movie directory, frames, tracking features and track_param.'''
+
+    path = str(tmp_path_factory.mktemp('movie'))
+    frames = 15
+
+    file_list, label_files = simulatemovie.write_movie(path, frames=frames, nuclei=25, division_rate=0.03, step=3.,
+                                                       seed=3)[:2]
+
+    with h5py.File(os.path.join(path, 'params.hdf5'), 'r') as params:
+        track_param = params['track_param'][...]
+        training = {'data': params['training']['data'][...], 'tracking': params['training']['tracking'][...]}
+
+    movie = movieobj.MovieObj(file_list)
+    features = featuretable.FeatureTable()
+
+    for i in range(frames):
+        frame_feats, new_label = extractfeats.frame_job(movie, False, i, loadimages.loadlabel(label_files[i]))
+        extractfeats.add_frame(features, frame_feats, new_label)
+
+    features = classifycells.classifycells(features, training)
+
+    return {'path': path, 'frames': frames, 'features': np.asarray(features['tracking'], dtype=float),
+            'track_param': track_param}
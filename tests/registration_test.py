@@ -0,0 +1,39 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from nuclitrack.nuclitrack_tools import featuretable as ft
+from nuclitrack.nuclitrack_tools import registration
+
+
+def test_phase_correlation(simulated_movie):
+
+    image = np.asarray(Image.open(os.path.join(simulated_movie['path'], 'ch1_t0000.tif')), dtype=float)
+    shifted = np.roll(image, (-7, 12), axis=(0, 1))  # 12 pixels along x and -7 along y
+
+    x, y = registration.phase_correlation(image, shifted)
+
+    assert abs(x - 12) < 0.5 and abs(y + 7) < 0.5
+
+
+def test_centroid_offsets(simulated_movie):
+
+    # Drift of each frame several times the max movement distance
+
+    features = simulated_movie['features'].copy()
+    radius = simulated_movie['track_param'][1]
+
+    drift = np.array([3.2 * radius, -2.5 * radius])
+    offsets = np.arange(simulated_movie['frames'])[:, np.newaxis] * drift
+
+    frame = features[1:, ft.FRAME].astype(int)
+    features[1:, ft.X] += offsets[frame, 0]
+    features[1:, ft.Y] += offsets[frame, 1]
+
+    found = registration.centroid_offsets(features, simulated_movie['frames'], radius)
+
+    # The cells move randomly, so the median movement of each frame only estimates the drift to about the step size,
+    # finding the wrong neighbours would be off by the spacing of the nuclei
+
+    assert np.all(np.abs(np.diff(found - offsets, axis=0)) < 2.)
@@ -0,0 +1,143 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('ctooltracking')
+
+from nuclitrack.nuclitrack_tools import featuretable as ft
+from nuclitrack.nuclitrack_tools import trackcells
+from nuclitrack.nuclitrack_tools import trackevaluate
+
+
+def detections(rows):
+
+    return np.asarray(rows, dtype=float).reshape(-1, 4)
+
+
+# Two cells that do not move, [frame, cell, x, y]
+
+CELLS = detections([[i, cell, x, x] for i in range(4) for cell, x in [(1, 10.), (2, 50.)]])
+LINEAGE = np.asarray([[1, 0, 0, 3], [2, 0, 0, 3]], dtype=float)
+
+
+def test_perfect_tracks():
+
+    tracked = CELLS.copy()
+    tracked[:, 1] += 6
+
+    metrics = trackevaluate.evaluate(tracked, np.zeros((0, 2), dtype=int), CELLS, LINEAGE)
+
+    assert metrics['mota'] == 1 and metrics['idf1'] == 1
+    assert metrics['id_switches'] == 0 and metrics['fp'] == 0 and metrics['fn'] == 0
+
+
+def test_mota_and_idf1():
+
+    # Cell 1 switches from track 7 to track 9, cell 2 is missed in the last frame and there is a false positive
+
+    tracked = detections([[0, 7, 10, 10], [1, 7, 10, 10], [2, 9, 10, 10], [3, 9, 10, 10],
+                          [0, 8, 50, 50], [1, 8, 50, 50], [2, 8, 50, 50],
+                          [0, 10, 100, 100]])
+
+    metrics = trackevaluate.evaluate(tracked, np.zeros((0, 2), dtype=int), CELLS, LINEAGE)
+
+    assert (metrics['tp'], metrics['fp'], metrics['fn'], metrics['id_switches']) == (7, 1, 1, 1)
+    assert metrics['mota'] == pytest.approx(1 - 3 / 8.)
+
+    # Cell 1 is identified with track 7 or 9 for 2 frames, cell 2 with track 8 for 3
+
+    assert metrics['idf1'] == pytest.approx(2 * 5 / (8 + 8.))
+
+
+def test_best_assignment():
+
+    # One to one: 1-8 and 2-7 beat the single heaviest pair 1-7
+
+    rows = np.asarray([1, 1, 2, 5])
+    cols = np.asarray([7, 8, 7, 9])
+
+    assert trackevaluate.best_assignment(rows, cols, np.asarray([3., 2., 2., 1.])) == 5.
+
+
+def test_division_f1():
+
+    # Cell 3 divides into 4 and 5 after frame 1, track 1 follows 3 and then 4
+
+    cells = detections([[0, 3, 30, 30], [1, 3, 30, 30], [2, 4, 20, 30], [3, 4, 20, 30], [2, 5, 40, 30],
+                        [3, 5, 40, 30]])
+    lineage = np.asarray([[3, 0, 0, 1], [4, 3, 2, 3], [5, 3, 2, 3]], dtype=float)
+
+    tracked = cells.copy()
+    tracked[:, 1] = [1, 1, 1, 1, 2, 2]
+
+    metrics = trackevaluate.evaluate(tracked, np.asarray([[1, 4]]), cells, lineage)
+    assert (metrics['divisions'], metrics['division_tp'], metrics['division_fp']) == (1, 1, 0)
+    assert metrics['division_f1'] == 1
+
+    # A second division from cell 4, which never divides
+
+    metrics = trackevaluate.evaluate(tracked, np.asarray([[1, 4], [3, 5]]), cells, lineage)
+    assert (metrics['division_tp'], metrics['division_fp']) == (1, 1)
+    assert metrics['division_f1'] == pytest.approx(2 / 3.)
+
+
+def test_iscb_round_trip(tmp_path):
+
+    # Segment k of frame i is a square centred at (x, y), cell 2 divides into 3 and 4 after frame 1
+
+    segments = [(1, 0, 10, 10), (2, 0, 40, 40), (3, 1, 10, 12), (4, 1, 40, 42),
+                (5, 2, 10, 14), (6, 2, 34, 44), (9, 2, 48, 44), (7, 3, 10, 16), (8, 3, 34, 46), (10, 3, 48, 46)]
+
+    labels = np.zeros((4, 60, 60))
+    tracking = np.zeros((11, len(ft.TRACKING_COLUMNS)))
+
+    for segment, frame, x, y in segments:
+        labels[frame, y - 2:y + 3, x - 2:x + 3] = segment
+        tracking[segment, [ft.ID, ft.FRAME, ft.X, ft.Y]] = segment, frame, x, y
+
+    features = {'tracking': tracking, 'data': np.zeros((11, len(ft.DATA_COLUMNS)))}
+
+    # Track 2 continues as one daughter, track 3 starts from segment 4 as the other
+
+    tracks = np.zeros((10, 8))
+    tracks[:, [0, 4]] = [[1, 1], [3, 1], [5, 1], [7, 1], [2, 2], [4, 2], [9, 2], [10, 2], [6, 3], [8, 3]]
+    tracks[:, 5] = tracking[tracks[:, 0].astype(int), ft.FRAME]
+    tracks[8, 3] = 4
+
+    trackcells.save_iscb(features, tracks, str(tmp_path / 'tracks.csv'), labels, 4)
+    tracked, divisions = trackevaluate.load_iscb(str(tmp_path), 4)
+
+    assert tracked.shape[0] == len(segments)
+    assert divisions.shape[0] == 2  # Both daughters start from the parent track
+
+    cells = np.asarray([[frame, {1: 1, 3: 1, 5: 1, 7: 1, 2: 2, 4: 2, 6: 3, 8: 3, 9: 4, 10: 4}[segment], x, y]
+                        for segment, frame, x, y in segments], dtype=float)
+    lineage = np.asarray([[1, 0, 0, 3], [2, 0, 0, 1], [3, 2, 2, 3], [4, 2, 2, 3]], dtype=float)
+
+    metrics = trackevaluate.evaluate(tracked, divisions, cells, lineage)
+
+    assert metrics['mota'] == 1 and metrics['idf1'] == 1
+    assert metrics['division_f1'] == 1
+
+
+def test_run_config_options(simulated_movie, monkeypatch):
+
+    # Options of TrackCells reach the TrackCells of every window and region
+
+    engines = []
+    init = trackcells.TrackCells.__init__
+
+    def record(self, *args, **kwargs):
+        engines.append(kwargs.get('engine'))
+        init(self, *args, **kwargs)
+
+    monkeypatch.setattr(trackcells.TrackCells, '__init__', record)
+
+    configs = [{'name': 'whole'},
+               {'name': 'windows', 'window': 8, 'overlap': 3},
+               {'name': 'regions', 'regions': (2, 2)}]
+
+    for config in configs:
+        trackevaluate.run_config(simulated_movie['features'], simulated_movie['frames'], simulated_movie['track_param'],
+                                 dict(config, engine='lap'))
+
+    assert len(engines) > 3 and set(engines) == {'lap'}
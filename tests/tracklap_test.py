@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('ctooltracking')
+
+from nuclitrack.nuclitrack_tools import featuretable as ft
+from nuclitrack.nuclitrack_tools import trackcells
+from nuclitrack.nuclitrack_tools import trackevaluate
+
+
+@pytest.fixture(scope='module')
+def lap_tracks(simulated_movie):
+
+    tracking_object = trackcells.TrackCells(features=simulated_movie['features'].copy(),
+                                            frames=simulated_movie['frames'],
+                                            track_param=simulated_movie['track_param'], engine='lap')
+    tracking_object.run()
+
+    tracks = tracking_object.get()[0]
+
+    return tracks[tracks[:, 0] != 0, :]
+
+
+def test_tracks_are_valid(simulated_movie, lap_tracks):
+
+    features = simulated_movie['features']
+
+    assert len(np.unique(lap_tracks[:, 0])) == lap_tracks.shape[0]  # Each segment in at most one track
+    assert np.all(lap_tracks[:, 5] == features[lap_tracks[:, 0].astype(int), ft.FRAME])
+    assert np.all(lap_tracks[:, [6, 7]] == 0)  # No swaps
+
+    for track_id in np.unique(lap_tracks[:, 4]):
+
+        track = lap_tracks[lap_tracks[:, 4] == track_id, :]
+        assert np.all(np.diff(track[:, 5]) > 0)  # One segment per frame, in order
+
+        # Only the first segment of a track can have a mitotic parent, tracked in an earlier frame
+
+        assert np.all(track[1:, 3] == 0)
+
+        if track[0, 3] > 0:
+            parent = lap_tracks[lap_tracks[:, 0] == track[0, 3], :]
+            assert parent.shape[0] == 1 and parent[0, 5] < track[0, 5] and parent[0, 4] != track_id
+
+    assert np.count_nonzero(lap_tracks[:, 3]) > 0
+
+
+def test_links_match_ground_truth(simulated_movie, lap_tracks):
+
+    # Segments are matched to the true cells, a link is correct between the same cell or a mother and daughter
+
+    features = simulated_movie['features']
+    cells, lineage = trackevaluate.load_truth(os.path.join(simulated_movie['path'], 'ground_truth.hdf5'))
+
+    detections = np.column_stack((features[:, ft.FRAME], features[:, ft.ID], features[:, ft.X], features[:, ft.Y]))
+    cell = np.concatenate(([0], trackevaluate.match_frames(detections[1:, :], cells, 5.)))
+    mother = dict(zip(lineage[:, 0].tolist(), lineage[:, 1].tolist()))
+
+    true_links = set()
+
+    for frame in range(simulated_movie['frames'] - 1):
+
+        before = np.nonzero(np.logical_and(features[:, ft.FRAME] == frame, cell > 0))[0]
+        after = np.nonzero(np.logical_and(features[:, ft.FRAME] == frame + 1, cell > 0))[0]
+
+        true_links |= set((i, j) for i in before.tolist() for j in after.tolist() if cell[i] == cell[j])
+
+    links = set()
+
+    for track_id in np.unique(lap_tracks[:, 4]):
+        segments = lap_tracks[lap_tracks[:, 4] == track_id, 0].astype(int).tolist()
+        links |= set(zip(segments[:-1], segments[1:]))
+
+    judged = [(i, j) for i, j in links if cell[i] > 0 and cell[j] > 0]
+    correct = [(i, j) for i, j in judged if cell[i] == cell[j] or mother.get(cell[j]) == cell[i]]
+
+    assert len(true_links & links) >= 0.9 * len(true_links)
+    assert len(correct) >= 0.9 * len(judged)
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('ctooltracking')
+
+from nuclitrack.nuclitrack_tools import featuretable as ft
+from nuclitrack.nuclitrack_tools import trackcells
+from nuclitrack.nuclitrack_tools import trackregions
+
+
+def links(tracks):
+
+    # Pairs of consecutive segments of every track
+
+    tracks = tracks[tracks[:, 0] != 0, :]
+    pairs = set()
+
+    for track_id in np.unique(tracks[:, 4]):
+        segments = tracks[tracks[:, 4] == track_id, 0].astype(int).tolist()
+        pairs |= set(zip(segments[:-1], segments[1:]))
+
+    return pairs
+
+
+def test_region_grid(simulated_movie):
+
+    features = simulated_movie['features']
+    x_edges, y_edges = trackregions.region_grid(features, (3, 2))
+    owner = trackregions.region_owner(features, x_edges, y_edges)
+
+    assert owner[0] == -1
+    assert set(owner[1:].tolist()) == set(range(6))
+
+    ix = owner[1:] % 3
+    iy = owner[1:] // 3
+
+    assert np.all(features[1:, ft.X] >= x_edges[ix]) and np.all(features[1:, ft.X] <= x_edges[ix + 1])
+    assert np.all(features[1:, ft.Y] >= y_edges[iy]) and np.all(features[1:, ft.Y] <= y_edges[iy + 1])
+
+
+def test_halo(simulated_movie, monkeypatch):
+
+    features = simulated_movie['features']
+    track_param = simulated_movie['track_param']
+    boxes = []
+
+    def region_features(features, box):
+        boxes.append(box)
+        return features[:1, :], np.zeros(0, dtype=int)
+
+    monkeypatch.setattr(trackregions, 'region_features', region_features)
+
+    trackregions.track_regions(features.copy(), simulated_movie['frames'], track_param, (2, 2), halo=1.,
+                               parallel=False)
+
+    x_edges, y_edges = trackregions.region_grid(features, (2, 2))
+    box = boxes[0]
+
+    assert len(boxes) == 4
+    assert x_edges[0] - box[0] >= track_param[1] and box[1] - x_edges[1] >= track_param[1]
+    assert y_edges[0] - box[2] >= track_param[1] and box[3] - y_edges[1] >= track_param[1]
+
+
+@pytest.mark.parametrize('regions', [(2, 2), (4, 4)])
+def test_regions_match_whole_movie(simulated_movie, regions):
+
+    features = simulated_movie['features']
+
+    tracking_object = trackcells.TrackCells(features=features.copy(), frames=simulated_movie['frames'],
+                                            track_param=simulated_movie['track_param'], incremental=True)
+
+    while tracking_object.addtrack():
+        pass
+
+    for i in range(2):
+        while tracking_object.optimisetrack():
+            pass
+
+    whole = links(tracking_object.get()[0])
+    tracks = trackregions.track_regions(features.copy(), simulated_movie['frames'], simulated_movie['track_param'],
+                                        regions, parallel=False)[0]
+
+    # Cells moving across a region boundary are joined as in the whole movie
+
+    x_edges, y_edges = trackregions.region_grid(features, regions)
+    owner = trackregions.region_owner(features, x_edges, y_edges)
+    crossing = set(pair for pair in whole if owner[pair[0]] != owner[pair[1]])
+
+    assert len(crossing) > 0
+    assert crossing <= links(tracks)
+    assert len(whole & links(tracks)) >= 0.95 * len(whole)
+
+    # Merged parts never share a frame
+
+    for track_id in np.unique(tracks[:, 4]):
+        frames = tracks[tracks[:, 4] == track_id, 5]
+        assert len(np.unique(frames)) == len(frames)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('ctooltracking')
+
+from nuclitrack.nuclitrack_tools import trackcells
+
+
+@pytest.mark.parametrize('mitosis_threshold', [None, 0.3])
+def test_incremental_matches_forward_pass(simulated_movie, mitosis_threshold):
+
+    # Every incremental update, after tracks are added, removed and swapped, must equal a full forward pass
+
+    tracking_object = trackcells.TrackCells(features=simulated_movie['features'], frames=simulated_movie['frames'],
+                                            track_param=simulated_movie['track_param'], incremental=True,
+                                            mitosis_threshold=mitosis_threshold, stats=True)
+    update = tracking_object.forward_pass
+    checked = []
+
+    def forward_pass():
+
+        score_mat = update()
+        full = trackcells.ctooltracking.forward_pass(tracking_object.score_features, tracking_object.d_mat,
+                                                     tracking_object.s_mat, tracking_object.states,
+                                                     tracking_object.track_param)
+
+        # The swap score of rows without a swap is whatever main_loop left there and is never read
+
+        compared = [score_mat.copy(), full]
+
+        for mat in compared:
+            mat[mat[:, 5] == 0, 6] = 0
+
+        np.testing.assert_array_equal(compared[0], compared[1])
+        checked.append(len(checked))
+
+        return score_mat
+
+    tracking_object.forward_pass = forward_pass
+
+    while tracking_object.addtrack():
+        pass
+
+    added = len(checked)
+
+    while tracking_object.sweeps < 2:
+        tracking_object.optimisetrack()
+
+    assert added > 10
+    assert len(checked) > added
+    assert tracking_object.stats.counters.get('swaps_performed', 0) > 0
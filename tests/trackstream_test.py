@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('ctooltracking')
+
+from nuclitrack.nuclitrack_tools import featuretable as ft
+from nuclitrack.nuclitrack_tools import trackstream
+from nuclitrack.nuclitrack_tools import trackwindows
+
+
+def ordered(tracks):
+
+    return tracks[np.lexsort((tracks[:, 5], tracks[:, 4])), :]
+
+
+@pytest.mark.parametrize('window, overlap', [(6, 2), (5, 3), (15, 4), (20, 4)])
+def test_stream_matches_windows(simulated_movie, window, overlap):
+
+    features = simulated_movie['features']
+    frames = simulated_movie['frames']
+
+    tracks, _, segment_count, double_segment = trackwindows.track_windows(
+        features.copy(), frames, simulated_movie['track_param'], window, overlap, parallel=False)
+
+    tracker = trackstream.StreamTracker(simulated_movie['track_param'], window, overlap)
+    rows = [tracker.add_frame(features[1:][features[1:, ft.FRAME] == i, :]) for i in range(frames)]
+    rows.append(tracker.finish())
+
+    np.testing.assert_array_equal(ordered(np.vstack(rows)), ordered(tracks[1:, :]))
+    assert tracker.segment_count == segment_count - 1  # The placeholder row
+    assert tracker.double_segment == double_segment
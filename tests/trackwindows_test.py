@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('ctooltracking')
+
+from nuclitrack.nuclitrack_tools import trackcells
+from nuclitrack.nuclitrack_tools import trackwindows
+
+
+def by_track(tracks):
+
+    # Tracks as sorted tuples of (segment, mitotic parent, frame), independent of track ids and row order
+
+    tracks = tracks[tracks[:, 0] != 0, :]
+
+    return sorted(tuple(map(tuple, tracks[tracks[:, 4] == i][:, [0, 3, 5]].tolist())) for i in np.unique(tracks[:, 4]))
+
+
+def fragment(track_id, segments, frames):
+
+    rows = np.zeros((len(segments), 8))
+    rows[:, 0] = segments
+    rows[:, 4] = track_id
+    rows[:, 5] = frames
+
+    return rows
+
+
+@pytest.mark.parametrize('options', [{}, {'engine': 'lap'}, {'gap_closing': True}])
+def test_single_window_matches_trackcells(simulated_movie, options):
+
+    features = simulated_movie['features']
+    frames = simulated_movie['frames']
+
+    tracks = trackwindows.track_windows(features.copy(), frames, simulated_movie['track_param'], window=frames + 10,
+                                        overlap=5, parallel=False, **options)[0]
+
+    tracking_object = trackcells.TrackCells(features=features.copy(), frames=frames,
+                                            track_param=simulated_movie['track_param'], incremental=True, **options)
+
+    while tracking_object.addtrack():
+        pass
+
+    for i in range(2):
+        while tracking_object.optimisetrack():
+            pass
+
+    assert by_track(tracks) == by_track(tracking_object.get()[0])
+
+
+def test_stitch_keeps_overlap_rows():
+
+    # Windows of frames 0-5 and 4-9 overlap in frames 4 and 5 and switch at frame 5
+
+    bounds = [(0, 6), (4, 10)]
+
+    first = np.vstack((fragment(1, [10, 11, 12, 13, 14, 15], range(6)),
+                       fragment(2, [21, 22, 23, 24, 25], range(1, 6))))
+
+    # Track 1 continues, a new track starts in the overlap, and two fragments share segment 24 of track 2
+
+    second = np.vstack((fragment(1, [14, 15, 16, 17, 18, 19], range(4, 10)),
+                        fragment(2, [34, 35, 36, 37], range(4, 8)),
+                        fragment(3, [24, 25, 26], range(4, 7)),
+                        fragment(4, [24, 45, 46], range(4, 7))))
+
+    tracks = trackwindows.stitch_tracks([first, second], bounds)
+    tracks = tracks[tracks[:, 0] != 0, :]
+
+    stitched = dict((int(track[0, 0]), track[:, 0].astype(int).tolist())
+                    for track in [tracks[tracks[:, 4] == i, :] for i in np.unique(tracks[:, 4])])
+
+    assert stitched[10] == [10, 11, 12, 13, 14, 15, 16, 17, 18, 19]
+    assert stitched[21] == [21, 22, 23, 24, 25, 26]
+    assert stitched[34] == [34, 35, 36, 37]  # Starts before the switch and keeps its overlap rows
+    assert stitched[45] == [45, 46]  # Segment 24 before the switch stays with track 2